@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""Benchmark suite of the import completion pipeline.
+
+Generates synthetic sys.path layouts and times, for each of them, the module
+scan (`ModuleScanner`), and `module_matches` and `complete` for every
+keystroke of scripted typing sequences.
+
+Layouts:
+  flat        one directory with many modules and packages
+  deep        a deep tree of nested packages
+  extensions  extension modules with every suffix in SUFFIXES
+  zip         a zip archive with packages, like an egg or zipapp
+
+The results are reported as described in runner.py, named after the
+layout and what was timed, e.g. "flat scan".
+
+Usage: python benchmarks/bench_import_pipeline.py [--json] [--repeat=N]
+                                                  [--scale=N] [layout ...]
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bpython import importcompletion
+
+import runner
+
+
+def touch(filename):
+    open(filename, 'w').close()
+
+
+def make_flat(root, scale):
+    """`scale` * 2000 modules and `scale` * 200 packages of 10 modules."""
+    os.makedirs(root)
+    for i in range(scale * 2000):
+        touch(os.path.join(root, 'flatmod%d.py' % (i, )))
+    for i in range(scale * 200):
+        package = os.path.join(root, 'flatpkg%d' % (i, ))
+        os.makedirs(package)
+        touch(os.path.join(package, '__init__.py'))
+        for j in range(10):
+            touch(os.path.join(package, 'mod%d.py' % (j, )))
+    return [root], ['import flatmod1999', 'from flatpkg15 import mod7',
+                    'import flatpkg150.mod3']
+
+
+def _make_tree(directory, depth, fanout):
+    touch(os.path.join(directory, '__init__.py'))
+    for i in range(fanout):
+        touch(os.path.join(directory, 'mod%d.py' % (i, )))
+    if depth:
+        for i in range(fanout):
+            subdir = os.path.join(directory, 'sub%d' % (i, ))
+            os.makedirs(subdir)
+            _make_tree(subdir, depth - 1, fanout)
+
+
+def make_deep(root, scale):
+    """A package tree 6 levels deep with 3 * `scale` subpackages each."""
+    os.makedirs(os.path.join(root, 'deeppkg'))
+    _make_tree(os.path.join(root, 'deeppkg'), 5, 3 * scale)
+    return [root], ['import deeppkg.sub1.sub2.sub0.sub1.mod2',
+                    'from deeppkg.sub2.sub2 import mod1']
+
+
+def make_extensions(root, scale):
+    """`scale` * 500 modules for every suffix in SUFFIXES."""
+    os.makedirs(root)
+    for i in range(scale * 500):
+        for j, suffix in enumerate(importcompletion.SUFFIXES):
+            touch(os.path.join(root, 'ext%d_%d%s' % (j, i, suffix)))
+    return [root], ['import ext0_499', 'import ext1_42']
+
+
+def make_zip(root, scale):
+    """A zip archive with `scale` * 200 packages of 10 modules."""
+    os.makedirs(root)
+    filename = os.path.join(root, 'site.zip')
+    archive = zipfile.ZipFile(filename, 'w')
+    try:
+        for i in range(scale * 200):
+            archive.writestr('zippkg%d/__init__.py' % (i, ), '')
+            for j in range(10):
+                archive.writestr('zippkg%d/mod%d.py' % (i, j), '')
+    finally:
+        archive.close()
+    return [filename], ['import zippkg199.mod9', 'from zippkg20 import mod1']
+
+
+LAYOUTS = [
+    ('flat', make_flat),
+    ('deep', make_deep),
+    ('extensions', make_extensions),
+    ('zip', make_zip),
+]
+
+
+def keystrokes(line):
+    """Every prefix of `line` after 'import ' or 'from ', as typed."""
+    start = line.index(' ') + 1
+    return [line[:i] for i in range(start + 1, len(line) + 1)]
+
+
+def run_layout(name, make, tmpdir, repeat, scale):
+    path, sequences = make(os.path.join(tmpdir, name), scale)
+    results = []
+
+    def reset():
+        importcompletion.modules = importcompletion.ModuleIndex()
+
+    def scan():
+        scanner = importcompletion.ModuleScanner(path)
+        scanner.start()
+        scanner.join()
+
+    best, mean, _ = runner.timed(scan, repeat, setup=reset)
+    results.append(runner.result('%s scan' % (name, ), best, mean, repeat,
+                                 modules=len(importcompletion.modules)))
+
+    lines = [line for sequence in sequences for line in keystrokes(sequence)]
+
+    def matches():
+        for line in lines:
+            word = line.split()[-1]
+            importcompletion.module_matches(word)
+
+    def complete():
+        for line in lines:
+            importcompletion.complete(len(line), line)
+
+    for benchmark, function in (('module_matches', matches),
+                                ('complete', complete)):
+        best, mean, _ = runner.timed(function, repeat)
+        results.append(runner.result('%s %s' % (name, benchmark), best, mean,
+                                     repeat, keystrokes=len(lines),
+                                     per_keystroke=best / len(lines)))
+    return results
+
+
+def run(repeat, options, names):
+    layouts = [(name, make) for name, make in LAYOUTS
+               if not names or name in names]
+
+    # Neither the module cache nor a background scan must interfere
+    importcompletion.cache_path = None
+    importcompletion.scanner = None
+
+    results = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, make in layouts:
+            results.extend(run_layout(name, make, tmpdir, repeat,
+                                      options['scale']))
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+if __name__ == '__main__':
+    runner.main(run, dict(scale=1))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""Benchmark of the import completion module scan.
+
+Builds a synthetic site-packages directory and compares the time of a cold
+scan (no module cache) to the time of a warm scan (module cache filled by a
+previous session), and the time of the threaded scan with one worker to the
+time with one worker per CPU.
+
+The results are reported as described in runner.py.
+
+Usage: python benchmarks/bench_importcompletion.py [--json] [--repeat=N]
+           [--packages=N] [--modules=N]
+"""
+
+from __future__ import print_function
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bpython import importcompletion
+
+import runner
+
+
+def make_site_packages(root, packages, modules_per_package):
+    # Old enough for the module cache to trust the mtimes
+    mtime = time.time() - 60
+    for i in range(packages):
+        package = os.path.join(root, 'pkg%d' % (i, ))
+        os.makedirs(package)
+        open(os.path.join(package, '__init__.py'), 'w').close()
+        for j in range(modules_per_package):
+            open(os.path.join(package, 'mod%d.py' % (j, )), 'w').close()
+        os.utime(package, (mtime, mtime))
+    os.utime(root, (mtime, mtime))
+
+
+def scan():
+    scanner = importcompletion.ModuleScanner()
+    scanner.start()
+    scanner.join()
+
+
+def threaded_scan(site, workers):
+    scanner = importcompletion.ModuleScanner([site], workers)
+    scanner.start()
+    scanner.join()
+
+
+def run(repeat, options, arguments):
+    packages = options['packages']
+    tmpdir = tempfile.mkdtemp()
+    orig_path = sys.path
+    try:
+        site = os.path.join(tmpdir, 'site-packages')
+        make_site_packages(site, packages, options['modules'])
+        importcompletion.cache_path = os.path.join(tmpdir, 'modules.cache')
+
+        def reset():
+            importcompletion.modules = importcompletion.ModuleIndex()
+
+        def remove_cache():
+            reset()
+            if os.path.exists(importcompletion.cache_path):
+                os.remove(importcompletion.cache_path)
+
+        sys.path = [site]
+        try:
+            cold, cold_mean, _ = runner.timed(scan, repeat, remove_cache)
+            found = len(importcompletion.modules)
+            warm, warm_mean, _ = runner.timed(scan, repeat, reset)
+        finally:
+            sys.path = orig_path
+        results = [
+            runner.result('cold scan', cold, cold_mean, repeat,
+                          modules=found, packages=packages),
+            runner.result('warm cache', warm, warm_mean, repeat,
+                          speedup=cold / warm),
+        ]
+
+        importcompletion.cache_path = None
+        workers = multiprocessing.cpu_count()
+        single, single_mean, _ = runner.timed(
+            lambda: threaded_scan(site, 1), repeat, reset)
+        parallel, parallel_mean, _ = runner.timed(
+            lambda: threaded_scan(site, workers), repeat, reset)
+        results.extend([
+            runner.result('threaded scan, 1 worker', single, single_mean,
+                          repeat, workers=1),
+            runner.result('threaded scan, 1 worker per CPU', parallel,
+                          parallel_mean, repeat, workers=workers,
+                          speedup=single / parallel),
+        ])
+        return results
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    runner.main(run, dict(packages=300, modules=10))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""Benchmark of the line analysis done by the completers for a keystroke.
+
+Types scripted lines one character at a time and completes every prefix
+with all of bpython's completers, counting the calls of the functions which
+find a part of the line, and timing the completion. This is done twice:
+
+  shared    the completers share a LineContext per keystroke, whose parts
+            are found by bpython.line's LineScanner, as bpython does
+  unshared  every lookup of a part of the line calls the function in
+            regexline.py, which matches its regular expressions over the
+            line again, as the completers did before sharing a LineContext
+
+The results are reported as described in runner.py, named after the mode.
+
+Usage: python benchmarks/bench_line_analysis.py [--json] [--repeat=N]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bpython import autocomplete
+from bpython import importcompletion
+from bpython import line as lineparts
+
+import regexline
+import runner
+
+LINES = [
+    'import os.path',
+    'from collections import OrderedDict',
+    'result = sorted(data.keys(), key=len)',
+    'data["some key"].append(value)',
+    'open("/usr/lib/python/site.py").read()',
+    '"abc".upper().startswith(prefix)',
+    'def method(self, first, second=None):',
+]
+
+NAMESPACE = {
+    'data': {'some key': [], 'other key': []},
+    'value': 1,
+    'prefix': 'ab',
+    'os': os,
+}
+
+SCANNERS = ['current_word', 'current_dict_key', 'current_dict',
+            'current_string', 'current_from_import_from',
+            'current_from_import_import', 'current_import',
+            'current_method_definition_name', 'current_single_word',
+            'current_string_literal_attr']
+
+
+def keystrokes():
+    """Every prefix of every line in LINES, as typed."""
+    return [line[:i] for line in LINES for i in range(1, len(line) + 1)]
+
+
+class UnsharedContext(lineparts.LineContext):
+    """A LineContext which looks for a part every time it is asked for,
+    with the function of regexline of the same name."""
+
+    def _part(self, function):
+        return getattr(regexline, function.__name__)(self.cursor_offset,
+                                                     self.line)
+
+    def tokens(self):
+        return self.line.split()
+
+    def current_from_import_from(self):
+        # The function checks the tokens itself
+        return self._part(lineparts.current_from_import_from)
+
+
+class Counter(object):
+
+    def __init__(self, module):
+        self.module = module
+        self.scans = 0
+        self.originals = dict()
+
+    def install(self):
+        for name in SCANNERS:
+            function = self.originals[name] = getattr(self.module, name)
+            setattr(self.module, name, self.counting(function))
+
+    def counting(self, function):
+        def counted(cursor_offset, line):
+            self.scans += 1
+            return function(cursor_offset, line)
+        return counted
+
+    def uninstall(self):
+        for name, function in self.originals.items():
+            setattr(self.module, name, function)
+
+
+def complete(lines):
+    for line in lines:
+        autocomplete.get_completer_bpython(
+            cursor_offset=len(line), line=line, locals_=NAMESPACE,
+            argspec=None, current_block=line, complete_magic_methods=True)
+
+
+def run_mode(mode, lines, repeat):
+    context = lineparts.context
+    if mode == 'unshared':
+        lineparts.context = UnsharedContext
+        counter = Counter(regexline)
+    else:
+        counter = Counter(lineparts)
+    counter.install()
+    try:
+        complete(lines)
+        scans = counter.scans
+        best, mean, _ = runner.timed(lambda: complete(lines), repeat)
+    finally:
+        counter.uninstall()
+        lineparts.context = context
+    return runner.result(mode, best, mean, repeat, keystrokes=len(lines),
+                         scans=scans,
+                         scans_per_keystroke=float(scans) / len(lines))
+
+
+def run(repeat, options, arguments):
+    # Neither the module cache nor a background scan must interfere
+    importcompletion.cache_path = None
+    importcompletion.scanner = None
+
+    lines = keystrokes()
+    return [run_mode(mode, lines, repeat) for mode in ('unshared', 'shared')]
+
+
+if __name__ == '__main__':
+    runner.main(run)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Benchmark of finding the parts of adversarial long lines.
+
+For lines of doubling length, times asking for every part of the line at
+the end of it, in two modes:
+
+  scanner   with a new bpython.line.LineScanner for every line
+  regex     with the functions of regexline.py, the regular expressions
+            bpython.line used to match, some of which backtrack over the
+            rest of the line from every position they fail at
+
+The growth is the time for a line divided by the time for a line half as
+long: about 2 where the time is linear in the length of the line, about 4
+where it is quadratic.
+
+The results are reported as described in runner.py, named after the line,
+the mode and the length, e.g. "name scanner 1000".
+
+Usage: python benchmarks/bench_line_scanner.py [--json] [--repeat=N]
+                                               [--max-length=N]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bpython import line as lineparts
+
+import regexline
+import runner
+
+# How the lines are made of n characters
+LINES = [
+    ('name', lambda n: 'a' * n),
+    ('dotted name', lambda n: 'a.' * (n // 2)),
+    ('escaped quotes', lambda n: '"' + "\\'" * (n // 2)),
+    ('strings', lambda n: "x'" * (n // 2)),
+    ('imports', lambda n: 'from a import b, ' * (n // 17)),
+]
+
+PARTS = ['current_word', 'current_dict_key', 'current_dict',
+         'current_string', 'current_from_import_from',
+         'current_from_import_import', 'current_import',
+         'current_method_definition_name', 'current_single_word',
+         'current_string_literal_attr']
+
+
+def scanner(line):
+    scanner = lineparts.LineScanner(line)
+    for part in PARTS:
+        getattr(scanner, part)(len(line))
+
+
+def regex(line):
+    for part in PARTS:
+        getattr(regexline, part)(len(line), line)
+
+
+def run_line(name, make_line, mode, lengths, repeat):
+    results = []
+    function = scanner if mode == 'scanner' else regex
+    previous = None
+    for length in lengths:
+        line = make_line(length)
+        best, mean, _ = runner.timed(lambda: function(line), repeat)
+        results.append(runner.result('%s %s %d' % (name, mode, length),
+                                     best, mean, repeat, length=len(line),
+                                     growth=runner.growth(best, previous)))
+        previous = best
+    return results
+
+
+def run(repeat, options, arguments):
+    lengths = []
+    length = 1000
+    while length <= options['max_length']:
+        lengths.append(length)
+        length *= 2
+
+    results = []
+    for name, make_line in LINES:
+        for mode in ('regex', 'scanner'):
+            results.extend(run_line(name, make_line, mode, lengths, repeat))
+    return results
+
+
+if __name__ == '__main__':
+    runner.main(run, dict(max_length=16000))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Micro-benchmark of module name lookups.
+
+Compares the linear scan formerly done by importcompletion.module_matches
+with the lookups of importcompletion.ModuleIndex on a synthetic index of
+500k dotted module names.
+
+The results are reported as described in runner.py.
+
+Usage: python benchmarks/bench_module_index.py [--json] [--repeat=N]
+                                               [--names=N]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bpython.importcompletion import ModuleIndex
+
+import runner
+
+
+def synthetic_names(count):
+    names = []
+    i = 0
+    while len(names) < count:
+        package = 'pkg%d' % (i, )
+        names.append(package)
+        for j in range(50):
+            subpackage = '%s.sub%d' % (package, j)
+            names.append(subpackage)
+            names.extend('%s.mod%d' % (subpackage, k) for k in range(9))
+        i += 1
+    return names[:count]
+
+
+def linear_matches(names, full):
+    return [name for name in names
+            if name.startswith(full) and name.find('.', len(full)) == -1]
+
+
+def run(repeat, options, arguments):
+    names = synthetic_names(options['names'])
+    as_set = set(names)
+    best, mean, index = runner.timed(lambda: ModuleIndex(names), 1)
+    results = [runner.result('build index', best, mean, 1,
+                             names=len(index))]
+
+    for prefix in ('pkg1', 'pkg10.', 'pkg10.sub1', 'pkg10.sub10.', 'zzz'):
+        best, mean, matches = runner.timed(
+            lambda: linear_matches(as_set, prefix), repeat)
+        results.append(runner.result('linear %r' % (prefix, ), best, mean,
+                                     repeat, matches=len(matches)))
+        best, mean, matches = runner.timed(lambda: index.matches(prefix),
+                                           repeat, number=100)
+        results.append(runner.result('index %r' % (prefix, ), best, mean,
+                                     repeat, matches=len(matches)))
+
+    def insert():
+        index.update('extra%d.mod' % (i, ) for i in range(1000))
+        index.matches('extra')
+
+    best, mean, _ = runner.timed(insert, 1)
+    results.append(runner.result('insert 1000 names', best, mean, 1))
+    return results
+
+
+if __name__ == '__main__':
+    runner.main(run, dict(names=500000))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Benchmark of the classification of directory entries during the module
+scan.
+
+Builds a synthetic package directory and compares `_scan_directory`, which
+classifies the entries from one directory listing, to probing every entry
+with `imp.find_module`, as the module scan used to do. Both must find the
+same modules.
+
+To compare the syscalls, run the benchmark under strace with only one of the
+classifiers, e.g.
+
+  strace -c -f python benchmarks/bench_scan_directory.py --only=listing
+  strace -c -f python benchmarks/bench_scan_directory.py --only=imp
+
+The results are reported as described in runner.py.
+
+Usage: python benchmarks/bench_scan_directory.py [--json] [--repeat=N]
+           [--only=listing|imp] [--entries=N]
+"""
+
+from __future__ import print_function
+
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bpython import importcompletion
+
+import runner
+
+
+def make_package(root, entries):
+    os.makedirs(root)
+    open(os.path.join(root, '__init__.py'), 'w').close()
+    for i in range(entries):
+        kind = i % 4
+        if kind == 0:
+            os.makedirs(os.path.join(root, 'sub%d' % (i, )))
+            open(os.path.join(root, 'sub%d' % (i, ), '__init__.py'),
+                 'w').close()
+        elif kind == 1:
+            open(os.path.join(root, 'data%d.txt' % (i, )), 'w').close()
+        else:
+            open(os.path.join(root, 'mod%d.py' % (i, )), 'w').close()
+
+
+def imp_scan_directory(path):
+    """The classification by probing every entry with imp.find_module."""
+    names = set()
+    packages = set()
+    for name in os.listdir(path):
+        if not any(name.endswith(suffix)
+                   for suffix in importcompletion.SUFFIXES):
+            if '.' in name:
+                continue
+        elif os.path.isdir(os.path.join(path, name)):
+            continue
+        for suffix in importcompletion.SUFFIXES:
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+                break
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', ImportWarning)
+                fo, _, _ = imp.find_module(name, [path])
+        except (ImportError, IOError, SyntaxError, UnicodeEncodeError):
+            continue
+        if fo is not None:
+            fo.close()
+        else:
+            packages.add(name)
+        names.add(name)
+    return names, packages
+
+
+def listing_scan_directory(path):
+    """The classification from one listing per directory. Packages are
+    recognised by listing the candidate directories as well."""
+    _, names, subdirs = importcompletion._scan_directory(path)
+    names = set(names)
+    packages = set()
+    for name in subdirs:
+        if importcompletion._scan_directory(os.path.join(path, name))[0]:
+            packages.add(name)
+    names.update(packages)
+    return names, packages
+
+
+CLASSIFIERS = [
+    ('imp', 'imp.find_module probing', imp_scan_directory),
+    ('listing', 'directory listing', listing_scan_directory),
+]
+
+
+def run(repeat, options, arguments):
+    entries = options['entries']
+    tmpdir = tempfile.mkdtemp()
+    try:
+        package = os.path.join(tmpdir, 'pkg')
+        make_package(package, entries)
+        results = []
+        found = []
+        for key, name, scan_directory in CLASSIFIERS:
+            if options['only'] and options['only'] != key:
+                continue
+            best, mean, result = runner.timed(
+                lambda: scan_directory(package), repeat)
+            results.append(runner.result(name, best, mean, repeat,
+                                         entries=entries))
+            found.append(result)
+        if found and found.count(found[0]) != len(found):
+            print('results differ!', file=sys.stderr)
+        return results
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    runner.main(run, dict(only='', entries=2000))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Benchmark of formatting the tokens of a line for the curtsies frontend.
+
+For lines of doubling numbers of tokens, times making the FmtStr of the
+lexed line twice:
+
+  parse      bpythonparse(format(tokens, BPythonFormatter(...))), building a
+             string of \\x01..\\x04 delimited segments and peeling it apart
+             again, as the curtsies frontend did before TokenFormatter
+  direct     TokenFormatter(...).format(tokens), as it does now
+
+The growth is the time for a line divided by the time for a line with half
+as many tokens: about 2 where the time is linear in the length of the line,
+about 4 where it is quadratic.
+
+The results are reported as described in runner.py, named after the mode
+and the number of tokens, e.g. "direct 100".
+
+Usage: python benchmarks/bench_token_formatting.py [--json] [--repeat=N]
+                                                   [--max-tokens=N]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pygments import format
+
+from bpython._py3compat import PythonLexer
+from bpython.config import Struct, loadini, default_config_path
+from bpython.curtsiesfrontend.parse import parse, TokenFormatter
+from bpython.formatter import BPythonFormatter
+
+import runner
+
+SOURCE = u'result = f(a, "b", 1.5) '
+
+
+def make_tokens(n):
+    """n tokens of SOURCE repeated, without the newline the lexer adds"""
+    tokens = list(PythonLexer().get_tokens(SOURCE))[:-1]
+    return (tokens * (n // len(tokens) + 1))[:n]
+
+
+def run_mode(mode, counts, repeat, color_scheme):
+    if mode == 'parse':
+        formatter = BPythonFormatter(color_scheme)
+        function = lambda tokens: parse(format(tokens, formatter))
+    else:
+        function = TokenFormatter(color_scheme).format
+    results = []
+    previous = None
+    for count in counts:
+        tokens = make_tokens(count)
+        best, mean, _ = runner.timed(lambda: function(tokens), repeat)
+        results.append(runner.result('%s %d' % (mode, len(tokens)), best,
+                                     mean, repeat, tokens=len(tokens),
+                                     growth=runner.growth(best, previous)))
+        previous = best
+    return results
+
+
+def run(repeat, options, arguments):
+    config = Struct()
+    loadini(config, default_config_path())
+
+    counts = []
+    count = 25
+    while count <= options['max_tokens']:
+        counts.append(count)
+        count *= 2
+
+    results = []
+    for mode in ('parse', 'direct'):
+        results.extend(run_mode(mode, counts, repeat, config.color_scheme))
+    return results
+
+
+if __name__ == '__main__':
+    runner.main(run, dict(max_tokens=3200))
@@ -0,0 +1,138 @@
+"""Command line and output shared by the benchmarks.
+
+Every benchmark is run as
+
+  python benchmarks/bench_<name>.py [--json] [--repeat=N] [--<option>=VALUE]
+                                    [argument ...]
+
+where the options and arguments are those of the benchmark, and prints its
+results as a table, or with --json as a JSON document which can be stored to
+track regressions over time:
+
+  {"benchmark": "import_pipeline", "python": "2.7.18",
+   "implementation": "CPython", "platform": ..., "time": ..., "repeat": 5,
+   "options": {"scale": 1}, "arguments": [], "results": [
+      {"name": "flat scan", "runs": 5, "best": 0.012, "mean": 0.013,
+       "metrics": {"modules": 4200}}, ...]}
+
+The `name` of a result identifies it across runs of the benchmark, `best`
+and `mean` are in seconds, and `metrics` holds whatever else the benchmark
+counted or computed for it.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import platform
+import sys
+import time
+
+
+def timed(function, repeat, setup=None, number=1):
+    """Time `repeat` runs of calling `function` `number` times, calling
+    `setup` before each run without timing it. Returns the best and the
+    mean time of a call, and the result of the last call."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.time()
+        for _ in range(number):
+            result = function()
+        times.append((time.time() - start) / number)
+    return min(times), sum(times) / len(times), result
+
+
+def result(name, best, mean, runs, **metrics):
+    """Return the result `name` in the form every benchmark reports."""
+    return dict(name=name, best=best, mean=mean, runs=runs, metrics=metrics)
+
+
+def growth(best, previous):
+    """The growth of the time `best` over the time `previous` for an input
+    half as large: about 2 where the time is linear in the size of the
+    input, about 4 where it is quadratic. None without a previous time."""
+    if not previous:
+        return None
+    return best / previous
+
+
+def _format_metric(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return '%.3g' % (value, )
+    return str(value)
+
+
+def _parse_args(args, options, usage):
+    as_json = False
+    repeat = 5
+    options = dict(options)
+    arguments = []
+    for arg in args:
+        if arg == '--json':
+            as_json = True
+            continue
+        if not arg.startswith('--'):
+            arguments.append(arg)
+            continue
+        option, _, value = arg[2:].partition('=')
+        option = option.replace('-', '_')
+        try:
+            if option == 'repeat':
+                repeat = int(value)
+            elif option in options:
+                options[option] = type(options[option])(value)
+            else:
+                raise ValueError(option)
+        except ValueError:
+            sys.exit(usage)
+    return as_json, repeat, options, arguments
+
+
+def main(run, options=None):
+    """Run the benchmark of the calling script: parse `sys.argv`, call
+    `run(repeat, options, arguments)`, which returns a list of results made
+    by `result`, and print them.
+
+    `options` maps the names of the options of the benchmark to their
+    default values, whose types the values given are converted to. The
+    usage printed for invalid options is taken from the "Usage:" line of
+    the docstring of the script."""
+    benchmark = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    if benchmark.startswith('bench_'):
+        benchmark = benchmark[len('bench_'):]
+    if options is None:
+        options = dict()
+    doc = sys.modules['__main__'].__doc__ or ''
+    if 'Usage: ' in doc:
+        usage = doc[doc.index('Usage: '):].rstrip()
+    else:
+        usage = 'Usage: %s [--json] [--repeat=N]%s' % (
+            sys.argv[0], ''.join(' [--%s=%s]' % (name.replace('_', '-'),
+                                                 name.upper())
+                                 for name in sorted(options)))
+    as_json, repeat, options, arguments = _parse_args(sys.argv[1:], options,
+                                                      usage)
+    results = run(repeat, options, arguments)
+
+    if as_json:
+        json.dump(dict(benchmark=benchmark,
+                       python=platform.python_version(),
+                       implementation=platform.python_implementation(),
+                       platform=platform.platform(), time=time.time(),
+                       repeat=repeat, options=options, arguments=arguments,
+                       results=results),
+                  sys.stdout, indent=2, sort_keys=True)
+        print()
+        return
+
+    width = max([len(r['name']) for r in results] + [0])
+    for r in results:
+        metrics = '  '.join('%s %s' % (name, _format_metric(value))
+                            for name, value in sorted(r['metrics'].items()))
+        print('%-*s  best %9.4fms  mean %9.4fms  %s' % (
+            width, r['name'], r['best'] * 1000, r['mean'] * 1000, metrics))
@@ -24,24 +24,29 @@
 import __builtin__
 import __main__
 import abc
+import bisect
+import collections
+import itertools
 import keyword
+import logging
 import os
 import re
 import rlcompleter
-
-from glob import glob
+import sys
+import threading
+import time
+import weakref
 
 from bpython import inspection
 from bpython import importcompletion
 from bpython import line as lineparts
+from bpython import matching
+from bpython import staticnames
 from bpython._py3compat import py3
-
 # Autocomplete modes
-SIMPLE = 'simple'
-SUBSTRING = 'substring'
-FUZZY = 'fuzzy'
+from bpython.matching import SIMPLE, SUBSTRING, FUZZY, ALL_MODES
 
-ALL_MODES = (SIMPLE, SUBSTRING, FUZZY)
+logger = logging.getLogger(__name__)
 
 MAGIC_METHODS = ("__%s__" % s for s in (
     "init", "repr", "str", "lt", "le", "eq", "ne", "gt", "ge", "cmp", "hash",
@@ -56,11 +61,29 @@ def after_last_dot(name):
     return name.rstrip('.').rsplit('.')[-1]
 
 
+def _matched_part(match):
+    """The part of a match which was matched against the word, without the
+    dotted expression before it and the `(` or `=` after it."""
+    return match.rpartition('.')[2].rstrip('(=')
+
+
 class BaseCompletionType(object):
     """Describes different completion types"""
 
-    def __init__(self, shown_before_tab=True):
+    # Whether the time the completion type takes is limited by a
+    # CompletionBudget
+    budgeted = True
+
+    # Whether the last matches were cut short, because there were too many
+    truncated = False
+
+    # How many matches are ranked at most in substring and fuzzy mode, the
+    # others are listed sorted after them
+    max_ranked = 500
+
+    def __init__(self, shown_before_tab=True, mode=SIMPLE):
         self._shown_before_tab = shown_before_tab
+        self._mode = mode
 
     def matches(self, cursor_offset, line, **kwargs):
         """Returns a list of possible matches given a line and cursor, or None
@@ -83,9 +106,66 @@ class BaseCompletionType(object):
         if no target for this type of completion is found under the cursor"""
         raise NotImplementedError
 
+    def applies(self, cursor_offset, line):
+        """Whether matches() returns matches rather than None, found without
+        looking for the matches"""
+        return self.locate(cursor_offset, line) is not None
+
     def format(self, word):
         return word
 
+    def rank(self, cursor_offset, line, matches):
+        """Returns the matches in the order they are shown to the user:
+        sorted, or best match first in substring and fuzzy mode."""
+        if self._mode == SIMPLE:
+            return sorted(matches)
+        r = self.locate(cursor_offset, line)
+        if r is None:
+            return sorted(matches)
+        return matching.rank(matches, r[2].rpartition('.')[2], self._mode,
+                             key=_matched_part, limit=self.max_ranked)
+
+    def narrow(self, matches, word):
+        """Returns the matches for a word `word` extends which also match
+        `word`, see `narrowing_key`."""
+        if self._mode == SIMPLE:
+            return set(match for match in matches if match.startswith(word))
+        start = word.rfind('.') + 1
+        text = word[start:]
+        return set(match for match in matches
+                   if matching.is_match(match[start:], text, self._mode))
+
+    def narrowing_key(self, cursor_offset, line):
+        """Returns what the matches depend on besides the namespace and the
+        word being completed, together with that word, or None.
+
+        If the key is the same as for an earlier completion and the word
+        extends the earlier one, the matches are found by filtering the
+        earlier matches (see `CompletionCache`). Completion types which don't
+        support this return None."""
+        return None
+
+    def _dotted_narrowing_key(self, cursor_offset, line):
+        """Narrowing key for completion types whose matches are the
+        candidates for the part of the word before the last dot which start
+        with the word, except for private names unless asked for."""
+        r = self.locate(cursor_offset, line)
+        if r is None:
+            return None
+        start, end, word = r
+        head = word[:word.rfind('.') + 1]
+        private = word[len(head):].startswith('_')
+        return (line[:start], head, private), word
+
+    def budget_target(self, cursor_offset, line, locals_=None):
+        """Returns what the time this completion type takes depends on,
+        besides the completion type itself, or None.
+
+        Completion types which evaluate the expression before the cursor
+        return the object it starts with, so that they can be disabled for
+        slow objects only (see `CompletionBudget`)."""
+        return None
+
     def substitute(self, cursor_offset, line, match):
         """Returns a cursor offset and line with match swapped in"""
         start, end, word = self.locate(cursor_offset, line)
@@ -101,12 +181,15 @@ class BaseCompletionType(object):
 class CumulativeCompleter(BaseCompletionType):
     """Returns combined matches from several completers"""
 
-    def __init__(self, completers):
+    # the completers are limited one by one instead
+    budgeted = False
+
+    def __init__(self, completers, mode=SIMPLE):
         if not completers:
             raise ValueError("CumulativeCompleter requires at least one completer")
         self._completers = completers
 
-        super(CumulativeCompleter, self).__init__(True)
+        super(CumulativeCompleter, self).__init__(True, mode)
 
     def locate(self, current_offset, line):
         return self._completers[0].locate(current_offset, line)
@@ -114,17 +197,29 @@ class CumulativeCompleter(BaseCompletionType):
     def format(self, word):
         return self._completers[0].format(word)
 
-    def matches(self, cursor_offset, line, locals_, argspec, current_block, complete_magic_methods):
+    def rank(self, cursor_offset, line, matches):
+        for completer in self._completers:
+            if completer.locate(cursor_offset, line) is not None:
+                return completer.rank(cursor_offset, line, matches)
+        return sorted(matches)
+
+    def matches(self, cursor_offset, line, locals_, argspec, current_block,
+                complete_magic_methods, cache=None, namespace_generation=None,
+                budget=None):
         all_matches = set()
         for completer in self._completers:
             # these have to be explicitely listed to deal with the different
             # signatures of various matches() methods of completers
-            matches = completer.matches(cursor_offset=cursor_offset,
-                                        line=line,
-                                        locals_=locals_,
-                                        argspec=argspec,
-                                        current_block=current_block,
-                                        complete_magic_methods=complete_magic_methods)
+            matches = _matches(completer,
+                               cursor_offset=cursor_offset,
+                               line=line,
+                               locals_=locals_,
+                               argspec=argspec,
+                               current_block=current_block,
+                               complete_magic_methods=complete_magic_methods,
+                               cache=cache,
+                               namespace_generation=namespace_generation,
+                               budget=budget)
             if matches is not None:
                 all_matches.update(matches)
 
@@ -134,29 +229,144 @@ class CumulativeCompleter(BaseCompletionType):
 class ImportCompletion(BaseCompletionType):
 
     def matches(self, cursor_offset, line, **kwargs):
-        return importcompletion.complete(cursor_offset, line)
+        return importcompletion.complete(cursor_offset, line, self._mode)
 
     def locate(self, current_offset, line):
-        return lineparts.current_word(current_offset, line)
+        return lineparts.context(current_offset, line).current_word()
+
+    def applies(self, cursor_offset, line):
+        context = lineparts.context(cursor_offset, line)
+        return (context.current_word() is not None and
+                (context.current_from_import_from() is not None or
+                 bool(context.current_import())))
 
     def format(self, word):
         return after_last_dot(word)
 
+    def narrowing_key(self, cursor_offset, line):
+        key = self._dotted_narrowing_key(cursor_offset, line)
+        if key is None:
+            return None
+        # The known modules change while they are searched
+        context, word = key
+        return (context, len(importcompletion.modules), len(sys.modules)), word
+
+class StaticImportCompletion(ImportCompletion):
+    """Completes `from module import <name>` if module was not imported yet,
+    with the names found in its source code."""
+
+    def matches(self, cursor_offset, line, **kwargs):
+        names = staticnames.complete(cursor_offset, line, self._mode)
+        if names is None:
+            return None
+        matches = set(names)
+        matches.update(importcompletion.complete(cursor_offset, line,
+                                                 self._mode) or ())
+        return matches
+
+    def applies(self, cursor_offset, line):
+        context = lineparts.context(cursor_offset, line)
+        from_part = context.current_from_import_from()
+        return (from_part is not None and
+                context.current_from_import_import() is not None and
+                from_part[2] not in sys.modules and
+                not from_part[2].startswith('.'))
+
+class DirectoryListings(object):
+    """Sorted listings of directories, to find the files starting with a
+    prefix by bisection.
+
+    A listing is used until the mtime of its directory changes, and at most
+    `max_directories` listings are kept. Whether an entry is a directory is
+    only looked up when the entry is returned by `matches`, as every lookup
+    is a stat() call, and remembered for as long as the listing is."""
+
+    def __init__(self, max_directories=32):
+        self.max_directories = max_directories
+        # For each directory, its mtime, sorted entries, whether each entry
+        # is a directory (None if not looked up yet), and when the listing
+        # was used last
+        self.listings = dict()
+        self._clock = 0
+
+    def listing(self, directory):
+        """Returns the mtime, sorted entries and is-dir flags of
+        `directory`, or None if it can't be listed."""
+        try:
+            mtime = os.stat(directory).st_mtime
+        except EnvironmentError:
+            return None
+        self._clock += 1
+        listing = self.listings.get(directory)
+        if listing is not None and listing[0] == mtime:
+            listing[3] = self._clock
+            return listing
+        try:
+            names = sorted(os.listdir(directory))
+        except EnvironmentError:
+            return None
+        # A file created in the same second as the listing may not change a
+        # coarse-grained mtime, so a listing that recent is not trusted
+        if time.time() - mtime < 2:
+            mtime = None
+        listing = [mtime, names, [None] * len(names), self._clock]
+        if (directory not in self.listings and
+                len(self.listings) >= self.max_directories):
+            oldest = min(self.listings, key=lambda d: self.listings[d][3])
+            del self.listings[oldest]
+        self.listings[directory] = listing
+        return listing
+
+    def matches(self, directory, prefix, limit=None):
+        """Returns the entries of `directory` starting with `prefix`, as
+        (name, is_dir) tuples, and whether there were more than `limit`.
+        Hidden entries are only returned if `prefix` starts with a dot."""
+        listing = self.listing(directory)
+        if listing is None:
+            return [], False
+        mtime, names, is_dir, _ = listing
+        result = []
+        i = bisect.bisect_left(names, prefix)
+        while i < len(names) and names[i].startswith(prefix):
+            name = names[i]
+            if prefix or not name.startswith('.'):
+                if limit is not None and len(result) == limit:
+                    return result, True
+                if is_dir[i] is None:
+                    is_dir[i] = os.path.isdir(os.path.join(directory, name))
+                result.append((name, is_dir[i]))
+            i += 1
+        return result, False
+
+    def clear(self):
+        self.listings.clear()
+
+
 class FilenameCompletion(BaseCompletionType):
 
+    # How many filenames are listed at most
+    max_matches = 500
+
     def __init__(self):
         super(FilenameCompletion, self).__init__(False)
+        self.listings = DirectoryListings()
 
     def matches(self, cursor_offset, line, **kwargs):
-        cs = lineparts.current_string(cursor_offset, line)
+        cs = lineparts.context(cursor_offset, line).current_string()
         if cs is None:
             return None
         start, end, text = cs
         matches = set()
         username = text.split(os.path.sep, 1)[0]
         user_dir = os.path.expanduser(username)
-        for filename in glob(os.path.expanduser(text + '*')):
-            if os.path.isdir(filename):
+        expanded = os.path.expanduser(text)
+        head = expanded[:expanded.rfind(os.path.sep) + 1]
+        entries, truncated = self.listings.matches(
+            head or os.curdir, expanded[len(head):], self.max_matches)
+        self.truncated = truncated
+        for name, is_dir in entries:
+            filename = head + name
+            if is_dir:
                 filename += os.path.sep
             if text.startswith('~'):
                 filename = username + filename[len(user_dir):]
@@ -164,7 +374,7 @@ class FilenameCompletion(BaseCompletionType):
         return matches
 
     def locate(self, current_offset, line):
-        return lineparts.current_string(current_offset, line)
+        return lineparts.context(current_offset, line).current_string()
 
     def format(self, filename):
         filename.rstrip(os.sep).rsplit(os.sep)[-1]
@@ -192,7 +402,7 @@ class AttrCompletion(BaseCompletionType):
                 break
         methodtext = text[-i:]
         matches = set(''.join([text[:-i], m])
-                      for m in attr_matches(methodtext, locals_))
+                      for m in attr_matches(methodtext, locals_, self._mode))
 
         #TODO add open paren for methods via _callable_prefix (or decide not to)
         # unless the first character is a _ filter out all attributes starting with a _
@@ -202,35 +412,146 @@ class AttrCompletion(BaseCompletionType):
         return matches
 
     def locate(self, current_offset, line):
-        return lineparts.current_dotted_attribute(current_offset, line)
+        return lineparts.context(current_offset,
+                                 line).current_dotted_attribute()
 
     def format(self, word):
         return after_last_dot(word)
 
+    def narrowing_key(self, cursor_offset, line):
+        return self._dotted_narrowing_key(cursor_offset, line)
+
+    def budget_target(self, cursor_offset, line, locals_=None):
+        r = self.locate(cursor_offset, line)
+        if r is None:
+            return None
+        return _expression_target(r[2].rpartition('.')[0], locals_)
+
+class KeyIndex(object):
+    """The sorted reprs of the keys of a mapping, to find the ones starting
+    with a prefix by bisection. At most `max_keys` keys are indexed;
+    `truncated` tells whether the mapping has more."""
+
+    def __init__(self, mapping, max_keys):
+        self.length = len(mapping)
+        reprs = []
+        for key in itertools.islice(_iterkeys(mapping), max_keys):
+            try:
+                reprs.append(repr(key))
+            except Exception:
+                pass
+        reprs.sort()
+        self.reprs = reprs
+        self.truncated = self.length > max_keys
+
+    def matches(self, prefix, limit=None):
+        """Returns the reprs starting with `prefix`, and whether there were
+        more than `limit`."""
+        reprs = self.reprs
+        start = end = bisect.bisect_left(reprs, prefix)
+        while end < len(reprs) and reprs[end].startswith(prefix):
+            if limit is not None and end - start == limit:
+                return reprs[start:end], True
+            end += 1
+        return reprs[start:end], False
+
+
+def _iterkeys(mapping):
+    """Iterates over the keys of `mapping` without making a list of them if
+    possible."""
+    if isinstance(mapping, dict) and not py3:
+        return mapping.iterkeys()
+    elif isinstance(mapping, (dict, collections.Mapping)):
+        return iter(mapping)
+    return iter(mapping.keys())
+
+
+def _is_mapping(obj):
+    """Whether `obj` is a mapping, or at least has keys() and __len__
+    methods, found without looking up attributes of obj."""
+    if isinstance(obj, dict) or issubclass(type(obj), collections.Mapping):
+        return True
+    attributes = inspection.class_attributes(type(obj))
+    return 'keys' in attributes and '__len__' in attributes
+
+
 class DictKeyCompletion(BaseCompletionType):
 
-    def matches(self, cursor_offset, line, locals_, **kwargs):
+    # How many keys of a mapping are indexed at most
+    max_keys = 100000
+    # How many keys are listed at most
+    max_matches = 500
+
+    def __init__(self, shown_before_tab=True, mode=SIMPLE):
+        super(DictKeyCompletion, self).__init__(shown_before_tab, mode)
+        # For the id of each mapping completed in, a weak reference to it
+        # and its KeyIndex. Dicts can't be weakly referenced, so for the
+        # last of these its id, the expression and the namespace generation
+        # it was found with, and its index are kept instead.
+        self._indexes = dict()
+        self._last = None
+
+    def matches(self, cursor_offset, line, locals_, namespace_generation=None,
+                **kwargs):
         r = self.locate(cursor_offset, line)
         if r is None:
             return None
         start, end, orig = r
-        _, _, dexpr = lineparts.current_dict(cursor_offset, line)
+        _, _, dexpr = lineparts.context(cursor_offset, line).current_dict()
         try:
             obj = safe_eval(dexpr, locals_)
         except EvaluationError:
             return set()
-        if obj and isinstance(obj, type({})) and obj.keys():
-            return set("{!r}".format(k) for k in obj.keys()
-                       if repr(k).startswith(orig))
-        else:
+        if not _is_mapping(obj):
+            return set()
+        try:
+            index = self._index(obj, (dexpr, namespace_generation))
+        except Exception:
+            # len() or the keys of a mapping-like object failed
             return set()
+        matches, truncated = index.matches(orig, self.max_matches)
+        self.truncated = truncated or index.truncated
+        return set(matches)
+
+    def _index(self, mapping, key=(None, None)):
+        """Returns the KeyIndex of `mapping`, made again if its length
+        changed. Mappings which can't be weakly referenced are identified
+        by their id and `key`, the expression they were found with and the
+        namespace generation; their index is only kept while the generation
+        stays the same, and not at all without one."""
+        index = None
+        entry = self._indexes.get(id(mapping))
+        if entry is not None and entry[0]() is mapping:
+            index = entry[1]
+        elif (self._last is not None and key[1] is not None and
+                self._last[:2] == (id(mapping), key)):
+            index = self._last[2]
+        if index is not None and index.length == len(mapping):
+            return index
+
+        index = KeyIndex(mapping, self.max_keys)
+        mapping_id = id(mapping)
+        try:
+            ref = weakref.ref(mapping,
+                              lambda ref: self._indexes.pop(mapping_id, None))
+        except TypeError:
+            self._last = (mapping_id, key, index)
+        else:
+            self._indexes[mapping_id] = (ref, index)
+        return index
 
     def locate(self, current_offset, line):
-        return lineparts.current_dict_key(current_offset, line)
+        return lineparts.context(current_offset, line).current_dict_key()
 
     def format(self, match):
         return match[:-1]
 
+    def budget_target(self, cursor_offset, line, locals_=None):
+        r = lineparts.context(cursor_offset, line).current_dict()
+        if r is None:
+            return None
+        return _expression_target(r[2], locals_)
+
 class MagicMethodCompletion(BaseCompletionType):
 
     def matches(self, cursor_offset, line, current_block, **kwargs):
@@ -243,11 +564,87 @@ class MagicMethodCompletion(BaseCompletionType):
         return set(name for name in MAGIC_METHODS if name.startswith(word))
 
     def locate(self, current_offset, line):
-        return lineparts.current_method_definition_name(current_offset, line)
+        return lineparts.context(current_offset,
+                                 line).current_method_definition_name()
+
+class NamespaceIndex(object):
+    """The keywords, builtins and names in a namespace, sorted in a
+    MatchIndex, and whether their values are callable.
+
+    `update` brings the index up to date with a namespace by comparing it
+    with the names and their values seen last time, by identity,
+    so only the names added, removed or rebound since then are indexed
+    again. With a `namespace_generation`, that is only done once code was
+    run in the namespace."""
+
+    def __init__(self):
+        self.names = matching.MatchIndex(keyword.kwlist)
+        # For the builtins and the namespace, the value of each name when
+        # last updated, and the callable postfixes of the values looked up
+        # since. The values themselves are kept rather than their ids, as a
+        # new value may reuse the id of the one it replaced.
+        self._values = (dict(), dict())
+        self._postfixes = (dict(), dict())
+        self._key = None
+        self.lock = threading.Lock()
+
+    def update(self, locals_, namespace_generation=None):
+        """Update the index with the names in `locals_`."""
+        key = (id(locals_), namespace_generation, len(locals_),
+               len(__builtin__.__dict__))
+        if namespace_generation is not None and key == self._key:
+            return
+        self._update(0, __builtin__.__dict__)
+        self._update(1, locals_)
+        self._key = key
+
+    def _update(self, which, namespace):
+        values = self._values[which]
+        postfixes = self._postfixes[which]
+        items = list(namespace.items())
+        changed = [(name, value) for name, value in items
+                   if name not in values or values[name] is not value]
+        added = [name for name, _ in changed if name not in values]
+        values.update(changed)
+        for name, _ in changed:
+            postfixes.pop(name, None)
+        removed = []
+        if len(values) != len(items):
+            removed = [name for name in values if name not in namespace]
+            for name in removed:
+                del values[name]
+                postfixes.pop(name, None)
+
+        if len(added) + len(removed) > len(self.names) // 4:
+            self.names = matching.MatchIndex(keyword.kwlist +
+                                             list(self._values[0]) +
+                                             list(self._values[1]))
+            return
+        for name in added:
+            self.names.add(name)
+        other = self._values[1 - which]
+        for name in removed:
+            if name not in other and not keyword.iskeyword(name):
+                self.names.remove(name)
+
+    def postfix(self, which, name, value):
+        """Returns '(' if `value`, the value of `name` in the builtins
+        (`which` is 0) or the namespace (1), is callable, otherwise ''."""
+        postfixes = self._postfixes[which]
+        postfix = postfixes.get(name)
+        if postfix is None:
+            postfix = postfixes[name] = _callable_postfix(value, '')
+        return postfix
+
 
 class GlobalCompletion(BaseCompletionType):
 
-    def matches(self, cursor_offset, line, locals_, **kwargs):
+    def __init__(self, shown_before_tab=True, mode=SIMPLE):
+        super(GlobalCompletion, self).__init__(shown_before_tab, mode)
+        self._index = NamespaceIndex()
+
+    def matches(self, cursor_offset, line, locals_, namespace_generation=None,
+                **kwargs):
         """Compute matches when text is a simple name.
         Return a list of all keywords, built-in functions and names currently
         defined in self.namespace that match.
@@ -257,19 +654,25 @@ class GlobalCompletion(BaseCompletionType):
             return None
         start, end, text = r
 
+        index = self._index
         matches = set()
-        n = len(text)
-        for word in keyword.kwlist:
-            if method_match(word, n, text):
-                matches.add(word)
-        for nspace in [__builtin__.__dict__, locals_]:
-            for word, val in nspace.items():
-                if method_match(word, len(text), text) and word != "__builtins__":
-                    matches.add(_callable_postfix(val, word))
+        with index.lock:
+            index.update(locals_, namespace_generation)
+            for word in index.names.matches(text, self._mode):
+                if keyword.iskeyword(word):
+                    matches.add(word)
+                for which, nspace in enumerate([__builtin__.__dict__,
+                                                locals_]):
+                    if word in nspace and word != "__builtins__":
+                        matches.add(word + index.postfix(which, word,
+                                                         nspace[word]))
         return matches
 
     def locate(self, current_offset, line):
-        return lineparts.current_single_word(current_offset, line)
+        return lineparts.context(current_offset, line).current_single_word()
+
+    def narrowing_key(self, cursor_offset, line):
+        return self._dotted_narrowing_key(cursor_offset, line)
 
 class ParameterNameCompletion(BaseCompletionType):
 
@@ -281,16 +684,17 @@ class ParameterNameCompletion(BaseCompletionType):
             return None
         start, end, word = r
         if argspec:
-            matches = set(name + '=' for name in argspec[1][0]
-                          if isinstance(name, basestring) and
-                          name.startswith(word))
+            names = [name for name in argspec[1][0]
+                     if isinstance(name, basestring)]
             if py3:
-                matches.update(name + '=' for name in argspec[1][4]
-                               if name.startswith(word))
+                names.extend(argspec[1][4])
+            matches = set(name + '='
+                          for name in matching.filter_names(names, word,
+                                                            self._mode))
         return matches
 
     def locate(self, current_offset, line):
-        return lineparts.current_word(current_offset, line)
+        return lineparts.context(current_offset, line).current_word()
 
 class StringLiteralAttrCompletion(BaseCompletionType):
 
@@ -306,7 +710,178 @@ class StringLiteralAttrCompletion(BaseCompletionType):
         return matches
 
     def locate(self, current_offset, line):
-        return lineparts.current_string_literal_attr(current_offset, line)
+        return lineparts.context(current_offset,
+                                 line).current_string_literal_attr()
+
+
+class CompletionCache(object):
+    """Remembers the matches of every completer for the last word completed.
+
+    When the user types more characters of the same word, only the earlier
+    matches still starting with the word can match, so they are filtered
+    instead of computing the matches from scratch. That is only done if the
+    completer's `narrowing_key` and the namespace are the same as before:
+    the namespace is identified by the locals and `namespace_generation`,
+    which needs to change whenever code is run in it."""
+
+    def __init__(self):
+        self.entries = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def matches(self, completer, cursor_offset, line, **kwargs):
+        """Like `completer.matches`, filtering earlier matches if possible."""
+        generation = kwargs.get('namespace_generation')
+        narrowing = None
+        if generation is not None:
+            narrowing = completer.narrowing_key(cursor_offset, line)
+        if narrowing is None:
+            return completer.matches(cursor_offset, line, cache=self, **kwargs)
+
+        context, word = narrowing
+        key = (type(completer), context, id(kwargs.get('locals_')), generation)
+        entry = self.entries.get(completer)
+        if entry is not None and entry[0] == key and word.startswith(entry[1]):
+            self.hits += 1
+            matches = completer.narrow(entry[2], word)
+        else:
+            self.misses += 1
+            matches = completer.matches(cursor_offset, line, cache=self,
+                                        **kwargs)
+        logger.debug('completion cache: %d hits, %d misses',
+                     self.hits, self.misses)
+        if matches is None:
+            self.entries.pop(completer, None)
+        else:
+            self.entries[completer] = (key, word, matches)
+        return matches
+
+    def clear(self):
+        self.entries.clear()
+
+
+class CompletionBudget(object):
+    """Circuit breaker for completers which take too long.
+
+    Python can't interrupt a completer once it's running, e.g. while it
+    calls dir() on a lazy proxy object, but it can avoid running it again.
+    Each completer gets `deadline` seconds. Once it took longer than that
+    `strikes` times in a row, it is disabled for `cooldown` seconds: for the
+    object it evaluated if it evaluates one (see
+    `BaseCompletionType.budget_target`), otherwise completely.
+
+    The completers skipped are collected for the frontends to tell the user,
+    see `take_skipped`."""
+
+    def __init__(self, deadline=0.2, strikes=2, cooldown=60.0):
+        self.deadline = deadline
+        self.strikes = strikes
+        self.cooldown = cooldown
+        # For each key, the number of deadlines missed in a row
+        self.overruns = dict()
+        # For each key of a disabled completer, when it's enabled again
+        self.disabled = dict()
+        self.skipped = []
+        self.lock = threading.Lock()
+
+    def _key(self, completer, cursor_offset, line, locals_):
+        try:
+            target = completer.budget_target(cursor_offset, line, locals_)
+        except Exception:
+            target = None
+        return type(completer), target
+
+    def matches(self, completer, cursor_offset, line, cache=None, **kwargs):
+        """Like `_matches`, unless the completer is disabled: then the
+        completer is skipped, and no matches are returned if it applies to
+        the line, None if it doesn't."""
+        if not completer.budgeted:
+            # the completers it combines are limited instead
+            return self._run(completer, cursor_offset, line, cache,
+                             budget=self, **kwargs)
+        key = self._key(completer, cursor_offset, line, kwargs.get('locals_'))
+        with self.lock:
+            until = self.disabled.get(key)
+            if until is not None and time.time() >= until:
+                del self.disabled[key]
+                until = None
+        if until is not None:
+            if not completer.applies(cursor_offset, line):
+                return None
+            with self.lock:
+                self.skipped.append(key)
+            return []
+
+        start = time.time()
+        try:
+            return self._run(completer, cursor_offset, line, cache, **kwargs)
+        finally:
+            self.record(key, time.time() - start)
+
+    def _run(self, completer, cursor_offset, line, cache, **kwargs):
+        if cache is None:
+            return completer.matches(cursor_offset, line, **kwargs)
+        return cache.matches(completer, cursor_offset, line, **kwargs)
+
+    def record(self, key, elapsed):
+        """Count a completion of completer and target `key` which took
+        `elapsed` seconds."""
+        with self.lock:
+            if elapsed <= self.deadline:
+                self.overruns.pop(key, None)
+                return
+            overruns = self.overruns.get(key, 0) + 1
+            if overruns < self.strikes:
+                self.overruns[key] = overruns
+                return
+            self.overruns.pop(key, None)
+            self.disabled[key] = time.time() + self.cooldown
+        logger.debug('disabling %s for %r: took %.2fs', key[0].__name__,
+                     key[1], elapsed)
+
+    def take_skipped(self):
+        """Returns descriptions of the completers skipped since the last
+        call, like 'AttrCompletion for session.query'."""
+        with self.lock:
+            skipped, self.skipped = self.skipped, []
+        descriptions = []
+        for completer_type, target in skipped:
+            description = completer_type.__name__
+            if target is not None:
+                description += ' for %s%s' % target[1:]
+            if description not in descriptions:
+                descriptions.append(description)
+        return descriptions
+
+    def reset(self):
+        with self.lock:
+            self.overruns.clear()
+            self.disabled.clear()
+            self.skipped = []
+
+
+def _expression_target(expr, locals_):
+    """Budget target of a completion evaluating `expr`: the type of the
+    object its first name refers to, the name and the rest of `expr`. Only
+    the first name is looked up, as evaluating more may be what is slow."""
+    m = re.match(r'\s*([A-Za-z_]\w*)', expr)
+    if m is None:
+        return None
+    if locals_ is None:
+        locals_ = __main__.__dict__
+    name = m.group(1)
+    obj = locals_.get(name, getattr(__builtin__, name, None))
+    return type(obj), name, expr[m.end():].strip()
+
+
+def _matches(completer, cursor_offset, line, cache=None, budget=None,
+             **kwargs):
+    if budget is not None:
+        return budget.matches(completer, cursor_offset, line, cache=cache,
+                              **kwargs)
+    if cache is None:
+        return completer.matches(cursor_offset, line, **kwargs)
+    return cache.matches(completer, cursor_offset, line, **kwargs)
 
 
 def get_completer(completers, cursor_offset, line, **kwargs):
@@ -324,27 +899,47 @@ def get_completer(completers, cursor_offset, line, **kwargs):
             code which the current line is part of
         complete_magic_methods is a bool of whether we ought to complete
             double underscore methods like __len__ in method signatures
+
+    optional kwargs:
+        cache is a CompletionCache to narrow down earlier matches with
+        namespace_generation changes whenever code was run in locals_
+        budget is a CompletionBudget to skip completers which were too slow
     """
 
     for completer in completers:
-        matches = completer.matches(cursor_offset, line, **kwargs)
+        matches = _matches(completer, cursor_offset, line, **kwargs)
         if matches is not None:
-            return sorted(matches), (completer if matches else None)
+            return (completer.rank(cursor_offset, line, matches),
+                    (completer if matches else None))
     return [], None
 
-BPYTHON_COMPLETER = (
-    DictKeyCompletion(),
-    StringLiteralAttrCompletion(),
-    ImportCompletion(),
-    FilenameCompletion(),
-    MagicMethodCompletion(),
-    GlobalCompletion(),
-    CumulativeCompleter((AttrCompletion(), ParameterNameCompletion()))
-)
-
-def get_completer_bpython(**kwargs):
-    """"""
-    return get_completer(BPYTHON_COMPLETER,
+# The completers for each autocomplete mode, see get_default_completer()
+_default_completers = dict()
+
+def get_default_completer(mode=SIMPLE):
+    """Returns the completers bpython uses, matching names in `mode`"""
+    completers = _default_completers.get(mode)
+    if completers is None:
+        completers = _default_completers[mode] = (
+            DictKeyCompletion(),
+            StringLiteralAttrCompletion(),
+            StaticImportCompletion(mode=mode),
+            ImportCompletion(mode=mode),
+            FilenameCompletion(),
+            MagicMethodCompletion(),
+            GlobalCompletion(mode=mode),
+            CumulativeCompleter((AttrCompletion(mode=mode),
+                                 ParameterNameCompletion(mode=mode)),
+                                mode=mode)
+        )
+    return completers
+
+BPYTHON_COMPLETER = get_default_completer(SIMPLE)
+
+def get_completer_bpython(mode=SIMPLE, **kwargs):
+    """Returns matches and the completer like get_completer, using the
+    completers for autocomplete `mode`"""
+    return get_completer(get_default_completer(mode),
                          **kwargs)
 
 
@@ -364,13 +959,10 @@ def safe_eval(expr, namespace):
 
 attr_matches_re = re.compile(r"(\w+(\.\w+)*)\.(\w*)")
 
-def attr_matches(text, namespace):
+def attr_matches(text, namespace, mode=SIMPLE):
     """Taken from rlcompleter.py and bent to my will.
     """
 
-    # Gna, Py 2.6's rlcompleter searches for __call__ inside the
-    # instance instead of the type, so we monkeypatch to prevent
-    # side-effects (__getattr__/__getattribute__)
     m = attr_matches_re.match(text)
     if not m:
         return []
@@ -384,36 +976,43 @@ def attr_matches(text, namespace):
         obj = safe_eval(expr, namespace)
     except EvaluationError:
         return []
-    with inspection.AttrCleaner(obj):
-        matches = attr_lookup(obj, expr, attr)
-    return matches
+    return attr_lookup(obj, expr, attr, mode)
 
-def attr_lookup(obj, expr, attr):
-    """Second half of original attr_matches method factored out so it can
-    be wrapped in a safe try/finally block in case anything bad happens to
-    restore the original __getattribute__ method."""
-    words = dir(obj)
-    if hasattr(obj, '__class__'):
-        words.append('__class__')
-        words = words + rlcompleter.get_class_members(obj.__class__)
-        if not isinstance(obj.__class__, abc.ABCMeta):
-            try:
-                words.remove('__abstractmethods__')
-            except ValueError:
-                pass
+def _dir_attributes(obj):
+    """The attributes of `obj` as found by dir() and rlcompleter."""
+    with inspection.AttrCleaner(obj):
+        words = dir(obj)
+        if hasattr(obj, '__class__'):
+            words.append('__class__')
+            words = words + rlcompleter.get_class_members(obj.__class__)
+    return set(words)
+
+def attr_lookup(obj, expr, attr, mode=SIMPLE):
+    """Second half of original attr_matches method. Unless the class of obj
+    provides attributes through __dir__, __getattr__ or __getattribute__,
+    the attributes are found without running any code of obj, see
+    inspection.static_attributes."""
+    words = None
+    if inspection.has_attribute_hooks(obj):
+        try:
+            words = _dir_attributes(obj)
+        except Exception:
+            pass
+    if words is None:
+        words = inspection.static_attributes(obj)
+    if not isinstance(type(obj), abc.ABCMeta):
+        words.discard('__abstractmethods__')
 
     matches = []
-    n = len(attr)
-    for word in words:
-        if method_match(word, n, attr) and word != "__builtins__":
+    for word in matching.filter_names(words, attr, mode):
+        if word != "__builtins__":
             matches.append("%s.%s" % (expr, word))
     return matches
 
 def _callable_postfix(value, word):
     """rlcompleter's _callable_postfix done right."""
-    with inspection.AttrCleaner(value):
-        if inspection.is_callable(value):
-            word += '('
+    if inspection.is_callable_static(value):
+        word += '('
     return word
 
 def method_match(word, size, text):
@@ -70,6 +70,7 @@ from bpython.formatter import BPythonFormatter
 
 # This for completion
 from bpython import importcompletion
+from bpython import staticnames
 
 # This for config
 from bpython.config import Struct
@@ -1769,7 +1770,7 @@ def idle(caller):
     sure it happens conveniently."""
     global DO_RESIZE
 
-    if importcompletion.find_coroutine() or caller.paste_mode:
+    if caller.paste_mode:
         caller.scr.nodelay(True)
         key = caller.scr.getch()
         caller.scr.nodelay(False)
@@ -1921,6 +1922,8 @@ def main_curses(scr, args, config, interactive=True, locals_=None,
     if banner is not None:
         clirepl.write(banner)
         clirepl.write('\n')
+    staticnames.cache.start()
+    importcompletion.start_scan(config.module_indexing)
     exit_value = clirepl.repl()
     if hasattr(sys, 'exitfunc'):
         sys.exitfunc()
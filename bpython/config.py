@@ -7,8 +7,10 @@ from ConfigParser import ConfigParser
 from itertools import chain
 from bpython.keys import cli_key_dispatch as key_dispatch
 from bpython.autocomplete import SIMPLE as default_completion
+from bpython.importcompletion import EAGER as default_module_indexing
 
 import bpython.autocomplete
+import bpython.importcompletion
 
 class Struct(object):
     """Simple class for instantiating objects we can add arbitrary attributes
@@ -52,6 +54,7 @@ def loadini(struct, configfile):
             'hist_file': '~/.pythonhist',
             'hist_length': 100,
             'hist_duplicates': True,
+            'module_indexing': default_module_indexing,
             'paste_time': 0.02,
             'syntax': True,
             'tab_length': 4,
@@ -101,6 +104,7 @@ def loadini(struct, configfile):
             'trim_prompts': False,
         },
         'curtsies': {
+            'highlight_cache_size': 100000,
             'list_above' : False,
             'right_arrow_completion' : True,
         }}
@@ -191,8 +195,11 @@ def loadini(struct, configfile):
     struct.complete_magic_methods = config.getboolean('general',
                                                       'complete_magic_methods')
     struct.autocomplete_mode = config.get('general', 'autocomplete_mode')
+    struct.module_indexing = config.get('general', 'module_indexing')
     struct.save_append_py = config.getboolean('general', 'save_append_py')
 
+    struct.curtsies_highlight_cache_size = config.getint('curtsies',
+                                                        'highlight_cache_size')
     struct.curtsies_list_above = config.getboolean('curtsies', 'list_above')
     struct.curtsies_right_arrow_completion = config.getboolean('curtsies',
                                                                'right_arrow_completion')
@@ -244,6 +251,10 @@ def loadini(struct, configfile):
     if struct.autocomplete_mode not in bpython.autocomplete.ALL_MODES:
         struct.autocomplete_mode = default_completion
 
+    # verify module indexing policy
+    if struct.module_indexing not in bpython.importcompletion.ALL_POLICIES:
+        struct.module_indexing = default_module_indexing
+
     # set box drawing characters
     if config.getboolean('general', 'unicode_box'):
         struct.left_border = u'│'
@@ -14,7 +14,8 @@ from bpython.curtsiesfrontend.repl import Repl
 from bpython.curtsiesfrontend.coderunner import SystemExitFromCodeGreenlet
 from bpython import args as bpargs
 from bpython.translations import _
-from bpython.importcompletion import find_iterator
+from bpython import importcompletion
+from bpython import staticnames
 from bpython.curtsiesfrontend import events as bpythonevents
 
 logger = logging.getLogger(__name__)
@@ -69,6 +70,8 @@ def main(args=None, locals_=None, banner=None):
     mainloop(config, locals_, banner, interp, paste, interactive=(not exec_args))
 
 def mainloop(config, locals_, banner, interp=None, paste=None, interactive=True):
+    # before the completion and module scan threads are started
+    staticnames.cache.start()
     with curtsies.input.Input(keynames='curtsies', sigint_event=True) as input_generator:
         with curtsies.window.CursorAwareWindow(
                 sys.stdout,
@@ -80,6 +83,7 @@ def mainloop(config, locals_, banner, interp=None, paste=None, interactive=True)
             request_refresh = input_generator.event_trigger(bpythonevents.RefreshRequestEvent)
             schedule_refresh = input_generator.scheduled_event_trigger(bpythonevents.ScheduledRefreshRequestEvent)
             request_reload = input_generator.threadsafe_event_trigger(bpythonevents.ReloadEvent)
+            request_completions = input_generator.threadsafe_event_trigger(bpythonevents.CompletionsReadyEvent)
             interrupting_refresh = input_generator.threadsafe_event_trigger(lambda: None)
 
             def on_suspend():
@@ -97,6 +101,7 @@ def mainloop(config, locals_, banner, interp=None, paste=None, interactive=True)
                       request_refresh=request_refresh,
                       schedule_refresh=schedule_refresh,
                       request_reload=request_reload,
+                      request_completions=request_completions,
                       get_term_hw=window.get_term_hw,
                       get_cursor_vertical_diff=window.get_cursor_vertical_diff,
                       banner=banner,
@@ -142,10 +147,7 @@ def mainloop(config, locals_, banner, interp=None, paste=None, interactive=True)
                     process_event(paste)
 
                 process_event(None)  # do a display before waiting for first event
-                for _ in find_iterator:
-                    e = input_generator.send(0)
-                    if e is not None:
-                        process_event(e)
+                importcompletion.start_scan(config.module_indexing)
 
                 for e in input_generator:
                     process_event(e)
@@ -0,0 +1,114 @@
+"""For computing completions in a background thread, so that an object with
+a slow __dir__ or a huge namespace doesn't block the keyboard.
+
+Every request gets a generation number. Submitting a request supersedes the
+one waiting or being computed: its result is discarded, and a computation
+which notices that it was superseded stops early.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Cancelled(Exception):
+    """Raised by the check function of a CompletionWorker when the request
+    being computed was superseded or cancelled."""
+
+
+class CompletionWorker(object):
+    """Runs compute(request, check) in a background thread for the most
+    recent request submitted.
+
+    compute is called in the worker thread and should call check() between
+    its steps, which raises Cancelled if the request is stale. When a result
+    is ready, on_ready is called in the worker thread; the result is then
+    collected with take() in the main thread."""
+
+    def __init__(self, compute, on_ready):
+        self.compute = compute
+        self.on_ready = on_ready
+        self.generation = 0
+        self._request = None
+        self._result = None
+        # The generation submitted last, until its result is taken
+        self._pending = None
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def submit(self, request):
+        """Compute the result for `request` instead of any earlier one.
+        Returns the generation of the request."""
+        with self._condition:
+            self.generation += 1
+            self._request = (self.generation, request)
+            self._result = None
+            self._pending = self.generation
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='bpython-completion')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+            return self.generation
+
+    def cancel(self):
+        """Discard the request being computed and its result, if any."""
+        with self._condition:
+            self.generation += 1
+            self._request = None
+            self._result = None
+            self._pending = None
+
+    @property
+    def pending(self):
+        """Whether the result of the last request was not taken yet."""
+        return self._pending is not None
+
+    def take(self):
+        """Return the result of the last request, or None if it isn't ready
+        or was taken already."""
+        with self._condition:
+            result, self._result = self._result, None
+            if result is None or result[0] != self.generation:
+                return None
+            self._pending = None
+            return result[1]
+
+    def stop(self):
+        """Stop the worker thread once it finished what it is computing."""
+        with self._condition:
+            self._stopped = True
+            self._request = None
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._request is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                generation, request = self._request
+                self._request = None
+
+            def check():
+                if generation != self.generation:
+                    raise Cancelled()
+
+            try:
+                result = self.compute(request, check)
+            except Cancelled:
+                logger.debug('completion request %d cancelled', generation)
+                continue
+            except Exception:
+                logger.exception('computing completions failed')
+                continue
+
+            with self._condition:
+                if generation != self.generation:
+                    continue
+                self._result = (generation, result)
+            self.on_ready()
@@ -35,5 +35,10 @@ class ScheduledRefreshRequestEvent(curtsies.events.ScheduledEvent):
         return ("<RefreshRequestEvent from %r for %s seconds from now>" %
                 (self.who, self.when - time.time()))
 
+class CompletionsReadyEvent(curtsies.events.Event):
+    """Request to show the completions computed in the background"""
+    def __repr__(self):
+        return "<CompletionsReadyEvent>"
+
 class RunStartupFileEvent(curtsies.events.Event):
     """Request to run the startup file."""
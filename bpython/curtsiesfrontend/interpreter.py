@@ -73,11 +73,19 @@ class Interp(code.InteractiveInterpreter):
             locals = {"__name__": "__console__", "__doc__": None}
         self.locals = locals
         self.compile = CommandCompiler()
+        # Changes whenever code was run in locals
+        self.generation = 0
 
         # typically changed after being instantiated
         self.write = lambda stuff: sys.stderr.write(stuff)
         self.outfile = self
 
+    def runcode(self, code_obj):
+        try:
+            code.InteractiveInterpreter.runcode(self, code_obj)
+        finally:
+            self.generation += 1
+
     def showsyntaxerror(self, filename=None):
         """Display the syntax error that just occurred.
 
@@ -4,7 +4,7 @@ from bpython._py3compat import PythonLexer
 from bpython.config import Struct, loadini, default_config_path
 
 from curtsies.termformatconstants import FG_COLORS, BG_COLORS, colors
-from curtsies.formatstring import fmtstr, FmtStr
+from curtsies.formatstring import fmtstr, FmtStr, Chunk
 
 from pygments import format
 from functools import partial
@@ -40,6 +40,10 @@ def parse(s):
             else FmtStr())
 
 def fs_from_match(d):
+    return fmtstr(d['string'], **atts_from_match(d))
+
+def atts_from_match(d):
+    """Returns the FmtStr attributes of a match of peel_off_string"""
     atts = {}
     if d['fg']:
 
@@ -60,7 +64,7 @@ def fs_from_match(d):
             atts['bg'] = BG_COLORS[color]
     if d['bold']:
         atts['bold'] = True
-    return fmtstr(d['string'], **atts)
+    return atts
 
 def peel_off_string(s):
     p = r"""(?P<colormarker>\x01
@@ -79,6 +83,110 @@ def peel_off_string(s):
     del d['rest']
     return d, rest
 
+class TokenFormatter(object):
+    """Formats pygments tokens as a FmtStr.
+
+    format(tokens) is parse(format(tokens, BPythonFormatter(color_scheme)))
+    without the bpython-formatted string in between: the attributes of a
+    token type are worked out once, and the FmtStr is built from a chunk per
+    token in one pass."""
+
+    def __init__(self, color_scheme):
+        self.f_strings = BPythonFormatter(color_scheme).f_strings
+        self.atts = dict()
+        for token, f_string in self.f_strings.items():
+            d, rest = peel_off_string(f_string + '\x03\x04')
+            self.atts[token] = atts_from_match(d)
+
+    def atts_for(self, token):
+        try:
+            return self.atts[token]
+        except KeyError:
+            parent = token
+            while parent not in self.f_strings:
+                parent = parent.parent
+            atts = self.atts[token] = self.atts[parent]
+            return atts
+
+    def format(self, tokens):
+        chunks = []
+        for token, text in tokens:
+            if not text or text == '\n':
+                continue
+            atts = self.atts_for(token)
+            if '\x1b[' in text:
+                # Escape sequences in the text are parsed by fmtstr
+                chunks.extend(fmtstr(text, **atts).basefmtstrs)
+            else:
+                chunks.append(Chunk(text, atts))
+        return FmtStr(*chunks)
+
+class HighlightCache(object):
+    """A least recently used cache of the FmtStrs of highlighted lines.
+
+    format(tokens) is formatter.format(tokens), but returns the FmtStr made
+    for the same tokens before if it is still cached. Lines are looked up by
+    their tokens rather than their text, because the text of a line alone
+    does not tell whether it continues a string or which of its brackets
+    are highlighted, while the colour scheme is that of the formatter.
+
+    The cache keeps at most `size` characters of lines, counting one for the
+    end of every line; with a size of 0 nothing is cached.
+    """
+
+    def __init__(self, formatter, size):
+        self.formatter = formatter
+        self.size = size
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        # The links of the entries are [previous, next, key, fmtstr, size],
+        # in a circular list from the least to the most recently used
+        self.links = dict()
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None, 0]
+
+    def __len__(self):
+        return len(self.links)
+
+    def __repr__(self):
+        return ('<HighlightCache %d lines, %d/%d characters, '
+                '%d hits, %d misses>' % (len(self), self.used, self.size,
+                                         self.hits, self.misses))
+
+    def format(self, tokens):
+        key = tuple(tokens)
+        link = self.links.get(key)
+        if link is not None:
+            self.hits += 1
+            self.unlink(link)
+            self.append(link)
+            return link[3]
+        self.misses += 1
+        fs = self.formatter.format(key)
+        size = 1
+        for token, text in key:
+            size += len(text)
+        if size <= self.size:
+            link = self.links[key] = [None, None, key, fs, size]
+            self.append(link)
+            self.used += size
+            while self.used > self.size:
+                oldest = self.root[1]
+                self.unlink(oldest)
+                del self.links[oldest[2]]
+                self.used -= oldest[4]
+        return fs
+
+    def append(self, link):
+        last = self.root[0]
+        link[0], link[1] = last, self.root
+        last[1] = self.root[0] = link
+
+    def unlink(self, link):
+        previous, next = link[0], link[1]
+        previous[1], next[0] = next, previous
+
 def string_to_fmtstr(x):
     config = Struct()
     loadini(config, default_config_path())
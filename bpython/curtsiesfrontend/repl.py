@@ -27,8 +27,8 @@ from curtsies import events
 import bpython
 from bpython.repl import Repl as BpythonRepl, SourceNotFound
 from bpython.config import Struct, loadini, default_config_path
-from bpython.formatter import BPythonFormatter
-from bpython import autocomplete, importcompletion
+from bpython.formatter import BPythonFormatter, Parenthesis
+from bpython import importcompletion
 from bpython import translations; translations.init()
 from bpython.translations import _
 from bpython._py3compat import py3
@@ -37,17 +37,16 @@ from bpython.pager import get_pager_command
 from bpython.curtsiesfrontend import replpainter as paint
 from bpython.curtsiesfrontend import sitefix; sitefix.monkeypatch_quit()
 from bpython.curtsiesfrontend.coderunner import CodeRunner, FakeOutput
+from bpython.curtsiesfrontend.completion import CompletionWorker
 from bpython.curtsiesfrontend.filewatch import ModuleChangedEventHandler
 from bpython.curtsiesfrontend.interaction import StatusBar
 from bpython.curtsiesfrontend.manual_readline import edit_keys
 from bpython.curtsiesfrontend import events as bpythonevents
-from bpython.curtsiesfrontend.parse import parse as bpythonparse
 from bpython.curtsiesfrontend.parse import func_for_letter, color_for_letter
+from bpython.curtsiesfrontend.parse import TokenFormatter, HighlightCache
 from bpython.curtsiesfrontend.preprocess import indent_empty_lines
 from bpython.curtsiesfrontend.interpreter import Interp, code_finished_will_parse
 
-#TODO other autocomplete modes (also fix in other bpython implementations)
-
 
 from curtsies.configfile_keynames import keymap as key_dispatch
 
@@ -219,6 +218,7 @@ class Repl(BpythonRepl):
                  request_refresh=lambda: None,
                  schedule_refresh=lambda when=0: None,
                  request_reload=lambda desc: None,
+                 request_completions=None,
                  get_term_hw=lambda:(50, 10),
                  get_cursor_vertical_diff=lambda: 0,
                  banner=None,
@@ -233,6 +233,9 @@ class Repl(BpythonRepl):
         request_refresh is a function that will be called when the Repl
             wants to refresh the display, but wants control returned to it afterwards
             Takes as a kwarg when= which is when to fire
+        request_completions is a thread-safe function that will be called
+            when completions computed in the background are ready to be
+            shown. If it is None, completions are computed right away.
         get_term_hw is a function that returns the current width and height
             of the terminal
         get_cursor_vertical_diff is a function that returns how the cursor moved
@@ -258,7 +261,6 @@ class Repl(BpythonRepl):
                 banner = _('Welcome to bpython!') + ' ' + (_('Press <%s> for help.') % config.help_key)
             else:
                 banner = None
-        config.autocomplete_mode = autocomplete.SIMPLE # only one implemented currently
         if config.cli_suggestion_width <= 0 or config.cli_suggestion_width > 1:
             config.cli_suggestion_width = 1
 
@@ -293,6 +295,10 @@ class Repl(BpythonRepl):
         super(Repl, self).__init__(interp, config)
         #TODO bring together all interactive stuff - including current directory in path?
         self.formatter = BPythonFormatter(config.color_scheme)
+        self.token_formatter = TokenFormatter(config.color_scheme)
+        # Shared by everything painting highlighted lines
+        self.highlight_cache = HighlightCache(
+            self.token_formatter, config.curtsies_highlight_cache_size)
         self.interact = self.status_bar # overwriting what bpython.Repl put there
                                         # interact is called to interact with the status bar,
                                         # so we're just using the same object
@@ -315,6 +321,13 @@ class Repl(BpythonRepl):
         self.after_suspend = after_suspend
 
         self.coderunner = CodeRunner(self.interp, self.request_refresh)
+        # Held while completing and while user code runs: the completers
+        # share caches, and AttrCleaner replaces methods of user types
+        self.completion_lock = threading.RLock()
+        self.completion_worker = None
+        if request_completions is not None:
+            self.completion_worker = CompletionWorker(self.compute_completion,
+                                                      request_completions)
         self.stdout = FakeOutput(self.coderunner, self.send_to_stdout)
         self.stderr = FakeOutput(self.coderunner, self.send_to_stderr)
         self.stdin = FakeStdin(self.coderunner, self, self.edit_keys)
@@ -332,6 +345,9 @@ class Repl(BpythonRepl):
         self.watching_files = False    # auto reloading turned on
         self.incremental_search_mode = None       # 'reverse_incremental_search' and 'incremental_search'
         self.incremental_search_target = ''
+        # The line, column and original cell of a bracket in the display
+        # buffer highlighted by reprint_line
+        self.highlighted_cell = None
 
         self.original_modules = sys.modules.keys()
 
@@ -382,6 +398,8 @@ class Repl(BpythonRepl):
         signal.signal(signal.SIGWINCH, self.orig_sigwinch_handler)
         signal.signal(signal.SIGTSTP, self.orig_sigtstp_handler)
         __builtins__['__import__'] = self.orig_import
+        if self.completion_worker is not None:
+            self.completion_worker.stop()
 
     def sigwinch_handler(self, signum, frame):
         old_rows, old_columns = self.height, self.width
@@ -437,6 +455,9 @@ class Repl(BpythonRepl):
         if isinstance(e, bpythonevents.ScheduledRefreshRequestEvent):
             pass  # This is a scheduled refresh - it's really just a refresh (so nop)
 
+        elif isinstance(e, bpythonevents.CompletionsReadyEvent):
+            self.show_completion()
+
         elif isinstance(e, bpythonevents.RefreshRequestEvent):
             logger.info('received ASAP refresh request event')
             if self.status_bar.has_focus:
@@ -641,6 +662,11 @@ class Repl(BpythonRepl):
         #if not self.matches_iter.candidate_selected:
         #    self.list_win_visible = self.complete(tab=True)
 
+        # the matches shown may be for an earlier line
+        if self.completion_worker is not None and self.completion_worker.pending:
+            self.completion_worker.cancel()
+            self.list_win_visible = self.complete()
+
         # run complete() if we don't already have matches
         if len(self.matches_iter.matches) == 0:
             self.list_win_visible = self.complete(tab=True)
@@ -793,7 +819,62 @@ class Repl(BpythonRepl):
         #Should be called whenever the completion box might need to appear / dissapear
         #when current line or cursor offset changes, unless via selecting a match
         self.current_match = None
-        self.list_win_visible = BpythonRepl.complete(self, tab)
+        if self.completion_worker is None or tab:
+            if self.completion_worker is not None:
+                self.completion_worker.cancel()
+            self.list_win_visible = self.complete(tab)
+        else:
+            # the infobox shows the last completions until these are ready
+            self.completion_worker.submit((
+                self.cursor_offset, self.current_line,
+                '\n'.join(self.buffer + [self.current_line])))
+
+    def complete(self, tab=False):
+        """Like BpythonRepl.complete, after the completion worker finished
+        what it is computing."""
+        with self.completion_lock:
+            return BpythonRepl.complete(self, tab)
+
+    def compute_completion(self, request, check):
+        """Find the argspec, docstring and matches for a request submitted
+        by update_completion. Runs in the thread of the completion worker,
+        check() raises if the request is outdated."""
+        with self.completion_lock:
+            check()
+            return self._compute_completion(request, check)
+
+    def _compute_completion(self, request, check):
+        cursor_offset, line, current_block = request
+        func, argspec = self.find_args(line)
+        check()
+        docstring = None
+        if not argspec:
+            argspec = None
+        elif func is not None:
+            docstring = self.find_docstring(func)
+            check()
+        matches, completer = self.find_matches(cursor_offset, line, argspec,
+                                               current_block)
+        return cursor_offset, line, func, argspec, docstring, matches, completer
+
+    def show_completion(self):
+        """Show the completions computed by the completion worker if they
+        are for the current line and cursor position."""
+        result = self.completion_worker.take()
+        if result is None:
+            return
+        cursor_offset, line, func, argspec, docstring, matches, completer = result
+        if (cursor_offset, line) != (self.cursor_offset, self.current_line):
+            return
+        self.current_func = func
+        self.argspec = argspec
+        self.docstring = docstring
+        self.current_match = None
+        self.list_win_visible = self.update_matches(matches, completer)
+
+    def completion_notice(self, message):
+        # notify() would wait for a keypress
+        self.status_bar.message(message)
 
     def predicted_indent(self, line):
         #TODO get rid of this! It's repeated code! Combine with Repl.
@@ -820,10 +901,11 @@ class Repl(BpythonRepl):
 
         #current line not added to display buffer if quitting #TODO I don't understand this comment
         if self.config.syntax:
-            display_line = bpythonparse(format(self.tokenize(line), self.formatter))
+            display_line = self.highlight_cache.format(self.tokenize(line))
             # careful: self.tokenize requires that the line not be in self.buffer yet!
 
             logger.debug('display line being pushed to buffer: %r -> %r', line, display_line)
+            logger.debug('highlighted lines: %r', self.highlight_cache)
             self.display_buffer.append(display_line)
         else:
             self.display_buffer.append(fmtstr(line))
@@ -849,7 +931,8 @@ class Repl(BpythonRepl):
         self.run_code_and_maybe_finish()
 
     def run_code_and_maybe_finish(self, for_code=None):
-        r = self.coderunner.run_code(for_code=for_code)
+        with self.completion_lock:
+            r = self.coderunner.run_code(for_code=for_code)
         if r:
             logger.debug("----- Running finish command stuff -----")
             logger.debug("saved_indent: %r", self.saved_indent)
@@ -890,12 +973,25 @@ class Repl(BpythonRepl):
                 return
             self.highlighted_paren = None
             logger.debug('trying to unhighlight a paren on line %r', lineno)
+            cell, self.highlighted_cell = self.highlighted_cell, None
+            if cell is not None and cell[0] == lineno:
+                # Only the bracket itself needs its old style back
+                self.set_display_cells(*cell)
+                return
             logger.debug('with these tokens: %r', saved_tokens)
-            new = bpythonparse(format(saved_tokens, self.formatter))
+            new = self.highlight_cache.format(saved_tokens)
             self.display_buffer[lineno] = self.display_buffer[lineno].setslice_with_length(0, len(new), new, len(self.display_buffer[lineno]))
 
+    def set_display_cells(self, lineno, column, cells):
+        """Replace the cells of line `lineno` of the display buffer starting
+        at `column` with the FmtStr `cells`."""
+        line = self.display_buffer[lineno]
+        self.display_buffer[lineno] = line.setslice_with_length(
+            column, column + len(cells), cells, len(line))
+
     def clear_current_block(self, remove_from_history=True):
         self.display_buffer = []
+        self.highlighted_cell = None
         if remove_from_history:
             [self.history.pop() for _ in self.buffer]
         self.buffer = []
@@ -944,7 +1040,7 @@ class Repl(BpythonRepl):
     def current_line_formatted(self):
         """The colored current line (no prompt, not wrapped)"""
         if self.config.syntax:
-            fs = bpythonparse(format(self.tokenize(self.current_line), self.formatter))
+            fs = self.highlight_cache.format(self.tokenize(self.current_line))
             if self.incremental_search_mode:
                 if self.incremental_search_target in self.current_line:
                     fs = fmtfuncs.on_magenta(self.incremental_search_target).join(fs.split(self.incremental_search_target))
@@ -1131,6 +1227,8 @@ class Repl(BpythonRepl):
             visible_space_below = min_height - current_line_end_row - 1
 
             info_max_rows = max(visible_space_above, visible_space_below)
+            format = self.matches_iter.completer.format if self.matches_iter.completer else None
+            match_width = self.matches_iter.max_width(format) if self.matches_iter.matches else None
             infobox = paint.paint_infobox(info_max_rows,
                                           int(width * self.config.cli_suggestion_width),
                                           self.matches_iter.matches,
@@ -1138,7 +1236,8 @@ class Repl(BpythonRepl):
                                           self.current_match,
                                           self.docstring,
                                           self.config,
-                                          self.matches_iter.completer.format if self.matches_iter.completer else None)
+                                          format,
+                                          match_width)
 
             if visible_space_above >= infobox.height and self.config.curtsies_list_above:
                 arr[current_line_start_row - infobox.height:current_line_start_row, 0:infobox.width] = infobox
@@ -1274,11 +1373,31 @@ class Repl(BpythonRepl):
     def reprint_line(self, lineno, tokens):
         logger.debug("calling reprint line with %r %r", lineno, tokens)
         if self.config.syntax:
-            self.display_buffer[lineno] = bpythonparse(format(tokens, self.formatter))
+            # Repl.tokenize only highlights a bracket, so restyle just that
+            column = 0
+            for token, value in tokens:
+                if token is Parenthesis:
+                    break
+                column += len(value)
+            else:
+                self.display_buffer[lineno] = self.highlight_cache.format(tokens)
+                return
+            cell = self.highlighted_cell
+            if cell is not None and cell[:2] != (lineno, column):
+                self.set_display_cells(*cell)
+                cell = None
+            if cell is None:
+                # Not highlighted by the last paint already
+                line = self.display_buffer[lineno]
+                self.highlighted_cell = (lineno, column,
+                                         line[column:column + len(value)])
+            self.set_display_cells(lineno, column,
+                                   self.highlight_cache.format([(token, value)]))
 
     def take_back_buffer_line(self):
         self.display_buffer.pop()
         self.buffer.pop()
+        self.highlighted_cell = None
 
         if not self.buffer:
             self._set_cursor_offset(0, update_completion=False)
@@ -1305,6 +1424,7 @@ class Repl(BpythonRepl):
         self.buffer = []
         self.display_buffer = []
         self.highlighted_paren = None
+        self.highlighted_cell = None
 
         self.reevaluating = True
         sys.stdin = ReevaluateFakeStdin(self.stdin, self)
@@ -1326,6 +1446,7 @@ class Repl(BpythonRepl):
             #self.scroll_offset = self.scroll_offset + (len(old_display_lines)-len(self.display_lines))
             self.inconsistent_history = True
         logger.debug('after rewind, self.inconsistent_history is %r', self.inconsistent_history)
+        logger.debug('after rewind, highlighted lines: %r', self.highlight_cache)
 
         self.cursor_offset = 0
         self.current_line = ''
@@ -1447,7 +1568,7 @@ def simple_repl():
         r.width = 50
         r.height = 10
         while True:
-            [_ for _ in importcompletion.find_iterator]
+            importcompletion.start_scan(r.config.module_indexing).join()
             r.dumb_print_output()
             r.dumb_input(refreshes)
 
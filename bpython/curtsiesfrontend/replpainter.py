@@ -40,23 +40,39 @@ def paint_current_line(rows, columns, current_display_line):
     lines = display_linize(current_display_line, columns, True)
     return fsarray(lines, width=columns)
 
-def matches_lines(rows, columns, matches, current, config, format):
+def matches_lines(rows, columns, matches, current, config, format,
+                  width=None):
+    """Returns at most `rows` lines of matches: the page of lines with the
+    current match on it. Only the matches on these lines are formatted,
+    unless the `width` of the widest formatted match isn't given."""
     highlight_color = func_for_letter(config.color_scheme['operator'].lower())
 
-    if not matches:
+    if not matches or rows <= 0:
         return []
+    if format is None:
+        format = lambda match: match
     color = func_for_letter(config.color_scheme['main'])
-    max_match_width = max(len(m) for m in matches)
-    words_wide = max(1, (columns - 1) // (max_match_width + 1))
-    matches = [format(m) for m in matches]
+    if width is None:
+        width = max(len(format(m)) for m in matches)
+    words_wide = max(1, (columns - 1) // (width + 1))
+
+    current_row = 0
     if current:
+        try:
+            current_row = matches.index(current) // words_wide
+        except ValueError:
+            pass
         current = format(current)
+    first = current_row // rows * rows * words_wide
+    last = min(len(matches), first + rows * words_wide)
 
-    matches_lines = [fmtstr(' ').join(color(m.ljust(max_match_width))
-                                      if m != current
-                                      else highlight_color(m.ljust(max_match_width))
-                                      for m in matches[i:i+words_wide])
-                     for i in range(0, len(matches), words_wide)]
+    matches_lines = []
+    for i in range(first, last, words_wide):
+        words = [format(m) for m in matches[i:min(i + words_wide, last)]]
+        matches_lines.append(fmtstr(' ').join(
+            color(m.ljust(width)) if m != current
+            else highlight_color(m.ljust(width))
+            for m in words))
 
     logger.debug('match: %r' % current)
     logger.debug('matches_lines: %r' % matches_lines)
@@ -138,19 +154,32 @@ def formatted_argspec(argspec, columns, config):
 
     return linesplit(s, columns)
 
-def formatted_docstring(docstring, columns, config):
+def formatted_docstring(docstring, columns, config, max_lines=None):
+    """Returns the lines of docstring, at most `max_lines` if given."""
     color = func_for_letter(config.color_scheme['comment'])
-    return sum(([color(x) for x in (display_linize(line, columns) if line else fmtstr(''))]
-                for line in docstring.split('\n')), [])
-
-def paint_infobox(rows, columns, matches, argspec, match, docstring, config, format):
+    lines = []
+    for line in docstring.split('\n'):
+        if max_lines is not None and len(lines) >= max_lines:
+            break
+        lines.extend(color(x) for x in (display_linize(line, columns)
+                                        if line else fmtstr('')))
+    return lines[:max_lines]
+
+def paint_infobox(rows, columns, matches, argspec, match, docstring, config, format,
+                  match_width=None):
     """Returns painted completions, argspec, match, docstring etc."""
     if not (rows and columns):
         return fsarray(0, 0)
     width = columns - 4
-    lines = ((formatted_argspec(argspec, width, config) if argspec else []) +
-             (matches_lines(rows, width, matches, match, config, format) if matches else []) +
-             (formatted_docstring(docstring, width, config) if docstring else []))
+    # the lines between the top and bottom borders which fit
+    max_lines = max(0, rows - 2)
+    lines = formatted_argspec(argspec, width, config) if argspec else []
+    if matches:
+        lines += matches_lines(max_lines - len(lines), width, matches, match,
+                               config, format, match_width)
+    if docstring and len(lines) < max_lines:
+        lines += formatted_docstring(docstring, width, config,
+                                     max_lines - len(lines))
 
     def add_border(line):
         """Add colored borders left and right to a line."""
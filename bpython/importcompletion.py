@@ -23,186 +23,1189 @@
 from __future__ import with_statement
 
 from bpython import line as lineparts
+from bpython.matching import MatchIndex, SIMPLE, filter_names
+import bisect
 import imp
+import json
+import logging
+import multiprocessing
 import os
+import platform
+import Queue
+import re
+import stat
 import sys
-import warnings
+import tempfile
+import threading
+import time
+import zipfile
 
 if sys.version_info[0] == 3 and sys.version_info[1] >= 3:
     import importlib.machinery
     SUFFIXES = importlib.machinery.all_suffixes()
+    # zipimport only imports source and bytecode modules
+    ARCHIVE_SUFFIXES = (importlib.machinery.SOURCE_SUFFIXES +
+                        importlib.machinery.BYTECODE_SUFFIXES)
 else:
     SUFFIXES = [suffix for suffix, mode, type in imp.get_suffixes()]
+    ARCHIVE_SUFFIXES = [suffix for suffix, mode, type in imp.get_suffixes()
+                        if type in (imp.PY_SOURCE, imp.PY_COMPILED)]
 
 try:
-    from warnings import catch_warnings
+    from os import scandir
 except ImportError:
-    import contextlib
-    @contextlib.contextmanager
-    def catch_warnings():
-        """Stripped-down version of `warnings.catch_warnings()`
-        (available in Py >= 2.6)."""
-        filters = warnings.filters
-        warnings.filters = list(filters)
-        try:
-            yield
-        finally:
-            warnings.filters = filters
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.observers.api import ObservedWatch
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
 
 from bpython._py3compat import py3
 
+logger = logging.getLogger(__name__)
+
+_identifier_re = re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*$')
+
+
+def _index_contains(names, name):
+    """Whether the sorted list `names` contains `name`."""
+    i = bisect.bisect_left(names, name)
+    return i < len(names) and names[i] == name
+
+
+class ModuleIndex(object):
+    """A sorted list of dotted module names.
+
+    Names can be added while the index is in use, e.g. by the threads of a
+    `ModuleScanner`: they are collected unsorted and only merged into the
+    sorted list on the next lookup. The sorted list is replaced, never
+    changed in place, so lookups don't need to hold the lock while they
+    search it."""
+
+    def __init__(self, names=()):
+        self._names = sorted(set(names))
+        self._pending = set()
+        self._lock = threading.Lock()
+        # The sorted list and, for each package, a MatchIndex of the last
+        # parts of the names directly below it
+        self._children = (None, dict())
+
+    def _merge(self):
+        # Needs to be called with the lock held
+        if self._pending:
+            names = self._names
+            new = [name for name in self._pending
+                   if not _index_contains(names, name)]
+            new.sort()
+            # Sorting two sorted runs is a linear merge
+            merged = names + new
+            merged.sort()
+            self._names = merged
+            self._pending = set()
+
+    def _sorted(self):
+        if self._pending:
+            with self._lock:
+                self._merge()
+        return self._names
+
+    def __len__(self):
+        return len(self._sorted())
+
+    def __iter__(self):
+        return iter(self._sorted())
+
+    def __contains__(self, name):
+        return _index_contains(self._sorted(), name)
+
+    def add(self, name):
+        with self._lock:
+            self._pending.add(name)
+
+    def update(self, names):
+        with self._lock:
+            self._pending.update(names)
+
+    def discard(self, name):
+        self.difference_update((name, ))
+
+    def difference_update(self, names):
+        names = set(names)
+        with self._lock:
+            self._merge()
+            self._names = [name for name in self._names if name not in names]
+
+    def intersection_update(self, names):
+        names = set(names)
+        with self._lock:
+            self._merge()
+            self._names = [name for name in self._names if name in names]
+
+    def clear(self):
+        with self._lock:
+            self._names = []
+            self._pending = set()
+
+    def subtree(self, name):
+        """Return `name` and all names below it, if it's known."""
+        names = self._sorted()
+        result = []
+        if _index_contains(names, name):
+            result.append(name)
+        i = bisect.bisect_left(names, name + '.')
+        j = bisect.bisect_left(names, name + '/', i)
+        result.extend(names[i:j])
+        return result
+
+    def matches(self, prefix, mode=SIMPLE):
+        """Return the names starting with `prefix` which are not nested
+        any deeper than the last part of `prefix`, i.e. have no dot after
+        it. In substring or fuzzy `mode`, the last part of the names needs
+        to match the last part of `prefix` in that mode instead."""
+        if mode != SIMPLE:
+            package, dot, text = prefix.rpartition('.')
+            return [package + dot + name
+                    for name in self._child_index(package).matches(text, mode)]
+
+        names = self._sorted()
+        result = []
+        i = bisect.bisect_left(names, prefix)
+        while i < len(names) and names[i].startswith(prefix):
+            name = names[i]
+            dot = name.find('.', len(prefix))
+            if dot == -1:
+                result.append(name)
+                i += 1
+            else:
+                # Skip the whole subtree below name[:dot]: '/' is the
+                # character sorting right after '.'
+                i = bisect.bisect_left(names, name[:dot] + '/', i)
+        return result
+
+    def _child_index(self, package):
+        """Return a MatchIndex of the last parts of the names directly below
+        `package`, or of the top-level names if `package` is empty. It is
+        kept until the sorted list changes."""
+        names = self._sorted()
+        if self._children[0] is not names:
+            self._children = (names, dict())
+        indexes = self._children[1]
+        index = indexes.get(package)
+        if index is None:
+            if package:
+                start = len(package) + 1
+                i = bisect.bisect_left(names, package + '.')
+                j = bisect.bisect_left(names, package + '/', i)
+                children = [name[start:] for name in names[i:j]
+                            if name.find('.', start) == -1]
+            else:
+                children = [name for name in names if '.' not in name]
+            index = indexes[package] = MatchIndex(children)
+        return index
+
+
 # The cached list of all known modules
-modules = set()
+modules = ModuleIndex()
 fully_loaded = False
 
+# The background scan started by start_scan()
+scanner = None
+
+# Module indexing policies: search all packages right away, or only search
+# a package once its name is typed
+EAGER = 'eager'
+LAZY = 'lazy'
+ALL_POLICIES = (EAGER, LAZY)
+
+# How long completion may wait for the modules of a package in lazy mode
+expand_timeout = 0.05
+
+# How often the directories which are not watched are checked for changes
+# while imports are completed, in seconds
+revalidate_interval = 10.0
+
+# Directories modified less than this many seconds before they were searched
+# might have changed again within the resolution of their mtime
+MTIME_RESOLUTION = 2.0
+
+# Bump this whenever the layout of the module cache file changes
+CACHE_VERSION = 2
+
+
+def default_cache_path():
+    """Returns the path of the file the module cache is stored in. Every
+    Python implementation and version has its own, as the modules found in
+    a directory depend on the suffixes they import."""
+    xdg_cache_home = os.environ.get('XDG_CACHE_HOME', '~/.cache')
+    filename = 'modules-%s%d.%d.cache' % (
+        platform.python_implementation().lower(), sys.version_info[0],
+        sys.version_info[1])
+    return os.path.expanduser(os.path.join(xdg_cache_home, 'bpython',
+                                           filename))
+
+# Where the module cache is stored; set to None to disable the cache
+cache_path = default_cache_path()
+
 
-def module_matches(cw, prefix=''):
+def module_matches(cw, prefix='', mode=SIMPLE):
     """Modules names to replace cw with"""
     full = '%s.%s' % (prefix, cw) if prefix else cw
-    matches = [name for name in modules
-               if (name.startswith(full) and
-                   name.find('.', len(full)) == -1)]
+    package = full.rpartition('.')[0]
+    if package and scanner is not None:
+        scanner.expand(package, expand_timeout)
+    matches = modules.matches(full, mode)
     if prefix:
         return [match[len(prefix)+1:] for match in matches]
     else:
         return matches
 
-def attr_matches(cw, prefix='', only_modules=False):
+# Sorted dir() of the modules completed by attr_matches: for each module
+# name, the module, its __dict__ and size when dir() was called, the
+# attributes, and the attributes which are modules together with the size
+# of sys.modules when they were looked up
+_attributes = dict()
+
+
+def _module_attributes(module_name, only_modules=False):
+    """Return the sorted attributes of module `module_name`, which needs to
+    be in `sys.modules`. dir() is only called again if the `__dict__` of the
+    module was replaced or changed its size."""
+    module = sys.modules[module_name]
+    namespace = getattr(module, '__dict__', None)
+    size = len(namespace) if namespace is not None else -1
+    record = _attributes.get(module_name)
+    if (record is None or record[0] is not module or
+            record[1] is not namespace or record[2] != size):
+        record = [module, namespace, size, sorted(dir(module)), None, -1]
+        _attributes[module_name] = record
+    if not only_modules:
+        return record[3]
+    if record[5] != len(sys.modules):
+        record[4] = [name for name in record[3]
+                     if '%s.%s' % (module_name, name) in sys.modules]
+        record[5] = len(sys.modules)
+    return record[4]
+
+
+def _prefix_matches(names, prefix):
+    """Return the names of the sorted list `names` starting with
+    `prefix`."""
+    start = end = bisect.bisect_left(names, prefix)
+    while end < len(names) and names[end].startswith(prefix):
+        end += 1
+    return names[start:end]
+
+
+def attr_matches(cw, prefix='', only_modules=False, mode=SIMPLE):
     """Attributes to replace name with"""
     full = '%s.%s' % (prefix, cw) if prefix else cw
     module_name, _, name_after_dot = full.rpartition('.')
     if module_name not in sys.modules:
+        _attributes.pop(module_name, None)
         return []
-    module = sys.modules[module_name]
-    if only_modules:
-        matches = [name for name in dir(module)
-                if name.startswith(name_after_dot) and
-                '%s.%s' % (module_name, name) in sys.modules]
+    attributes = _module_attributes(module_name, only_modules)
+    if mode == SIMPLE:
+        matches = _prefix_matches(attributes, name_after_dot)
     else:
-        matches = [name for name in dir(module) if name.startswith(name_after_dot)]
+        matches = filter_names(attributes, name_after_dot, mode)
     module_part, _, _ = cw.rpartition('.')
     if module_part:
         return ['%s.%s' % (module_part, m) for m in matches]
     return matches
 
-def module_attr_matches(name):
+def module_attr_matches(name, mode=SIMPLE):
     """Only attributes which are modules to replace name with"""
-    return attr_matches(name, prefix='', only_modules=True)
+    return attr_matches(name, prefix='', only_modules=True, mode=mode)
 
-def complete(cursor_offset, line):
-    """Construct a full list of possibly completions for imports."""
-    tokens = line.split()
+def complete(cursor_offset, line, mode=SIMPLE):
+    """Construct a full list of possibly completions for imports. Names
+    are matched in autocomplete `mode`, see bpython.matching."""
+    context = lineparts.context(cursor_offset, line)
+    tokens = context.tokens()
     if 'from' not in tokens and 'import' not in tokens:
         return None
+    if scanner is not None:
+        scanner.revalidate()
 
-    result = lineparts.current_word(cursor_offset, line)
+    result = context.current_word()
     if result is None:
         return None
 
-    if lineparts.current_from_import_from(cursor_offset, line) is not None:
-        if lineparts.current_from_import_import(cursor_offset, line) is not None:
+    from_part = context.current_from_import_from()
+    if from_part is not None:
+        import_part = context.current_from_import_import()
+        if import_part is not None:
             # `from a import <b|>` completion
-            return (module_matches(lineparts.current_from_import_import(cursor_offset, line)[2],
-                                   lineparts.current_from_import_from(cursor_offset, line)[2]) +
-                    attr_matches(lineparts.current_from_import_import(cursor_offset, line)[2],
-                                 lineparts.current_from_import_from(cursor_offset, line)[2]))
+            return (module_matches(import_part[2], from_part[2], mode) +
+                    attr_matches(import_part[2], from_part[2], mode=mode))
         else:
             # `from <a|>` completion
-            return (module_attr_matches(lineparts.current_from_import_from(cursor_offset, line)[2]) +
-                    module_matches(lineparts.current_from_import_from(cursor_offset, line)[2]))
-    elif lineparts.current_import(cursor_offset, line):
+            return (module_attr_matches(from_part[2], mode) +
+                    module_matches(from_part[2], mode=mode))
+    import_part = context.current_import()
+    if import_part:
         # `import <a|>` completion
-        return (module_matches(lineparts.current_import(cursor_offset, line)[2]) +
-                module_attr_matches(lineparts.current_import(cursor_offset, line)[2]))
+        return (module_matches(import_part[2], mode=mode) +
+                module_attr_matches(import_part[2], mode))
     else:
         return None
 
-def find_modules(path):
-    """Find all modules (and packages) for a given directory."""
-    if not os.path.isdir(path):
-        # Perhaps a zip file
-        return
+def _is_identifier(name):
+    if py3:
+        return name.isidentifier()
+    return _identifier_re.match(name) is not None
+
+
+def _module_name(filename, suffixes=SUFFIXES):
+    """Return the name of the module stored in file `filename`, or None if
+    it's not a module which can be imported."""
+    for suffix in suffixes:
+        if filename.endswith(suffix):
+            name = filename[:-len(suffix)]
+            if _is_identifier(name):
+                return name
+            return None
+    return None
+
 
+def _list_directory(path):
+    """Yield the name of every entry of directory `path` together with
+    whether it is a directory.
+
+    With `scandir` the file types come with the listing, so only symlinks
+    need another syscall. Without it, only the entries which could be
+    modules or packages are looked at with `os.path.isdir`."""
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                yield entry.name, entry.is_dir()
+            except EnvironmentError:
+                continue
+    else:
+        for name in os.listdir(path):
+            if '.' in name and _module_name(name) is None:
+                continue
+            yield name, os.path.isdir(os.path.join(path, name))
+
+
+def _scan_directory(path):
+    """Classify the entries of the directory `path` by their names alone.
+
+    Returns whether `path` is a package, the modules found directly in it
+    and the subdirectories which might be packages. Whether those are
+    packages is only known once they are scanned themselves."""
+    is_package = False
+    names = set()
+    subdirs = set()
     try:
-        filenames = os.listdir(path)
-    except EnvironmentError:
-        filenames = []
-    for name in filenames:
-        if not any(name.endswith(suffix) for suffix in SUFFIXES):
-            # Possibly a package
-            if '.' in name:
+        for filename, is_dir in _list_directory(path):
+            if is_dir:
+                # Directories which end with a python extension are no
+                # packages, CPython just crashes on them.
+                if _is_identifier(filename):
+                    subdirs.add(filename)
                 continue
-        elif os.path.isdir(os.path.join(path, name)):
-            # Unfortunately, CPython just crashes if there is a directory
-            # which ends with a python extension, so work around.
-            continue
-        for suffix in SUFFIXES:
-            if name.endswith(suffix):
-                name = name[:-len(suffix)]
+            name = _module_name(filename)
+            if name is None:
+                continue
+            if name == '__init__':
+                is_package = True
+            names.add(name)
+    except EnvironmentError:
+        pass
+    return is_package, list(names), list(subdirs)
+
+
+def _directory_contents(path, mtime, cache=None, entry=None):
+    """Like `_scan_directory`, but use the record of `cache` if the
+    directory did not change since it was recorded."""
+    record = None
+    if cache is not None:
+        record = cache.lookup(entry, path, mtime)
+    if record is None:
+        record = _scan_directory(path)
+        if cache is not None:
+            cache.store(entry, path, mtime, *record)
+    return record
+
+
+def _find_archive(path):
+    """Return the file name and the stat result of the archive `path`
+    refers to, together with the directory inside the archive. Like
+    zipimport, `path` may point into the archive, as in `app.zip/lib`."""
+    inner = []
+    while path:
+        try:
+            st = os.stat(path)
+        except EnvironmentError:
+            head, tail = os.path.split(path)
+            if head == path:
                 break
-        if py3 and name == "badsyntax_pep3120":
-            # Workaround for issue #166
+            inner.insert(0, tail)
+            path = head
             continue
+        if stat.S_ISREG(st.st_mode):
+            return path, st, '/'.join(inner)
+        break
+    return None, None, ''
+
+
+def _scan_archive(filename, inner=''):
+    """Return the modules found in the zip archive `filename` (e.g. a
+    zipapp, egg or wheel) below its directory `inner`.
+
+    Only the central directory of the archive is read, no member is
+    imported or even extracted."""
+    try:
+        archive = zipfile.ZipFile(filename)
         try:
-            with catch_warnings():
-                warnings.simplefilter("ignore", ImportWarning)
-                fo, pathname, _ = imp.find_module(name, [path])
-        except (ImportError, IOError, SyntaxError):
+            members = archive.namelist()
+        finally:
+            archive.close()
+    except (EnvironmentError, zipfile.BadZipfile, zipfile.LargeZipFile):
+        return []
+
+    if inner:
+        inner = inner.strip('/') + '/'
+        members = [member[len(inner):] for member in members
+                   if member.startswith(inner)]
+
+    # The modules in every directory of the archive
+    contents = dict()
+    for member in members:
+        dirname, _, filename = member.rpartition('/')
+        name = _module_name(filename, ARCHIVE_SUFFIXES)
+        if name is not None:
+            contents.setdefault(dirname, set()).add(name)
+
+    result = []
+    for dirname, names in contents.items():
+        if not dirname:
+            result.extend(names)
             continue
-        except UnicodeEncodeError:
-            # Happens with Python 3 when there is a filename in some
-            # invalid encoding
+        parts = dirname.split('/')
+        # The directory and all its parents need to be packages
+        if not all(_is_identifier(part) and
+                   '__init__' in contents.get('/'.join(parts[:i + 1]), ())
+                   for i, part in enumerate(parts)):
             continue
-        else:
-            if fo is not None:
-                fo.close()
-            else:
-                # Yay, package
-                for subname in find_modules(pathname):
-                    if subname != '__init__':
-                        yield '%s.%s' % (name, subname)
-            yield name
-
-
-def find_all_modules(path=None):
-    """Return a list with all modules in `path`, which should be a list of
-    directory names. If path is not given, sys.path will be used."""
-    if path is None:
-        modules.update(sys.builtin_module_names)
-        path = sys.path
-
-    for p in path:
-        if not p:
-            p = os.curdir
-        for module in find_modules(p):
-            if not py3 and not isinstance(module, unicode):
-                try:
-                    module = module.decode(sys.getfilesystemencoding())
-                except UnicodeDecodeError:
-                    # Not importable anyway, ignore it
-                    continue
-            modules.add(module)
-            yield
+        package = '.'.join(parts)
+        result.append(package)
+        result.extend('%s.%s' % (package, name) for name in names
+                      if name != '__init__')
+    return result
 
 
-def find_coroutine():
-    global fully_loaded
+def _archive_contents(path, cache=None, entry=None):
+    """Like `_scan_archive` for the archive `path` refers to, but use the
+    record of `cache` if size and mtime of the archive did not change since
+    it was recorded."""
+    filename, st, inner = _find_archive(path)
+    if filename is None:
+        return []
+    names = None
+    if cache is not None:
+        names = cache.lookup_archive(entry, st.st_size, st.st_mtime)
+    if names is None:
+        names = _scan_archive(filename, inner)
+        if cache is not None:
+            cache.store_archive(entry, st.st_size, st.st_mtime, names)
+    return names
+
+
+def _decode(name):
+    """Return module name `name` as unicode, or None if it can't be
+    decoded."""
+    if not py3 and not isinstance(name, unicode):
+        try:
+            return name.decode(sys.getfilesystemencoding())
+        except UnicodeDecodeError:
+            # Not importable anyway, ignore it
+            return None
+    return name
 
-    if fully_loaded:
-        return None
 
+def save_json(filename, data):
+    """Write `data` as JSON to `filename`. The file is replaced atomically,
+    so readers never see a partially written file. Returns whether writing
+    succeeded."""
+    dirname = os.path.dirname(filename)
     try:
-        find_iterator.next()
-    except StopIteration:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmpname = tempfile.mkstemp(prefix='.' + os.path.basename(filename),
+                                       dir=dirname)
+    except EnvironmentError:
+        return False
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        try:
+            os.rename(tmpname, filename)
+        except OSError:
+            # Windows does not replace existing files on rename
+            os.remove(filename)
+            os.rename(tmpname, filename)
+    except (EnvironmentError, TypeError, ValueError, UnicodeError):
+        try:
+            os.remove(tmpname)
+        except EnvironmentError:
+            pass
+        return False
+    return True
+
+
+class ModuleCache(object):
+    """The modules found on `sys.path`, stored on disk between sessions.
+
+    The cache keeps one record for every `sys.path` entry, holding the names
+    of all modules found there and, for every directory that was searched,
+    its mtime together with what `_scan_directory` found in it. A directory
+    is only searched again if its mtime changed. For an entry which is a zip
+    archive, the modules found in it are recorded together with its size and
+    mtime instead.
+
+    Directories and archives modified less than `MTIME_RESOLUTION` seconds
+    before they were searched are recorded without their mtime, as they
+    might have changed again without changing it: they are searched again
+    next time.
+
+    Sessions with different `sys.path`s share the file: only the modules of
+    the entries of the path searched are used, and the records of the other
+    entries found in the file when saving are kept. The file is replaced
+    atomically, so concurrently running sessions never see a partially
+    written cache."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.old_entries = dict()
+        self.entries = dict()
+        # ModuleScanner's workers share the cache
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read the cache file. A missing, unreadable or outdated cache
+        file is treated as an empty cache."""
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (EnvironmentError, ValueError):
+            return
+        if (not isinstance(data, dict) or
+                data.get('version') != CACHE_VERSION or
+                not isinstance(data.get('entries'), dict)):
+            return
+        self.old_entries = data['entries']
+
+    def save(self):
+        """Write the records of this scan to the cache file, together with
+        the records of the other entries in the file which still exist."""
+        saved = ModuleCache(self.filename)
+        saved.load()
+        entries = dict((entry, record)
+                       for entry, record in saved.old_entries.iteritems()
+                       if os.path.exists(entry))
+        with self.lock:
+            records = self.entries.items()
+        for entry, record in records:
+            entries[entry] = dict(modules=sorted(record['modules']),
+                                  dirs=record['dirs'])
+            if 'archive' in record:
+                entries[entry]['archive'] = record['archive']
+        save_json(self.filename, dict(version=CACHE_VERSION, entries=entries))
+
+    def cached_modules(self, entries):
+        """Return the modules of the path entries `entries` found in the
+        cache file."""
+        names = set()
+        for entry in entries:
+            record = self.old_entries.get(entry)
+            if isinstance(record, dict):
+                names.update(record.get('modules', ()))
+        return names
+
+    def _entry(self, entry):
+        if entry not in self.entries:
+            self.entries[entry] = dict(modules=set(), dirs={})
+        return self.entries[entry]
+
+    def lookup(self, entry, path, mtime):
+        """Return the contents recorded for directory `path` if its mtime
+        is still `mtime`, otherwise None."""
+        record = self.old_entries.get(entry, {}).get('dirs', {}).get(path)
+        if not record or len(record) != 4 or record[0] != mtime:
+            return None
+        with self.lock:
+            self._entry(entry)['dirs'][path] = record
+        return tuple(record[1:])
+
+    def store(self, entry, path, mtime, is_package, names, subdirs):
+        if time.time() - mtime < MTIME_RESOLUTION:
+            mtime = None
+        with self.lock:
+            self._entry(entry)['dirs'][path] = [mtime, is_package, names,
+                                                subdirs]
+
+    def lookup_archive(self, entry, size, mtime):
+        """Return the modules recorded for the archive of entry `entry` if
+        its size and mtime are still `size` and `mtime`, otherwise None."""
+        record = self.old_entries.get(entry, {}).get('archive')
+        if not record or len(record) != 3 or record[:2] != [size, mtime]:
+            return None
+        with self.lock:
+            self._entry(entry)['archive'] = record
+        return record[2]
+
+    def store_archive(self, entry, size, mtime, names):
+        if time.time() - mtime < MTIME_RESOLUTION:
+            mtime = None
+        with self.lock:
+            self._entry(entry)['archive'] = [size, mtime, names]
+
+    def add_module(self, entry, name):
+        with self.lock:
+            self._entry(entry)['modules'].add(name)
+
+
+class ModuleScanner(object):
+    """Search the directories of `path` (or `sys.path`) for modules in a
+    pool of worker threads.
+
+    Every directory is a task of its own, so both the entries of the path
+    and the subtrees of packages are spread over all workers. A directory
+    reachable in several ways, e.g. through a repeated path entry or a
+    symlink, is searched only once.
+
+    The modules found in a directory are added to `modules` as one batch.
+
+    If `lazy` is true, only the top-level modules and packages of the path
+    entries are searched. The modules of a package are searched once
+    `expand` is called for it, e.g. when its name is completed.
+
+    If `watch` is true, `modules` is kept up to date when modules are added
+    or removed. If watchdog is available, the path entries are watched by a
+    `ModuleIndexWatcher`. The directories of entries which are not watched,
+    because watchdog is not available or watching failed, are checked for
+    changes of their mtime by `revalidate` instead.
+    """
+
+    def __init__(self, path=None, workers=None, lazy=False, watch=False):
+        if workers is None:
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+        self.path = path
+        self.workers = max(1, workers)
+        self.tasks = Queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.seen = set()
+        self.found = None
+        self.cache = None
+        self.finished = threading.Event()
+        self.lazy = lazy
+        # In lazy mode, the directories of packages which were not searched
+        # yet, and the threads searching packages right now
+        self.unexpanded = dict()
+        self.expanding = dict()
+        # The path entries searched
+        self.entries = []
+        self.watch = watch
+        # The directories whose modules are in `modules`: for each, the path
+        # entry, the package prefix, the keys of the directory and its
+        # parents, and the result of `_scan_directory` without is_package.
+        # Subdirectories which are not packages are recorded with names
+        # None, to search them once they become packages.
+        self.directories = dict()
+        # For each directory in `directories`, its mtime and when it was
+        # searched
+        self.mtimes = dict()
+        self.revalidated = 0
+        self.revalidating = False
+        self.watcher = None
+        if watch and Observer is not None:
+            self.watcher = ModuleIndexWatcher(self)
+
+    def start(self):
+        """Start the worker threads and return immediately."""
+        if self.watcher is not None:
+            self.watcher.start()
+        path = self.path
+        if path is None:
+            path = sys.path
+            modules.update(sys.builtin_module_names)
+            self.found = set(sys.builtin_module_names)
+            if cache_path is not None:
+                self.cache = ModuleCache(cache_path)
+                self.cache.load()
+
+        for p in list(path):
+            if not p:
+                p = os.curdir
+            if self.cache is not None:
+                p = os.path.abspath(p)
+            self.entries.append(p)
+        if self.cache is not None:
+            cached = self.cache.cached_modules(self.entries)
+            if self.lazy:
+                cached = [name for name in cached if '.' not in name]
+            modules.update(cached)
+
+        for p in self.entries:
+            self._submit((p, p, '', ()))
+        if not self.pending:
+            self._finish()
+            return
+
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def join(self, timeout=None):
+        """Wait until the scan is finished. Returns whether it is."""
+        self.finished.wait(timeout)
+        return self.finished.is_set()
+
+    @property
+    def running(self):
+        return not self.finished.is_set()
+
+    def expand(self, package, timeout=None):
+        """Search the modules of `package` and of all packages containing
+        it, unless that happened already or the scan is not lazy. Waits at
+        most `timeout` seconds; the search goes on in the background if it
+        takes longer. Returns whether the search is finished."""
+        if not self.lazy:
+            return True
+        deadline = None if timeout is None else time.time() + timeout
+        parts = package.split('.')
+        for i in range(1, len(parts) + 1):
+            name = '.'.join(parts[:i])
+            with self.lock:
+                thread = self.expanding.get(name)
+                if thread is None and name in self.unexpanded:
+                    thread = threading.Thread(target=self._expand,
+                                              args=(name, ))
+                    thread.daemon = True
+                    self.expanding[name] = thread
+                    thread.start()
+            if thread is not None:
+                if deadline is None:
+                    thread.join()
+                else:
+                    thread.join(max(0, deadline - time.time()))
+                if thread.is_alive():
+                    return False
+        return True
+
+    def _expand(self, package):
+        with self.lock:
+            dirs = self.unexpanded.pop(package, ())
+        prefix = package + '.'
+        try:
+            for entry, path, ancestors, names, subdirs, mtime in dirs:
+                for name in subdirs:
+                    self._scan(entry, os.path.join(path, name),
+                               prefix + name + '.', ancestors)
+                self._add(entry, [_decode(prefix + name) for name in names
+                                  if name != '__init__'])
+                self._record(path, entry, prefix, ancestors, names, subdirs,
+                             mtime)
+        except Exception:
+            logger.exception('Searching package %s for modules failed',
+                             package)
+        finally:
+            with self.lock:
+                del self.expanding[package]
+
+    def _submit(self, task):
+        with self.lock:
+            self.pending += 1
+        self.tasks.put(task)
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            try:
+                self._scan(*task)
+            except Exception:
+                logger.exception('Searching %s for modules failed', task[1])
+            finally:
+                with self.lock:
+                    self.pending -= 1
+                    done = not self.pending
+                if done:
+                    self._finish()
+
+    def _scan(self, entry, path, prefix, ancestors, submit=None):
+        """Search directory `path` of path entry `entry`, which contains
+        the modules of package `prefix` if it is a package at all. Tasks
+        for subdirectories are passed to `submit`, by default they are
+        queued for the workers."""
+        if submit is None:
+            submit = self._submit
+        try:
+            st = os.stat(path)
+        except EnvironmentError:
+            st = None
+        if st is None or not stat.S_ISDIR(st.st_mode):
+            if not prefix:
+                # Perhaps a zip file
+                self._add(entry, [_decode(name) for name in
+                                  _archive_contents(path, self.cache, entry)])
+            return
+        if st.st_ino:
+            key = (st.st_dev, st.st_ino)
+        else:
+            # No inode numbers, e.g. on Windows
+            key = os.path.normcase(os.path.realpath(path))
+        # A symlink loop: the package is there, but don't descend into it
+        loop = key in ancestors
+        if not loop:
+            with self.lock:
+                if (key, prefix) in self.seen:
+                    return
+                self.seen.add((key, prefix))
+
+        is_package, names, subdirs = _directory_contents(path, st.st_mtime,
+                                                         self.cache, entry)
+        batch = []
+        if prefix:
+            if not is_package:
+                self._record(path, entry, prefix, ancestors + (key, ), None,
+                             subdirs, st.st_mtime)
+                return
+            batch.append(_decode(prefix[:-1]))
+        if loop:
+            self._add(entry, batch)
+            return
+        if self.lazy and prefix:
+            # Search the package once its name is typed
+            with self.lock:
+                self.unexpanded.setdefault(prefix[:-1], []).append(
+                    (entry, path, ancestors + (key, ), names, subdirs,
+                     st.st_mtime))
+            self._add(entry, batch)
+            return
+        for name in subdirs:
+            submit((entry, os.path.join(path, name), prefix + name + '.',
+                    ancestors + (key, )))
+
+        for name in names:
+            if prefix and name == '__init__':
+                continue
+            batch.append(_decode(prefix + name))
+        self._add(entry, batch)
+        self._record(path, entry, prefix, ancestors + (key, ), names, subdirs,
+                     st.st_mtime)
+
+    def _record(self, path, entry, prefix, ancestors, names, subdirs, mtime):
+        """Remember the contents of directory `path`, which had mtime
+        `mtime`, to update `modules` when it changes."""
+        if not self.watch:
+            return
+        with self.lock:
+            self.directories[path] = (entry, prefix, ancestors, names, subdirs)
+            self.mtimes[path] = (mtime, time.time())
+
+    def update_directory(self, path):
+        """Search directory `path` again after it changed. Only the names of
+        the modules and packages which appeared or disappeared in it are
+        added to or removed from `modules`."""
+        with self.lock:
+            record = self.directories.get(path)
+        if record is None:
+            return
+        entry, prefix, ancestors, old_names, old_subdirs = record
+        try:
+            mtime = os.stat(path).st_mtime
+        except EnvironmentError:
+            mtime = None
+        is_package, names, subdirs = _scan_directory(path)
+        if old_names is None:
+            if not is_package:
+                with self.lock:
+                    self.mtimes[path] = (mtime, time.time())
+                return
+            # It became a package, search it like a new one
+            with self.lock:
+                del self.directories[path]
+                self.mtimes.pop(path, None)
+                self.seen.discard((ancestors[-1], prefix))
+            tasks = [(entry, path, prefix, ancestors[:-1])]
+            while tasks:
+                self._scan(*tasks.pop(), submit=tasks.append)
+            return
+        if prefix and not is_package:
+            self._forget(path, prefix[:-1])
+            self._record(path, entry, prefix, ancestors, None, subdirs,
+                         mtime)
+            return
+        with self.lock:
+            self.directories[path] = (entry, prefix, ancestors, names, subdirs)
+            self.mtimes[path] = (mtime, time.time())
+
+        for name in set(old_subdirs).difference(subdirs):
+            self._forget(os.path.join(path, name), prefix + name)
+        removed = set(old_names).difference(names)
+        added = set(names).difference(old_names)
+        if prefix:
+            removed.discard('__init__')
+            added.discard('__init__')
+        modules.difference_update(_decode(prefix + name) for name in removed)
+        self._add(entry, [_decode(prefix + name) for name in added])
+        # New packages are searched right away
+        tasks = [(entry, os.path.join(path, name), prefix + name + '.',
+                  ancestors) for name in set(subdirs).difference(old_subdirs)]
+        while tasks:
+            self._scan(*tasks.pop(), submit=tasks.append)
+
+    def _forget(self, path, package):
+        """Remove the modules of `package` in directory `path` and below."""
+        subpath = os.path.join(path, '')
+        with self.lock:
+            for dirpath in list(self.directories):
+                if dirpath == path or dirpath.startswith(subpath):
+                    _, prefix, ancestors, _, _ = self.directories.pop(dirpath)
+                    self.mtimes.pop(dirpath, None)
+                    self.seen.discard((ancestors[-1], prefix))
+            for name in list(self.unexpanded):
+                if name == package or name.startswith(package + '.'):
+                    for record in self.unexpanded.pop(name):
+                        self.seen.discard((record[2][-1], name + '.'))
+        name = _decode(package)
+        if name is not None:
+            modules.difference_update(modules.subtree(name))
+
+    def _add(self, entry, batch):
+        """Add the modules in `batch` found in path entry `entry`."""
+        batch = [name for name in batch if name is not None]
+        if self.cache is not None:
+            for name in batch:
+                self.cache.add_module(entry, name)
+        if self.found is not None:
+            with self.lock:
+                self.found.update(batch)
+        modules.update(batch)
+
+    def _finish(self):
+        global fully_loaded
+        if self.found is not None:
+            # Forget about cached modules that are gone by now
+            modules.intersection_update(self.found)
+        if self.cache is not None:
+            self.cache.save()
+        if self.watcher is not None:
+            self.watcher.watch_entries()
+        for _ in range(self.workers):
+            self.tasks.put(None)
         fully_loaded = True
+        self.finished.set()
 
-    return True
+    def revalidate(self):
+        """Search the directories of the path entries which are not watched
+        again if their mtime changed, in the background. Does nothing if
+        the scan is not finished yet, or the directories were checked less
+        than `revalidate_interval` seconds ago."""
+        if not self.watch or self.running:
+            return
+        with self.lock:
+            if (self.revalidating or
+                    time.time() - self.revalidated < revalidate_interval):
+                return
+            self.revalidating = True
+        thread = threading.Thread(target=self._revalidate)
+        thread.daemon = True
+        thread.start()
+
+    def _revalidate(self):
+        try:
+            with self.lock:
+                mtimes = list(self.mtimes.items())
+                entries = dict((path, self.directories[path][0])
+                               for path, _ in mtimes)
+            # Parents first, changes of subdirectories might be moot then
+            for path, (mtime, searched) in sorted(mtimes):
+                if (self.watcher is not None and
+                        self.watcher.watching(entries[path])):
+                    continue
+                try:
+                    st = os.stat(path)
+                except EnvironmentError:
+                    if mtime is None:
+                        continue
+                else:
+                    if (st.st_mtime == mtime and
+                            searched - mtime > MTIME_RESOLUTION):
+                        continue
+                self.update_directory(path)
+        except Exception:
+            logger.exception('Checking the module directories failed')
+        finally:
+            with self.lock:
+                self.revalidating = False
+                self.revalidated = time.time()
+
+
+class ModuleIndexWatcher(FileSystemEventHandler):
+    """Watch the path entries searched by a `ModuleScanner` with watchdog
+    and let the scanner update `modules` when files or directories appear
+    or disappear in them.
+
+    Every path entry gets one recursive watch, i.e. one inotify instance
+    and thread on Linux, and at most `max_watches` of them are used. As
+    every directory below an entry takes an inotify watch of the user's
+    limited number, an entry is not watched if that would make the
+    directories searched in watched entries more than `max_directories`.
+    The scanner checks the mtimes of the entries not watched instead.
+
+    Events are coalesced: the changed directories are collected until no
+    event arrived for `delay` seconds, and each of them is searched once.
+    """
+
+    def __init__(self, scanner, delay=0.5, max_watches=16,
+                 max_directories=4096):
+        self.scanner = scanner
+        self.delay = delay
+        self.max_watches = max_watches
+        self.max_directories = max_directories
+        self.observer = Observer()
+        # For each path entry watched, the watch and the number of
+        # directories searched in it
+        self.watches = dict()
+        self.dirty = set()
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.observer.start()
+
+    def stop(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        self.observer.stop()
+        self.observer.join()
+
+    def watch_entries(self):
+        """Watch the path entries of the scanner, in order, as long as the
+        limits allow it."""
+        counts = dict()
+        with self.scanner.lock:
+            for record in self.scanner.directories.itervalues():
+                counts[record[0]] = counts.get(record[0], 0) + 1
+        for entry in self.scanner.entries:
+            if entry in counts:
+                self.watch(entry, counts.pop(entry))
+
+    def watch(self, entry, directories):
+        """Watch the `directories` directories of path entry `entry` unless
+        the limits are reached. Returns whether the entry is watched."""
+        with self.lock:
+            if entry in self.watches:
+                return True
+            for watched in self.watches:
+                if entry.startswith(os.path.join(watched, '')):
+                    # Watched already, as part of `watched`
+                    self.watches[entry] = (None, 0)
+                    return True
+            watches = [count for watch, count in self.watches.itervalues()
+                       if watch is not None]
+            used = sum(watches)
+            if (len(watches) >= self.max_watches or
+                    used + directories > self.max_directories):
+                logger.debug('Not watching %s for new modules: %d watches '
+                             'of %d directories', entry, len(watches), used)
+                return False
+        try:
+            watch = self.observer.schedule(self, entry, recursive=True)
+        except Exception:
+            # E.g. the inotify instance or watch limit is reached
+            logger.debug('Cannot watch %s for new modules', entry,
+                         exc_info=True)
+            try:
+                # The emitter stays scheduled if it failed to start
+                self.observer.unschedule(ObservedWatch(entry, True))
+            except Exception:
+                pass
+            return False
+        with self.lock:
+            self.watches[entry] = (watch, directories)
+        return True
+
+    def watching(self, entry):
+        """Whether path entry `entry` is watched."""
+        with self.lock:
+            return entry in self.watches
+
+    def on_any_event(self, event):
+        # Only the names of files and directories matter
+        if event.event_type not in ('created', 'deleted', 'moved'):
+            return
+        paths = [event.src_path]
+        if event.event_type == 'moved':
+            paths.append(event.dest_path)
+        with self.lock:
+            for path in paths:
+                self.dirty.add(os.path.dirname(path))
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """Search all changed directories again."""
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = set()
+            self.timer = None
+        # Parents first, changes of subdirectories might be moot then
+        for path in sorted(dirty, key=len):
+            try:
+                self.scanner.update_directory(path)
+            except Exception:
+                logger.exception('Searching %s for modules failed', path)
+
+
+def start_scan(policy=EAGER):
+    """Start searching `sys.path` for modules in the background, unless that
+    happened already. Returns the `ModuleScanner`.
+
+    With the `LAZY` policy, packages are only searched once their name is
+    completed. If watchdog is available, the module list is kept up to date
+    when modules are installed or removed during the session."""
+    global scanner
+    if scanner is None:
+        scanner = ModuleScanner(lazy=(policy == LAZY), watch=True)
+        scanner.start()
+    return scanner
 
 
 def reload():
-    """Refresh the list of known modules."""
+    """Forget all known modules and search `sys.path` again in the
+    background, with the policy of the previous scan. Returns the new
+    `ModuleScanner`."""
+    global scanner
+    policy = EAGER
+    if scanner is not None:
+        if scanner.lazy:
+            policy = LAZY
+        scanner.join()
+        if scanner.watcher is not None:
+            scanner.watcher.stop()
+        scanner = None
     modules.clear()
-    for _ in find_all_modules():
-        pass
-
-find_iterator = find_all_modules()
+    return start_scan(policy)
@@ -27,7 +27,9 @@ import inspect
 import keyword
 import pydoc
 import re
+import threading
 import types
+import weakref
 
 from pygments.token import Token
 
@@ -48,6 +50,11 @@ if not py3:
     _name = re.compile(r'[a-zA-Z_]\w*$')
 
 
+# Held while an AttrCleaner has replaced the methods of a type, so that
+# another thread doesn't save the replacements as the original methods
+_attr_cleaner_lock = threading.RLock()
+
+
 class AttrCleaner(object):
     """A context manager that tries to make an object not exhibit side-effects
        on attribute lookup."""
@@ -58,6 +65,7 @@ class AttrCleaner(object):
     def __enter__(self):
         """Try to make an object not exhibit side-effects on attribute
         lookup."""
+        _attr_cleaner_lock.acquire()
         type_ = type(self.obj)
         __getattribute__ = None
         __getattr__ = None
@@ -97,6 +105,137 @@ class AttrCleaner(object):
         if __getattr__ is not None:
             setattr(type_, '__getattr__', __getattr__)
         # /Dark magic
+        _attr_cleaner_lock.release()
+
+
+# The descriptors behind type.__dict__ and type.__mro__, to look these up
+# without going through a metaclass's __getattribute__
+_type_dict = type.__dict__['__dict__'].__get__
+_type_mro = type.__dict__['__mro__'].__get__
+
+
+# The type flag set for classes defined in Python rather than in C
+_HEAPTYPE = 1 << 9
+_type_flags = type.__dict__['__flags__'].__get__
+
+# The methods by which a class can provide attributes its __dict__s don't
+# list, see has_attribute_hooks()
+_ATTRIBUTE_HOOKS = ('__dir__', '__getattr__', '__getattribute__')
+
+
+def _is_old_style_class(obj):
+    return has_instance_type and isinstance(obj, types.ClassType)
+
+
+def _static_mro(klass):
+    """Returns the classes attributes of `klass` are looked up in."""
+    if _is_old_style_class(klass):
+        # Depth first, like old-style attribute lookup
+        classes = [klass]
+        for base in klass.__bases__:
+            classes.extend(_static_mro(base))
+        return classes
+    return _type_mro(klass)
+
+
+def _static_dict(klass):
+    if _is_old_style_class(klass):
+        return klass.__dict__
+    return _type_dict(klass)
+
+
+# For each class, the version (see _class_version) and names of the
+# attributes of its instances, see class_attributes()
+_class_attributes = weakref.WeakKeyDictionary()
+
+
+def _class_version(mro):
+    """Changes when attributes are added to or removed from the classes
+    `mro`. CPython's version tags of types aren't available from Python, so
+    the names of the attributes of the classes which can change, those
+    defined in Python, are used instead."""
+    return tuple(frozenset(_static_dict(klass))
+                 if _is_old_style_class(klass) or
+                 _type_flags(klass) & _HEAPTYPE else None
+                 for klass in mro)
+
+
+def class_attributes(klass):
+    """Returns the names of the attributes `klass` and its bases define.
+
+    The names are found in the classes' __dict__s without calling anything
+    defined by them, and cached per class until attributes are added to or
+    removed from one of the classes."""
+    mro = _static_mro(klass)
+    version = _class_version(mro)
+    try:
+        cached = _class_attributes.get(klass)
+    except TypeError:
+        # not weakly referenceable
+        cached = None
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    names = set()
+    for base in mro:
+        names.update(_static_dict(base))
+    names = frozenset(names)
+    try:
+        _class_attributes[klass] = (version, names)
+    except TypeError:
+        pass
+    return names
+
+
+def static_attributes(obj):
+    """Returns the names of the attributes of `obj`, like dir(obj) and the
+    attributes of its class, but without calling __dir__, __getattr__,
+    __getattribute__ or any other code of `obj` or its class: the names are
+    read from its __dict__ and its classes' __dict__s."""
+    if has_instance_type and isinstance(obj, types.InstanceType):
+        # Old-style instances look up __class__ and __dict__ themselves
+        klass = obj.__class__
+        instance_dict = obj.__dict__
+    else:
+        klass = type(obj)
+        try:
+            instance_dict = object.__getattribute__(obj, '__dict__')
+        except Exception:
+            instance_dict = None
+
+    names = set(class_attributes(klass))
+    names.add('__class__')
+    if isinstance(obj, type) or _is_old_style_class(obj):
+        names.update(class_attributes(obj))
+    elif isinstance(instance_dict, dict):
+        names.update(name for name in instance_dict
+                     if isinstance(name, str))
+    return names
+
+
+def has_attribute_hooks(obj):
+    """Whether the class of `obj` or one of its bases defined in Python has
+    a __dir__, __getattr__ or __getattribute__ method. The attributes of
+    such objects might not be found by static_attributes, only by dir()."""
+    if has_instance_type and isinstance(obj, types.InstanceType):
+        klass = obj.__class__
+    else:
+        klass = type(obj)
+    for base in _static_mro(klass):
+        if _is_old_style_class(base) or _type_flags(base) & _HEAPTYPE:
+            names = _static_dict(base)
+            if any(hook in names for hook in _ATTRIBUTE_HOOKS):
+                return True
+    return False
+
+
+def is_callable_static(obj):
+    """Like is_callable, but without calling any code of `obj` or its
+    class."""
+    if has_instance_type and isinstance(obj, types.InstanceType):
+        # callable() would look up __call__ through __getattr__
+        return '__call__' in class_attributes(obj.__class__)
+    return callable(obj)
 
 class _Repr(object):
     """
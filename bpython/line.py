@@ -4,63 +4,295 @@ All functions take cursor offset from the beginning of the line and the line of
 and return None, or a tuple of the start index, end index, and the word"""
 
 import re
-from itertools import chain
+from bisect import bisect_left
+
+# Runs of characters, matched where a part of the line may start. None of
+# these can backtrack, so matching them is linear in the length of the run.
+_name_re = re.compile(r'[\w.]+')
+_current_word_re = re.compile(r'\w[\w.]*[(]?')
+_single_word_re = re.compile(r'(?<![\w.])[a-zA-Z_]\w*')
+_dotted_name_re = re.compile(r'[\w.]*')
+_word_re = re.compile(r'\w*')
+_nonempty_word_re = re.compile(r'\w+')
+_identifier_re = re.compile(r'[a-zA-Z_]\w*')
+_dict_key_re = re.compile(r'''[\w.(), '"]*''')
+_whitespace_re = re.compile(r'\s*')
+_next_word_re = re.compile(r', (\w*)')
+_next_dotted_name_re = re.compile(r', ([\w.]*)')
+_quote_re = re.compile(r'''\\+|['"]''')
+# These two don't backtrack over the rest of the line either: a string
+# either ends at the next delimiter or lasts until the end of the line, and
+# a from import ends where the names imported do. So each match only looks
+# at the characters it consumes.
+_string_re = re.compile(r'''("""|"|\'\'\'|')(?:(.+?)\1|(.+))''')
+_from_import_re = re.compile(r'from ([\w.]*)(?:\s+import\s+(\w+,?\s*)+)*')
+
+
+class LineScanner(object):
+    """The parts of a line the functions of this module look for, for any
+    cursor position.
+
+    Instead of matching regular expressions which backtrack over the whole
+    line for every part, each kind of part is found with one left to right
+    pass over the line, the first time it is asked for: with expressions
+    which only match runs of characters or otherwise never look further
+    than they consume, or over the runs of name characters, quotes and
+    backslashes. So the time taken is linear in the length of the line.
+    The results are the same as those of the regular expressions the
+    functions of this module used to match."""
+
+    def __init__(self, line):
+        self.line = line
+        self._spans = dict()
+
+    def _find(self, kind):
+        # Most kinds are only asked for once, so avoid raising KeyError
+        spans = self._spans.get(kind)
+        if spans is None:
+            spans = self._spans[kind] = getattr(self, '_find_' + kind)()
+        return spans
+
+    def _find_names(self):
+        # Runs of word characters and dots: dotted names and numbers
+        return [m.span() for m in _name_re.finditer(self.line)]
+
+    def _find_words(self):
+        return [m.span() for m in _current_word_re.finditer(self.line)]
+
+    def _find_dicts(self):
+        # The name before a [ and the key after it. The key consumes names,
+        # so a name inside a key isn't the start of another dict.
+        line = self.line
+        if '[' not in line:
+            return []
+        dicts = []
+        key_end = 0
+        for start, end in self._find('names'):
+            if start < key_end or line[end:end + 1] != '[':
+                continue
+            start = end - len(line[start:end].lstrip('.'))
+            if start == end:
+                continue
+            key_end = _dict_key_re.match(line, end + 1).end()
+            dicts.append((start, end, end + 1, key_end))
+        return dicts
+
+    def _find_single_words(self):
+        # Names which don't follow a dot, up to the first dot
+        return [m.span() for m in _single_word_re.finditer(self.line)]
+
+    def _find_strings(self):
+        # Unclosed strings last until the end of the line, and no string
+        # spans several lines.
+        return [m.span(2) if m.start(2) != -1 else m.span(3)
+                for m in _string_re.finditer(self.line)]
+
+    def _find_string_literal_attrs(self):
+        # The attribute after a closed string literal. A string ends at the
+        # first unescaped delimiter after its start; escapes are the same for
+        # every start, as a run of backslashes always lies within the string.
+        line = self.line
+        if "'." not in line and '".' not in line:
+            return []
+        quotes = []
+        delimiters = dict()
+        # Backslashes escaping a line break or nothing end every string
+        dangling = []
+        escaped = -1
+        for m in _quote_re.finditer(line):
+            start, end = m.span()
+            if line[start] == '\\':
+                if (end - start) % 2:
+                    if end == len(line) or line[end] == '\n':
+                        dangling.append(end - 1)
+                    else:
+                        escaped = end
+                continue
+            quotes.append(start)
+            if start == escaped:
+                continue
+            for delimiter in (line[start], line[start] * 3):
+                if line.startswith(delimiter, start):
+                    delimiters.setdefault(delimiter, []).append(start)
+
+        attrs = []
+        pos = 0
+        for quote in quotes:
+            if quote < pos:
+                continue
+            for delimiter in (line[quote] * 3, line[quote]):
+                if not line.startswith(delimiter, quote):
+                    continue
+                start = quote + len(delimiter)
+                closes = delimiters.get(delimiter, [])
+                i = bisect_left(closes, start)
+                if i == len(closes):
+                    continue
+                close = closes[i]
+                i = bisect_left(dangling, start)
+                if i < len(dangling) and dangling[i] < close:
+                    continue
+                dot = close + len(delimiter)
+                if line[dot:dot + 1] != '.':
+                    continue
+                pos = _word_re.match(line, dot + 1).end()
+                attrs.append((dot + 1, pos))
+                break
+        return attrs
+
+    def _find_from_imports(self):
+        # The module and the last name imported of every from import
+        return [m.span(1) + m.span(2)
+                for m in _from_import_re.finditer(self.line)]
+
+    def _find_from_import_names(self):
+        line = self.line
+        pos = 0
+        while True:
+            start = line.find('from', pos)
+            if start == -1:
+                return []
+            pos = start + 1
+            if _whitespace_re.match(line, start + 4, start + 5).end() == start + 4:
+                continue
+            end = _dotted_name_re.match(line, start + 5).end()
+            i = _whitespace_re.match(line, end).end()
+            if i > end and line.startswith('import', i):
+                return self._import_names(i + len('import'),
+                                          _nonempty_word_re, _next_word_re)
+
+    def _find_imports(self):
+        start = self.line.find('import')
+        if start == -1:
+            return []
+        return self._import_names(start + len('import'), _name_re,
+                                  _next_dotted_name_re)
+
+    def _import_names(self, pos, first_re, next_re):
+        # The first name after pos, and every name after a comma and a space
+        first = first_re.search(self.line, pos)
+        if first is None:
+            return []
+        return [first.span()] + [m.span(1)
+                                 for m in next_re.finditer(self.line, pos)]
+
+    def _find_method_definition_names(self):
+        line = self.line
+        names = []
+        pos = 0
+        while True:
+            start = line.find('def', pos)
+            if start == -1:
+                return names
+            pos = start + 1
+            i = _whitespace_re.match(line, start + 3).end()
+            if i == start + 3:
+                continue
+            m = _identifier_re.match(line, i)
+            if m is not None:
+                names.append(m.span())
+                pos = m.end()
+
+    def _at(self, kind, cursor_offset, after_start=False):
+        # The first span of this kind containing the cursor, or just after
+        # its start if after_start is true
+        for start, end in self._find(kind):
+            if start > cursor_offset:
+                break
+            if start < cursor_offset or not after_start:
+                if end >= cursor_offset:
+                    return start, end, self.line[start:end]
+        return None
 
+    def current_word(self, cursor_offset):
+        return self._at('words', cursor_offset, after_start=True)
 
-current_word_re = re.compile(r'[\w_][\w0-9._]*[(]?')
+    def current_dict_key(self, cursor_offset):
+        line = self.line
+        for start, end, key_start, key_end in self._find('dicts'):
+            if key_start > cursor_offset:
+                break
+            if cursor_offset <= key_end:
+                return key_start, key_end, line[key_start:key_end]
+        return None
 
-def current_word(cursor_offset, line):
-    """the object.attribute.attribute just before or under the cursor"""
-    pos = cursor_offset
-    matches = current_word_re.finditer(line)
-    start = pos
-    end = pos
-    word = None
-    for m in matches:
-        if m.start() < pos and m.end() >= pos:
-            start = m.start()
-            end = m.end()
-            word = m.group()
-    if word is None:
+    def current_dict(self, cursor_offset):
+        line = self.line
+        for start, end, key_start, key_end in self._find('dicts'):
+            if key_start > cursor_offset:
+                break
+            if cursor_offset <= key_end:
+                return start, end, line[start:end]
         return None
-    return (start, end, word)
 
+    def current_string(self, cursor_offset):
+        return self._at('strings', cursor_offset)
+
+    def current_from_import_from(self, cursor_offset):
+        line = self.line
+        for start, end, name_start, name_end in self._find('from_imports'):
+            if (start < cursor_offset <= end or
+                    name_start < cursor_offset <= name_end):
+                return start, end, line[start:end]
+        return None
+
+    def current_from_import_import(self, cursor_offset):
+        return self._import_at('from_import_names', cursor_offset)
+
+    def current_import(self, cursor_offset):
+        return self._import_at('imports', cursor_offset)
+
+    def _import_at(self, kind, cursor_offset):
+        # Not sorted: the first name is looked at before the others
+        for start, end in self._find(kind):
+            if start < cursor_offset <= end:
+                return start, end, self.line[start:end]
+        return None
+
+    def current_method_definition_name(self, cursor_offset):
+        return self._at('method_definition_names', cursor_offset)
+
+    def current_single_word(self, cursor_offset):
+        return self._at('single_words', cursor_offset)
+
+    def current_string_literal_attr(self, cursor_offset):
+        return self._at('string_literal_attrs', cursor_offset)
+
+
+_last_scanner = None
+
+def scanner(line):
+    """The LineScanner of `line`. The scanner of the last line asked for is
+    reused, so moving the cursor doesn't scan the line again."""
+    global _last_scanner
+    last = _last_scanner
+    if last is not None and last.line == line:
+        return last
+    _last_scanner = LineScanner(line)
+    return _last_scanner
+
+
+def current_word(cursor_offset, line):
+    """the object.attribute.attribute just before or under the cursor"""
+    return scanner(line).current_word(cursor_offset)
 
-current_dict_key_re = re.compile(r'''[\w_][\w0-9._]*\[([\w0-9._(), '"]*)''')
 
 def current_dict_key(cursor_offset, line):
     """If in dictionary completion, return the current key"""
-    matches = current_dict_key_re.finditer(line)
-    for m in matches:
-        if m.start(1) <= cursor_offset and m.end(1) >= cursor_offset:
-            return (m.start(1), m.end(1), m.group(1))
-    return None
-
+    return scanner(line).current_dict_key(cursor_offset)
 
-current_dict_re = re.compile(r'''([\w_][\w0-9._]*)\[([\w0-9._(), '"]*)''')
 
 def current_dict(cursor_offset, line):
     """If in dictionary completion, return the dict that should be used"""
-    matches = current_dict_re.finditer(line)
-    for m in matches:
-        if m.start(2) <= cursor_offset and m.end(2) >= cursor_offset:
-            return (m.start(1), m.end(1), m.group(1))
-    return None
+    return scanner(line).current_dict(cursor_offset)
 
 
-current_string_re = re.compile(
-    '''(?P<open>(?:""")|"|(?:''\')|')(?:((?P<closed>.+?)(?P=open))|(?P<unclosed>.+))''')
-
 def current_string(cursor_offset, line):
     """If inside a string of nonzero length, return the string (excluding quotes)
 
     Weaker than bpython.Repl's current_string, because that checks that a string is a string
     based on previous lines in the buffer"""
-    for m in current_string_re.finditer(line):
-        i = 3 if m.group(3) else 4
-        if m.start(i) <= cursor_offset and m.end(i) >= cursor_offset:
-            return m.start(i), m.end(i), m.group(i)
-    return None
+    return scanner(line).current_string(cursor_offset)
 
 
 current_object_re = re.compile(r'([\w_][\w0-9_]*)[.]')
@@ -97,8 +329,6 @@ def current_object_attribute(cursor_offset, line):
     return None
 
 
-current_from_import_from_re = re.compile(r'from ([\w0-9_.]*)(?:\s+import\s+([\w0-9_]+[,]?\s*)+)*')
-
 def current_from_import_from(cursor_offset, line):
     """If in from import completion, the word after from
 
@@ -109,97 +339,119 @@ def current_from_import_from(cursor_offset, line):
     tokens = line.split()
     if not ('from' in tokens or 'import' in tokens):
         return None
-    matches = current_from_import_from_re.finditer(line)
-    for m in matches:
-        if ((m.start(1) < cursor_offset and m.end(1) >= cursor_offset) or
-            (m.start(2) < cursor_offset and m.end(2) >= cursor_offset)):
-            return m.start(1), m.end(1), m.group(1)
-    return None
-
+    return scanner(line).current_from_import_from(cursor_offset)
 
-current_from_import_import_re_1 = re.compile(r'from\s([\w0-9_.]*)\s+import')
-current_from_import_import_re_2 = re.compile(r'([\w0-9_]+)')
-current_from_import_import_re_3 = re.compile(r'[,][ ]([\w0-9_]*)')
 
 def current_from_import_import(cursor_offset, line):
     """If in from import completion, the word after import being completed
 
     returns None if cursor not in or just after one of these words
     """
-    baseline = current_from_import_import_re_1.search(line)
-    if baseline is None:
-        return None
-    match1 = current_from_import_import_re_2.search(line[baseline.end():])
-    if match1 is None:
-        return None
-    matches = current_from_import_import_re_3.finditer(line[baseline.end():])
-    for m in chain((match1, ), matches):
-        start = baseline.end() + m.start(1)
-        end = baseline.end() + m.end(1)
-        if start < cursor_offset and end >= cursor_offset:
-            return start, end, m.group(1)
-    return None
-
+    return scanner(line).current_from_import_import(cursor_offset)
 
-current_import_re_1 = re.compile(r'import')
-current_import_re_2 = re.compile(r'([\w0-9_.]+)')
-current_import_re_3 = re.compile(r'[,][ ]([\w0-9_.]*)')
 
 def current_import(cursor_offset, line):
     #TODO allow for multiple as's
-    baseline = current_import_re_1.search(line)
-    if baseline is None:
-        return None
-    match1 = current_import_re_2.search(line[baseline.end():])
-    if match1 is None:
-        return None
-    matches = current_import_re_3.finditer(line[baseline.end():])
-    for m in chain((match1, ), matches):
-        start = baseline.end() + m.start(1)
-        end = baseline.end() + m.end(1)
-        if start < cursor_offset and end >= cursor_offset:
-            return start, end, m.group(1)
-
+    return scanner(line).current_import(cursor_offset)
 
-current_method_definition_name_re = re.compile("def\s+([a-zA-Z_][\w]*)")
 
 def current_method_definition_name(cursor_offset, line):
     """The name of a method being defined"""
-    matches = current_method_definition_name_re.finditer(line)
-    for m in matches:
-        if (m.start(1) <= cursor_offset and m.end(1) >= cursor_offset):
-            return m.start(1), m.end(1), m.group(1)
-    return None
+    return scanner(line).current_method_definition_name(cursor_offset)
 
 
-current_single_word_re = re.compile(r"(?<![.])\b([a-zA-Z_][\w]*)")
-
 def current_single_word(cursor_offset, line):
     """the un-dotted word just before or under the cursor"""
-    matches = current_single_word_re.finditer(line)
-    for m in matches:
-        if (m.start(1) <= cursor_offset and m.end(1) >= cursor_offset):
-            return m.start(1), m.end(1), m.group(1)
-    return None
+    return scanner(line).current_single_word(cursor_offset)
 
 
 def current_dotted_attribute(cursor_offset, line):
     """The dotted attribute-object pair before the cursor"""
-    match = current_word(cursor_offset, line)
+    return _dotted_attribute(current_word(cursor_offset, line))
+
+def _dotted_attribute(match):
     if match is None: return None
     start, end, word = match
     if '.' in word[1:]:
         return start, end, word
 
 
-current_string_literal_attr_re = re.compile(
-    "('''" +
-    r'''|"""|'|")((?:(?=([^"'\\]+|\\.|(?!\1)["']))\3)*)\1[.]([a-zA-Z_]?[\w]*)''')
-
 def current_string_literal_attr(cursor_offset, line):
     """The attribute following a string literal"""
-    matches = current_string_literal_attr_re.finditer(line)
-    for m in matches:
-        if (m.start(4) <= cursor_offset and m.end(4) >= cursor_offset):
-            return m.start(4), m.end(4), m.group(4)
-    return None
+    return scanner(line).current_string_literal_attr(cursor_offset)
+
+
+class LineContext(object):
+    """The parts of a line around the cursor, as found by the functions of
+    this module. Each part is only looked for once, the first time it is
+    asked for, so all completers can share the work."""
+
+    def __init__(self, cursor_offset, line):
+        self.cursor_offset = cursor_offset
+        self.line = line
+        self._parts = dict()
+
+    def _part(self, function):
+        # Most parts are only asked for once, so avoid raising KeyError
+        parts = self._parts
+        if function not in parts:
+            parts[function] = function(self.cursor_offset, self.line)
+        return parts[function]
+
+    def tokens(self):
+        """The whitespace separated words of the line"""
+        tokens = self._parts.get('tokens')
+        if tokens is None:
+            tokens = self._parts['tokens'] = self.line.split()
+        return tokens
+
+    def current_word(self):
+        return self._part(current_word)
+
+    def current_dict_key(self):
+        return self._part(current_dict_key)
+
+    def current_dict(self):
+        return self._part(current_dict)
+
+    def current_string(self):
+        return self._part(current_string)
+
+    def current_from_import_from(self):
+        tokens = self.tokens()
+        if not ('from' in tokens or 'import' in tokens):
+            return None
+        return self._part(current_from_import_from)
+
+    def current_from_import_import(self):
+        return self._part(current_from_import_import)
+
+    def current_import(self):
+        return self._part(current_import)
+
+    def current_method_definition_name(self):
+        return self._part(current_method_definition_name)
+
+    def current_single_word(self):
+        return self._part(current_single_word)
+
+    def current_dotted_attribute(self):
+        return _dotted_attribute(self.current_word())
+
+    def current_string_literal_attr(self):
+        return self._part(current_string_literal_attr)
+
+
+_last_context = None
+
+def context(cursor_offset, line):
+    """The LineContext of `line` with the cursor at `cursor_offset`. The
+    context of the last line asked for is reused, so it is shared by all
+    completers completing the same keystroke."""
+    global _last_context
+    last = _last_context
+    if (last is not None and last.cursor_offset == cursor_offset and
+            last.line == line):
+        return last
+    _last_context = LineContext(cursor_offset, line)
+    return _last_context
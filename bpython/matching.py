@@ -0,0 +1,250 @@
+# The MIT License
+#
+# Copyright (c) 2015 the bpython authors.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Matching of names against the text typed by the user, and ranking of the
+matches.
+
+In simple mode, names match if they start with the text. In substring mode
+they need to contain it, and in fuzzy mode they need to contain its
+characters in order. Matches are ranked by how well they match: names
+starting with the text come first, then names containing it at the start of
+a word (after an underscore or at a capital letter), then names containing
+it elsewhere, and then names only containing its characters."""
+
+import bisect
+import heapq
+import re
+
+# Autocomplete modes
+SIMPLE = 'simple'
+SUBSTRING = 'substring'
+FUZZY = 'fuzzy'
+
+ALL_MODES = (SIMPLE, SUBSTRING, FUZZY)
+
+def _fuzzy_positions(name, text):
+    """Return the leftmost positions of the characters of `text` in `name`,
+    or None if they aren't all contained in order."""
+    positions = []
+    i = 0
+    for c in text:
+        i = name.find(c, i)
+        if i == -1:
+            return None
+        positions.append(i)
+        i += 1
+    return positions
+
+
+def is_match(name, text, mode=SIMPLE):
+    """Whether `name` matches `text` in `mode`."""
+    if mode == SIMPLE:
+        return name.startswith(text)
+    elif mode == SUBSTRING:
+        return text in name
+    return _fuzzy_positions(name, text) is not None
+
+
+def _word_start(name, i):
+    if i == 0:
+        return True
+    before, c = name[i - 1], name[i]
+    return (before == '_' and c != '_' or
+            c.isupper() and not before.isupper() or
+            c.isdigit() and not before.isdigit())
+
+
+def score(name, text):
+    """Return a sort key for how well `name` matches `text`: the better the
+    match, the smaller the key. `name` needs to match in fuzzy mode."""
+    pos = name.find(text)
+    if pos == 0:
+        return (0, 0, 0, len(name))
+    elif pos != -1:
+        return (1 if _word_start(name, pos) else 2, 0, pos, len(name))
+    positions = _fuzzy_positions(name, text)
+    word_starts = sum(1 for i in positions if _word_start(name, i))
+    spread = positions[-1] - positions[0] + 1 - len(text)
+    return (3, -word_starts, spread + positions[0], len(name))
+
+
+def rank(names, text, mode=SIMPLE, key=None, limit=None):
+    """Return `names` best match first, or sorted in simple mode. If `key`
+    is given, it is called with every name to get the part of the name
+    which was matched against `text`.
+
+    If `limit` is given, only the best `limit` names are ranked and the
+    others follow them sorted. The classes of matches of `score` are then
+    ranked one at a time, and names only containing the characters of
+    `text` are only scored if the better classes have too few names."""
+    if mode == SIMPLE or not text:
+        return sorted(names)
+    if key is None:
+        sort_key = lambda name: (score(name, text), name)
+    else:
+        sort_key = lambda name: (score(key(name), text), name)
+    if limit is None or len(names) <= limit:
+        return sorted(names, key=sort_key)
+
+    # Sort keys of the names starting with text, containing it at the
+    # start of a word and containing it elsewhere, in the order of `score`
+    starts, word_starts, contains, others = [], [], [], []
+    for name in names:
+        part = name if key is None else key(name)
+        pos = part.find(text)
+        if pos == 0:
+            starts.append((len(part), name))
+        elif pos == -1:
+            others.append(name)
+        elif _word_start(part, pos):
+            word_starts.append((pos, len(part), name))
+        else:
+            contains.append((pos, len(part), name))
+    ranked = []
+    for matches in (starts, word_starts, contains):
+        wanted = limit - len(ranked)
+        if len(matches) > wanted:
+            matches = heapq.nsmallest(wanted, matches)
+        else:
+            matches.sort()
+        ranked.extend(match[-1] for match in matches)
+        if len(ranked) == limit:
+            break
+    else:
+        ranked.extend(heapq.nsmallest(limit - len(ranked), others,
+                                      key=sort_key))
+    best = set(ranked)
+    return ranked + sorted(name for name in names if name not in best)
+
+
+def filter_names(names, text, mode=SIMPLE):
+    """Return the names of `names` matching `text` in `mode`."""
+    if mode == SIMPLE:
+        return [name for name in names if name.startswith(text)]
+    elif mode == SUBSTRING or len(text) == 1:
+        return [name for name in names if text in name]
+    search = re.compile('.*?'.join(re.escape(c) for c in text)).search
+    return [name for name in names if search(name)]
+
+
+def _grams(text, mode):
+    """Return the grams of `text` in `mode`, see `MatchIndex`: its
+    characters, and its pairs of adjacent characters for substring matching
+    or pairs of consecutive characters for fuzzy matching, which only need
+    to be in order."""
+    grams = list(text)
+    if mode == SUBSTRING:
+        grams.extend(text[i:i + 2] for i in range(len(text) - 1))
+    else:
+        grams.extend((text[i], text[i + 1]) for i in range(len(text) - 1))
+    return grams
+
+
+def _gram_filter(gram):
+    """Return a function telling whether a name contains `gram`."""
+    if isinstance(gram, tuple):
+        return re.compile('%s.*?%s' % (re.escape(gram[0]),
+                                       re.escape(gram[1])), re.DOTALL).search
+    return lambda name: gram in name
+
+
+class MatchIndex(object):
+    """A sorted list of names to be matched against many different texts.
+
+    Prefixes are looked up with bisection. For substring and fuzzy matching,
+    the index keeps posting lists: for a gram (see `_grams`), the sorted
+    names containing it. A text is only matched against the names of the
+    shortest posting list of its grams. A posting list is made with one pass
+    over the names when none of the grams of a text has one, or when the
+    shortest is longer than an eighth of the names. As the texts completed
+    extend each other while they are typed, most of them are looked up in
+    posting lists made for earlier ones. At most `max_postings` posting
+    lists are kept."""
+
+    max_postings = 64
+
+    def __init__(self, names=()):
+        self.names = sorted(set(names))
+        self._postings = dict()
+        # The grams of the posting lists, oldest first
+        self._grams = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        i = bisect.bisect_left(self.names, name)
+        return i < len(self.names) and self.names[i] == name
+
+    def add(self, name):
+        """Add `name` to the index unless it is in it already."""
+        i = bisect.bisect_left(self.names, name)
+        if i < len(self.names) and self.names[i] == name:
+            return
+        self.names.insert(i, name)
+        for gram in self._grams:
+            if _gram_filter(gram)(name):
+                bisect.insort(self._postings[gram], name)
+
+    def remove(self, name):
+        """Remove `name` from the index if it is in it."""
+        i = bisect.bisect_left(self.names, name)
+        if i == len(self.names) or self.names[i] != name:
+            return
+        del self.names[i]
+        for posting in self._postings.itervalues():
+            i = bisect.bisect_left(posting, name)
+            if i < len(posting) and posting[i] == name:
+                del posting[i]
+
+    def _posting(self, grams):
+        """Return the shortest posting list of `grams`, made first if there
+        is none or it is too long."""
+        best = None
+        missing = None
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is None:
+                missing = gram
+            elif best is None or len(posting) < len(best):
+                best = posting
+        if missing is not None and (best is None or
+                                    len(best) > len(self.names) // 8):
+            contains = _gram_filter(missing)
+            posting = [name for name in self.names if contains(name)]
+            self._postings[missing] = posting
+            self._grams.append(missing)
+            if len(self._grams) > self.max_postings:
+                del self._postings[self._grams.pop(0)]
+            if best is None or len(posting) < len(best):
+                best = posting
+        return best
+
+    def matches(self, text, mode=SIMPLE):
+        """Return the names matching `text` in `mode`, sorted."""
+        names = self.names
+        if mode == SIMPLE or not text:
+            start = end = bisect.bisect_left(names, text)
+            while end < len(names) and names[end].startswith(text):
+                end += 1
+            return names[start:end]
+        return filter_names(self._posting(_grams(text, mode)), text, mode)
@@ -42,7 +42,9 @@ from string import Template
 from urllib import quote as urlquote
 from urlparse import urlparse, urljoin
 
+from pygments.lexer import ExtendedRegexLexer, LexerContext
 from pygments.token import Token
+from pygments.util import guess_decode
 
 from bpython import inspection
 from bpython._py3compat import PythonLexer, py3
@@ -66,9 +68,17 @@ class Interpreter(code.InteractiveInterpreter):
 
         self.encoding = encoding or sys.getdefaultencoding()
         self.syntaxerror_callback = None
+        # Changes whenever code was run in locals
+        self.generation = 0
         # Unfortunately code.InteractiveInterpreter is a classic class, so no super()
         code.InteractiveInterpreter.__init__(self, locals)
 
+    def runcode(self, code_obj):
+        try:
+            code.InteractiveInterpreter.runcode(self, code_obj)
+        finally:
+            self.generation += 1
+
     if not py3:
 
         def runsource(self, source, filename='<input>', symbol='single',
@@ -154,6 +164,7 @@ class MatchesIterator(object):
         self.orig_cursor_offset = None   # cursor position in the original line
         self.orig_line = None            # original line (before match replacements)
         self.completer = None            # class describing the current type of completion
+        self._max_width = None           # matches, format and width, see max_width()
 
     def __nonzero__(self):
         """MatchesIterator is False when word hasn't been replaced yet"""
@@ -193,12 +204,39 @@ class MatchesIterator(object):
         result = start + len(match), self.orig_line[:start] + match + self.orig_line[end:]
         return result
 
+    def cseq(self):
+        """Returns the common sequence of the matches, or None if it doesn't
+        start with the current word, e.g. for substring or fuzzy matches"""
+        if len(self.matches) == 1:
+            return self.matches[0]
+        cseq = os.path.commonprefix(self.matches)
+        if not cseq.startswith(self.current_word):
+            return None
+        return cseq
+
+    def max_width(self, format=None):
+        """Returns the width of the widest match when formatted with
+        `format`. It is only computed again when the matches or the format
+        change."""
+        cached = self._max_width
+        if (cached is None or cached[0] is not self.matches or
+                cached[1] != format):
+            if format is None:
+                width = max(len(m) for m in self.matches)
+            else:
+                width = max(len(format(m)) for m in self.matches)
+            cached = self._max_width = (self.matches, format, width)
+        return cached[2]
+
     def is_cseq(self):
-        return bool(os.path.commonprefix(self.matches)[len(self.current_word):])
+        cseq = self.cseq()
+        return cseq is not None and bool(cseq[len(self.current_word):])
 
     def substitute_cseq(self):
         """Returns a new line by substituting a common sequence in, and update matches"""
-        cseq = os.path.commonprefix(self.matches)
+        cseq = self.cseq()
+        if cseq is None:
+            return self.orig_cursor_offset, self.orig_line
         new_cursor_offset, new_line = self.substitute(cseq)
         if len(self.matches) == 1:
             self.clear()
@@ -219,10 +257,12 @@ class MatchesIterator(object):
         self.completer = completer
         #assert self.completer.locate(self.orig_cursor_offset, self.orig_line) is not None, (self.completer.locate, self.orig_cursor_offset, self.orig_line)
         self.index = -1
+        self._max_width = None
         self.start, self.end, self.current_word = self.completer.locate(self.orig_cursor_offset, self.orig_line)
 
     def clear(self):
         self.matches = []
+        self._max_width = None
         self.cursor_offset = -1
         self.current_line = ''
         self.current_word = ''
@@ -304,9 +344,13 @@ class Repl(object):
         self.history = []
         self.evaluating = False
         self.matches_iter = MatchesIterator()
+        self.completion_cache = autocomplete.CompletionCache()
+        self.completion_budget = autocomplete.CompletionBudget()
         self.argspec = None
         self.current_func = None
         self.highlighted_paren = None
+        self.line_tokens = LineTokens()
+        self.brackets = BracketIndex()
         self._C = {}
         self.prev_block_finished = 0
         self.interact = Interaction(self.config)
@@ -396,17 +440,25 @@ class Repl(object):
         argspec() for it. On success, update self.argspec and return True,
         otherwise set self.argspec to None and return False"""
 
-        self.current_func = None
+        self.current_func, argspec = self.find_args(self.current_line)
+        if argspec:
+            self.argspec = argspec
+            return True
+        return False
+
+    def find_args(self, line):
+        """Return the function called by the unclosed parenthesis in `line`
+        and its argspec with the number or name of the current argument
+        appended. Either is None if it can't be found."""
 
         if not self.config.arg_spec:
-            return False
+            return None, None
 
         # Get the name of the current function and where we are in
         # the arguments
         stack = [['', 0, '']]
         try:
-            for (token, value) in PythonLexer().get_tokens(
-                self.current_line):
+            for (token, value) in PythonLexer().get_tokens(line):
                 if token is Token.Punctuation:
                     if value in '([{':
                         stack.append(['', 0, value])
@@ -437,9 +489,9 @@ class Repl(object):
             _, arg_number, _ = stack.pop()
             func, _, _ = stack.pop()
         except IndexError:
-            return False
+            return None, None
         if not func:
-            return False
+            return None, None
 
         try:
             f = self.get_object(func)
@@ -448,21 +500,19 @@ class Repl(object):
             # since user code is run in the case of descriptors
             # XXX: Make sure you raise here if you're debugging the completion
             # stuff !
-            return False
+            return None, None
 
         if inspect.isclass(f):
             try:
                 if f.__init__ is not object.__init__:
                     f = f.__init__
             except AttributeError:
-                return None
-        self.current_func = f
+                return None, None
 
-        self.argspec = inspection.getargspec(func, f)
-        if self.argspec:
-            self.argspec.append(arg_number)
-            return True
-        return False
+        argspec = inspection.getargspec(func, f)
+        if argspec:
+            argspec.append(arg_number)
+        return f, argspec
 
     def get_source_of_current_name(self):
         """Return the source code of the object which is bound to the
@@ -493,15 +543,16 @@ class Repl(object):
         if not self.get_args():
             self.argspec = None
         elif self.current_func is not None:
-            try:
-                self.docstring = pydoc.getdoc(self.current_func)
-            except IndexError:
-                self.docstring = None
-            else:
-                # pydoc.getdoc() returns an empty string if no
-                # docstring was found
-                if not self.docstring:
-                    self.docstring = None
+            self.docstring = self.find_docstring(self.current_func)
+
+    def find_docstring(self, func):
+        """Return the docstring of `func`, or None if it has none."""
+        try:
+            docstring = pydoc.getdoc(func)
+        except IndexError:
+            return None
+        # pydoc.getdoc() returns an empty string if no docstring was found
+        return docstring or None
 
     # What complete() does:
     # Should we show the completion box? (are there matches, or is there a docstring to show?)
@@ -527,15 +578,40 @@ class Repl(object):
 
         self.set_docstring()
 
-        matches, completer = autocomplete.get_completer_bpython(
-            cursor_offset=self.cursor_offset,
-            line=self.current_line,
+        matches, completer = self.find_matches(
+            self.cursor_offset, self.current_line, self.argspec,
+            '\n'.join(self.buffer + [self.current_line]))
+        return self.update_matches(matches, completer, tab)
+
+    def find_matches(self, cursor_offset, line, argspec, current_block):
+        """Return the matches for the cursor at `cursor_offset` in `line`
+        and the completer which found them, see
+        autocomplete.get_completer."""
+        return autocomplete.get_completer_bpython(
+            cursor_offset=cursor_offset,
+            line=line,
             locals_=self.interp.locals,
-            argspec=self.argspec,
-            current_block='\n'.join(self.buffer + [self.current_line]),
-            complete_magic_methods=self.config.complete_magic_methods)
+            argspec=argspec,
+            current_block=current_block,
+            complete_magic_methods=self.config.complete_magic_methods,
+            mode=self.config.autocomplete_mode,
+            cache=self.completion_cache,
+            namespace_generation=getattr(self.interp, 'generation', None),
+            budget=self.completion_budget)
+
+    def update_matches(self, matches, completer, tab=False):
+        """Show the matches found for the current line by find_matches, like
+        complete() does."""
         #TODO implement completer.shown_before_tab == False (filenames shouldn't fill screen)
 
+        skipped = self.completion_budget.take_skipped()
+        if skipped:
+            self.completion_notice('Completion too slow, skipped: %s' %
+                                   (', '.join(skipped), ))
+        if completer is not None and completer.truncated:
+            self.completion_notice('Too many matches, only showing %d' %
+                                   (len(matches), ))
+
         if len(matches) == 0:
             self.matches_iter.clear()
             return bool(self.argspec)
@@ -556,6 +632,11 @@ class Repl(object):
             assert len(matches) > 1
             return tab or completer.shown_before_tab
 
+    def completion_notice(self, message):
+        """Tell the user something about the completions shown, e.g. that
+        a completer was skipped because it took too long before."""
+        self.interact.notify(message)
+
     def format_docstring(self, docstring, width, height):
         """Take a string and try to format it into a sane list of strings to be
         put into the suggestion box."""
@@ -838,87 +919,69 @@ class Repl(object):
             iff that line is the not the current line
         """
 
-        source = '\n'.join(self.buffer + [s])
-        cursor = len(source) - self.cpos
+        lines = self.buffer + [s]
+        # Only the lines which changed since the last call are lexed again
+        all_tokens = self.line_tokens.tokens(lines)
+        if all_tokens[-1] and not all_tokens[-1][-1][1]:
+            # Split off the newline pygments ends the code with
+            all_tokens[-1] = all_tokens[-1][:-1]
+        tokens = all_tokens[-1]
+        line_tokens = list(tokens)
+        # Only the current line is walked to match the brackets, starting
+        # with the brackets left open by the lines before it
+        opened = self.brackets.open_brackets(all_tokens[:-1])
+        if opened is None:
+            return line_tokens
+        stack = list(opened)
+        lineno = len(self.buffer)
+        cursor = len(s) - self.cpos
         if self.cpos:
             cursor += 1
-        stack = list()
-        all_tokens = list(PythonLexer().get_tokens(source))
-        # Unfortunately, Pygments adds a trailing newline and strings with
-        # no size, so strip them
-        while not all_tokens[-1][1]:
-            all_tokens.pop()
-        all_tokens[-1] = (all_tokens[-1][0], all_tokens[-1][1].rstrip('\n'))
-        line = pos = 0
-        parens = dict(zip('{([', '})]'))
-        line_tokens = list()
-        saved_tokens = list()
-        search_for_paren = True
-        for (token, value) in split_lines(all_tokens):
+        pos = 0
+        for i, (token, value) in enumerate(tokens):
             pos += len(value)
-            if token is Token.Text and value == '\n':
-                line += 1
-                # Remove trailing newline
-                line_tokens = list()
-                saved_tokens = list()
-                continue
-            line_tokens.append((token, value))
-            saved_tokens.append((token, value))
-            if not search_for_paren:
-                continue
             under_cursor = (pos == cursor)
             if token is Token.Punctuation:
-                if value in parens:
+                if value in BracketIndex.brackets:
                     if under_cursor:
-                        line_tokens[-1] = (Parenthesis.UnderCursor, value)
+                        line_tokens[i] = (Parenthesis.UnderCursor, value)
                         # Push marker on the stack
                         stack.append((Parenthesis, value))
                     else:
-                        stack.append((line, len(line_tokens) - 1,
-                                      line_tokens, value))
-                elif value in parens.itervalues():
-                    saved_stack = list(stack)
-                    try:
-                        while True:
-                            opening = stack.pop()
-                            if parens[opening[-1]] == value:
-                                break
-                    except IndexError:
-                        # SyntaxError.. more closed parentheses than
-                        # opened or a wrong closing paren
-                        opening = None
-                        if not saved_stack:
-                            search_for_paren = False
-                        else:
-                            stack = saved_stack
+                        stack.append((lineno, i, value))
+                elif value in BracketIndex.opening:
+                    opening = BracketIndex.pop(stack, value)
+                    if opening is BracketIndex.unbalanced:
+                        break
                     if opening and opening[0] is Parenthesis:
                         # Marker found
-                        line_tokens[-1] = (Parenthesis, value)
-                        search_for_paren = False
+                        line_tokens[i] = (Parenthesis, value)
+                        break
                     elif opening and under_cursor and not newline:
                         if self.cpos:
-                            line_tokens[-1] = (Parenthesis.UnderCursor, value)
+                            line_tokens[i] = (Parenthesis.UnderCursor, value)
                         else:
                             # The cursor is at the end of line and next to
                             # the paren, so it doesn't reverse the paren.
                             # Therefore, we insert the Parenthesis token
                             # here instead of the Parenthesis.UnderCursor
                             # token.
-                            line_tokens[-1] = (Parenthesis, value)
-                        (lineno, i, tokens, opening) = opening
-                        if lineno == len(self.buffer):
-                            self.highlighted_paren = (lineno, saved_tokens)
-                            line_tokens[i] = (Parenthesis, opening)
-                        else:
+                            line_tokens[i] = (Parenthesis, value)
+                        (opening_lineno, j, opening) = opening
+                        if opening_lineno == lineno:
                             self.highlighted_paren = (lineno, list(tokens))
+                            line_tokens[j] = (Parenthesis, opening)
+                        else:
                             # We need to redraw a line
-                            tokens[i] = (Parenthesis, opening)
-                            self.reprint_line(lineno, tokens)
-                        search_for_paren = False
-                elif under_cursor:
-                    search_for_paren = False
-        if line != len(self.buffer):
-            return list()
+                            saved_tokens = all_tokens[opening_lineno]
+                            self.highlighted_paren = (opening_lineno,
+                                                      list(saved_tokens))
+                            saved_tokens = list(saved_tokens)
+                            saved_tokens[j] = (Parenthesis, opening)
+                            self.reprint_line(opening_lineno, saved_tokens)
+                        break
+            elif under_cursor:
+                break
         return line_tokens
 
     def clear_current_line(self):
@@ -1008,6 +1071,148 @@ def split_lines(tokens):
                 yield (Token.Text, newline)
 
 
+class _ContextLexer(ExtendedRegexLexer, PythonLexer):
+    """PythonLexer keeping its state in a LexerContext, where it is left
+    when the text is lexed, so that lexing can continue from there."""
+
+
+class LineTokens(object):
+    """Lexes the lines of a block of code one at a time.
+
+    The pygments state at the end of every line is kept with the line's
+    tokens, and a line is only lexed again if its text or the state at the
+    end of the line before it changed. So typing in the last line of a long
+    block doesn't lex the whole block on every keystroke.
+
+    Tokens spanning several lines are split into a token per line, so a
+    multi-line docstring is lexed as a String.Double rather than a
+    String.Doc, which are highlighted the same way."""
+
+    def __init__(self):
+        self.lexer = _ContextLexer()
+        # For every line: its text, the state at its start and its end, and
+        # its tokens
+        self.lines = []
+
+    def tokens(self, lines):
+        """Return the tokens of each of `lines`, as split_lines does, but
+        without the newlines."""
+        del self.lines[len(lines):]
+        state = ('root', )
+        all_tokens = []
+        for i, line in enumerate(lines):
+            if i < len(self.lines):
+                cached = self.lines[i]
+                if cached[0] == line and cached[1] == state:
+                    all_tokens.append(cached[3])
+                    state = cached[2]
+                    continue
+            tokens, end = self.lex(line, state)
+            if i < len(self.lines):
+                self.lines[i] = (line, state, end, tokens)
+            else:
+                self.lines.append((line, state, end, tokens))
+            all_tokens.append(tokens)
+            state = end
+        return all_tokens
+
+    def lex(self, line, state):
+        """Lex `line` starting in pygments state `state`. Returns its tokens
+        and the state at the end of the line."""
+        text = line
+        if not py3 and not isinstance(text, unicode):
+            # Decoded like PythonLexer.get_tokens does
+            text = guess_decode(text)[0]
+        # Like PythonLexer.get_tokens, which ends the code with a newline
+        context = LexerContext(text + '\n', 0, list(state))
+        tokens = list(split_lines((token, value) for _, token, value in
+                                  self.lexer.get_tokens_unprocessed(
+                                      context=context)))
+        # The newline split off last
+        tokens.pop()
+        return tokens, tuple(context.stack)
+
+
+class BracketIndex(object):
+    """The brackets left open at the end of every line of a block.
+
+    Brackets are matched like Repl.tokenize does: a closing bracket closes
+    the innermost opening bracket of its kind, and the brackets opened
+    after that one are dropped. A closing bracket without an opening one of
+    its kind is ignored, unless no bracket is open at all, in which case
+    the brackets of the block can't be matched anymore.
+
+    Like LineTokens, a line is only looked at again if its tokens or the
+    brackets open at its start changed. So matching the bracket under the
+    cursor in the current line only needs the brackets open at the end of
+    the line before it."""
+
+    brackets = dict(zip('{([', '})]'))
+    opening = dict(zip('})]', '{(['))
+
+    # Returned by pop for a closing bracket when no bracket is open
+    unbalanced = object()
+
+    def __init__(self):
+        # For every line: its tokens, and the brackets open at its start and
+        # at its end
+        self.lines = []
+
+    def open_brackets(self, lines):
+        """Return the brackets open after `lines`, the tokens of each line
+        as returned by LineTokens.tokens, as a tuple of (lineno, token index,
+        bracket), innermost last. Returns None if the brackets can't be
+        matched."""
+        del self.lines[len(lines):]
+        stack = ()
+        for lineno, tokens in enumerate(lines):
+            if lineno < len(self.lines):
+                cached = self.lines[lineno]
+                if cached[0] is tokens and cached[1] == stack:
+                    stack = cached[2]
+                    continue
+            end = self.match(lineno, tokens, stack)
+            if lineno < len(self.lines):
+                self.lines[lineno] = (tokens, stack, end)
+            else:
+                self.lines.append((tokens, stack, end))
+            stack = end
+        return stack
+
+    @classmethod
+    def match(cls, lineno, tokens, stack):
+        """Return the brackets open after the line `lineno` with tokens
+        `tokens`, if `stack` were open before it."""
+        if stack is None:
+            return None
+        stack = list(stack)
+        for i, (token, value) in enumerate(tokens):
+            if token is not Token.Punctuation:
+                continue
+            if value in cls.brackets:
+                stack.append((lineno, i, value))
+            elif value in cls.opening:
+                if cls.pop(stack, value) is cls.unbalanced:
+                    return None
+        return tuple(stack)
+
+    @classmethod
+    def pop(cls, stack, bracket):
+        """Remove the opening bracket closed by the closing bracket
+        `bracket` from `stack` and return it, along with the brackets opened
+        after it. Returns None if there is none, and `unbalanced` if no
+        bracket is open."""
+        opening = cls.opening[bracket]
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][-1] == opening:
+                found = stack[i]
+                del stack[i:]
+                return found
+        if not stack:
+            return cls.unbalanced
+        return None
+
+
 def token_is(token_type):
     """Return a callable object that returns whether a token is of the
     given type `token_type`."""
@@ -0,0 +1,463 @@
+# The MIT License
+#
+# Copyright (c) 2015 the bpython authors.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Names defined by modules which have not been imported, found by parsing
+their source code instead of executing it."""
+
+from __future__ import with_statement
+
+import ast
+import atexit
+import collections
+import hashlib
+import json
+import logging
+import os
+import Queue
+import subprocess
+import sys
+import threading
+import time
+
+from bpython import importcompletion
+from bpython import line as lineparts
+from bpython.matching import SIMPLE, filter_names
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the layout of the cache files changes
+CACHE_VERSION = 1
+
+# How long completion may wait for a module to be parsed
+timeout = 0.05
+
+# How long a module whose source was not found is not searched again
+missing_interval = 10.0
+
+# How many files with the names of parsed modules are kept on disk
+max_cache_files = 2000
+
+
+def default_cache_dir():
+    """Returns the directory the names of parsed modules are stored in."""
+    return os.path.join(os.path.dirname(importcompletion.default_cache_path()),
+                        'names')
+
+
+def find_source(module_name, path=None):
+    """Return the source file of module `module_name`, or None if there is
+    none. The module is searched in `path` (or `sys.path`) like the import
+    statement would, but nothing is imported."""
+    if path is None:
+        path = sys.path
+    parts = module_name.split('.')
+    if not all(parts):
+        return None
+    for entry in path:
+        directory = os.path.join(entry or os.curdir, parts[0])
+        if os.path.isfile(os.path.join(directory, '__init__.py')):
+            break
+        if os.path.isfile(directory + '.py'):
+            return directory + '.py' if len(parts) == 1 else None
+    else:
+        return None
+
+    for part in parts[1:]:
+        if not os.path.isfile(os.path.join(directory, '__init__.py')):
+            return None
+        directory = os.path.join(directory, part)
+    filename = os.path.join(directory, '__init__.py')
+    if os.path.isfile(filename):
+        return filename
+    if os.path.isfile(directory + '.py'):
+        return directory + '.py'
+    return None
+
+
+# For each module name and path, the source file found by find_source and
+# when it was searched
+_sources = dict()
+
+
+def cached_find_source(module_name):
+    """Like `find_source` for `sys.path`, but the file found is only
+    checked to still exist the next time, and a module whose source was not
+    found is only searched again after `missing_interval` seconds."""
+    key = (module_name, tuple(sys.path))
+    now = time.time()
+    record = _sources.get(key)
+    if record is not None:
+        filename, searched = record
+        if filename is None:
+            if now - searched < missing_interval:
+                return None
+        elif os.path.isfile(filename):
+            return filename
+    filename = find_source(module_name)
+    _sources[key] = (filename, now)
+    return filename
+
+
+def _string(node):
+    """Return the value of the string literal `node`, or None."""
+    value = getattr(node, 's', getattr(node, 'value', None))
+    if isinstance(value, basestring):
+        return value
+    return None
+
+
+def _add_targets(target, names):
+    if isinstance(target, ast.Name):
+        names.add(target.id)
+    elif isinstance(target, (ast.Tuple, ast.List)):
+        for elt in target.elts:
+            _add_targets(elt, names)
+
+
+def _collect(body, names, exported):
+    """Add the names bound by the statements `body` to `names`, and the
+    names listed in `__all__` to `exported`."""
+    for node in body:
+        kind = node.__class__.__name__
+        if kind in ('FunctionDef', 'AsyncFunctionDef', 'ClassDef'):
+            names.add(node.name)
+        elif kind in ('Assign', 'AugAssign', 'AnnAssign'):
+            targets = node.targets if kind == 'Assign' else [node.target]
+            for target in targets:
+                _add_targets(target, names)
+            if (any(isinstance(target, ast.Name) and target.id == '__all__'
+                    for target in targets) and
+                    isinstance(node.value, (ast.List, ast.Tuple))):
+                exported.extend(_string(elt) for elt in node.value.elts)
+        elif kind in ('Import', 'ImportFrom'):
+            for alias in node.names:
+                if alias.name != '*':
+                    names.add(alias.asname or alias.name.partition('.')[0])
+        elif kind in ('If', 'Try', 'TryExcept', 'TryFinally', 'With',
+                      'AsyncWith'):
+            # Names defined conditionally, e.g. by a fallback import
+            for field in ('body', 'orelse', 'finalbody'):
+                _collect(getattr(node, field, ()), names, exported)
+            for handler in getattr(node, 'handlers', ()):
+                _collect(handler.body, names, exported)
+
+
+def extract_names(source, filename='<unknown>'):
+    """Return the sorted names defined at the top level of the module with
+    source code `source`: functions, classes, assigned and imported names,
+    and the names listed in `__all__`."""
+    tree = ast.parse(source, filename)
+    names = set()
+    exported = []
+    _collect(tree.body, names, exported)
+    names.update(name for name in exported
+                 if name is not None and importcompletion._is_identifier(name))
+    return sorted(names)
+
+
+def names_from_file(filename):
+    """Like `extract_names` for the source file `filename`. Returns an
+    empty list if the file can't be read or parsed."""
+    try:
+        with open(filename, 'rb') as f:
+            source = f.read()
+        return extract_names(source, filename)
+    except Exception:
+        # SyntaxError, TypeError for null bytes, RecursionError, ...
+        return []
+
+
+def prune_cache(cache_dir, max_files=None):
+    """Remove the files of `cache_dir` whose source file is gone or which
+    were written by another version of bpython, and then the oldest files
+    beyond `max_files`."""
+    if max_files is None:
+        max_files = max_cache_files
+    try:
+        filenames = [os.path.join(cache_dir, name)
+                     for name in os.listdir(cache_dir)
+                     if name.endswith('.json')]
+    except EnvironmentError:
+        return
+    kept = []
+    for filename in filenames:
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+            if (isinstance(data, dict) and
+                    data.get('version') == CACHE_VERSION and
+                    os.path.exists(data.get('filename'))):
+                kept.append((os.stat(filename).st_mtime, filename))
+                continue
+        except (EnvironmentError, ValueError, TypeError):
+            pass
+        try:
+            os.remove(filename)
+        except EnvironmentError:
+            pass
+    kept.sort(reverse=True)
+    for _, filename in kept[max_files:]:
+        try:
+            os.remove(filename)
+        except EnvironmentError:
+            pass
+
+
+def serve(cache_dir=None):
+    """Run by the parser process of `NameCache.start`: prune `cache_dir`,
+    then read file names from stdin, one per line, and write the names
+    each file defines to stdout as a line of JSON."""
+    if cache_dir:
+        prune_cache(cache_dir)
+    for line in iter(sys.stdin.readline, ''):
+        names = names_from_file(line[:-1])
+        sys.stdout.write(json.dumps(names) + '\n')
+        sys.stdout.flush()
+
+
+class _Result(object):
+    """The names of a file, once it is parsed."""
+
+    def __init__(self):
+        self.value = None
+        self.done = threading.Event()
+
+    def set(self, value):
+        self.value = value
+        self.done.set()
+
+    def get(self, timeout=None):
+        """Wait at most `timeout` seconds for the names. Returns None if
+        the file is not parsed by then."""
+        self.done.wait(timeout)
+        return self.value
+
+
+class NameCache(object):
+    """The names defined by Python source files, see `names_from_file`.
+
+    If `threaded` is true, files are parsed in the background: by a parser
+    process once `start` was called, so that parsing a large module doesn't
+    hold the GIL of the interpreter, and otherwise by a worker thread. If
+    `threaded` is false, files are parsed right away. The names are kept in
+    memory and on disk in `cache_dir` (unless that is None), keyed by the
+    mtime of the file."""
+
+    def __init__(self, cache_dir=None, threaded=True):
+        self.cache_dir = cache_dir
+        self.threaded = threaded
+        self.tasks = Queue.Queue()
+        self.thread = None
+        self.process = None
+        # The files sent to the parser process and their results, in order
+        self.sent = collections.deque()
+        # For each file, its mtime and names
+        self.names = dict()
+        # For each file being parsed, its mtime and the result of the parse
+        self.pending = dict()
+        self.lock = threading.Lock()
+
+    def get(self, filename, timeout=None):
+        """Return the names defined by the source file `filename`. If it
+        has to be parsed and that takes longer than `timeout` seconds,
+        None is returned and the file is parsed in the background."""
+        try:
+            mtime = os.stat(filename).st_mtime
+        except EnvironmentError:
+            return None
+        with self.lock:
+            record = self.names.get(filename)
+        if record is not None and record[0] == mtime:
+            return record[1]
+
+        names = self._load(filename, mtime)
+        if names is None:
+            with self.lock:
+                pending = self.pending.get(filename)
+                if pending is None or pending[0] != mtime:
+                    pending = (mtime, self._parse(filename))
+                    self.pending[filename] = pending
+            names = pending[1].get(timeout)
+            if names is None:
+                return None
+            with self.lock:
+                self.pending.pop(filename, None)
+            self._store(filename, mtime, names)
+        with self.lock:
+            self.names[filename] = (mtime, names)
+        return names
+
+    def start(self):
+        """Start the parser process, which also prunes `cache_dir`. Call
+        this at startup, before other threads are started, as forking
+        while other threads run isn't safe."""
+        if not self.threaded or self.process is not None:
+            return
+        env = dict(os.environ)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(
+            [root] + [p for p in [env.get('PYTHONPATH')] if p])
+        try:
+            with open(os.devnull, 'w') as devnull:
+                self.process = subprocess.Popen(
+                    [sys.executable, '-c',
+                     'import sys; from bpython import staticnames; '
+                     'staticnames.serve(*sys.argv[1:])'] +
+                    [self.cache_dir] * (self.cache_dir is not None),
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                    stderr=devnull, close_fds=True, env=env)
+        except EnvironmentError:
+            logger.debug('Cannot start a process to parse modules')
+            return
+        reader = threading.Thread(target=self._read,
+                                  args=(self.process, ))
+        reader.daemon = True
+        reader.start()
+
+    def _read(self, process):
+        """Hand the names the parser process writes to the results of the
+        files sent to it. If it dies, the files it did not parse are parsed
+        by the worker thread."""
+        for line in iter(process.stdout.readline, b''):
+            try:
+                names = json.loads(line.decode('utf-8'))
+            except (ValueError, UnicodeError):
+                break
+            with self.lock:
+                filename, result = self.sent.popleft()
+            result.set(names)
+        with self.lock:
+            if self.process is process:
+                self.process = None
+            sent = list(self.sent)
+            self.sent.clear()
+            for filename, result in sent:
+                self._put(filename, result)
+
+    def _parse(self, filename):
+        result = _Result()
+        if not self.threaded:
+            result.set(names_from_file(filename))
+            return result
+        if self.process is not None and '\n' not in filename:
+            try:
+                line = filename
+                if not isinstance(line, bytes):
+                    line = line.encode(sys.getfilesystemencoding())
+                self.process.stdin.write(line + b'\n')
+                self.process.stdin.flush()
+            except UnicodeError:
+                pass
+            except (EnvironmentError, ValueError):
+                # It died, _read hands its files to the worker thread
+                self.process = None
+            else:
+                self.sent.append((filename, result))
+                return result
+        self._put(filename, result)
+        return result
+
+    def _put(self, filename, result):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._work)
+            self.thread.daemon = True
+            self.thread.start()
+        self.tasks.put((filename, result))
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            filename, result = task
+            result.set(names_from_file(filename))
+
+    def _cache_file(self, filename):
+        key = filename
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8', 'replace')
+        return os.path.join(self.cache_dir,
+                            hashlib.sha1(key).hexdigest() + '.json')
+
+    def _load(self, filename, mtime):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._cache_file(filename)) as f:
+                data = json.load(f)
+        except (EnvironmentError, ValueError):
+            return None
+        if (not isinstance(data, dict) or
+                data.get('version') != CACHE_VERSION or
+                data.get('filename') != filename or
+                data.get('mtime') != mtime or
+                not isinstance(data.get('names'), list)):
+            return None
+        return data['names']
+
+    def _store(self, filename, mtime, names):
+        if self.cache_dir is None:
+            return
+        importcompletion.save_json(self._cache_file(filename),
+                                   dict(version=CACHE_VERSION,
+                                        filename=filename, mtime=mtime,
+                                        names=names))
+
+    def close(self):
+        """Stop the parser process and the worker thread."""
+        with self.lock:
+            if self.process is not None:
+                try:
+                    self.process.stdin.close()
+                except EnvironmentError:
+                    pass
+                self.process = None
+            if self.thread is not None:
+                self.tasks.put(None)
+                self.thread = None
+
+
+cache = NameCache(default_cache_dir())
+atexit.register(cache.close)
+
+
+def complete(cursor_offset, line, mode=SIMPLE):
+    """Construct the list of names to complete `from module import name`
+    with if the module was not imported yet, or None if that's not what
+    the cursor is at. Names are matched in autocomplete `mode`."""
+    context = lineparts.context(cursor_offset, line)
+    from_part = context.current_from_import_from()
+    if from_part is None:
+        return None
+    import_part = context.current_from_import_import()
+    if import_part is None:
+        return None
+    module_name = from_part[2]
+    if module_name in sys.modules or module_name.startswith('.'):
+        return None
+    filename = cached_find_source(module_name)
+    if filename is None:
+        return None
+    names = cache.get(filename, timeout)
+    if names is None:
+        return None
+    return filter_names(names, import_part[2], mode)
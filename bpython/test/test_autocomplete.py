@@ -1,6 +1,10 @@
 from bpython import autocomplete
 
+import collections
 import mock
+import sys
+import time
+from contextlib import contextmanager
 try:
     import unittest2 as unittest
 except ImportError:
@@ -108,37 +112,62 @@ class TestFilenameCompletion(unittest.TestCase):
     def test_locate_succeeds_when_in_string(self):
         self.assertEqual(self.completer.locate(4, "a'bc'd"), (2, 4, 'bc'))
 
-    @mock.patch('bpython.autocomplete.glob', new=lambda text: [])
     def test_match_returns_none_if_not_in_string(self):
         self.assertEqual(self.completer.matches(2, 'abcd'), None)
 
-    @mock.patch('bpython.autocomplete.glob', new=lambda text: [])
     def test_match_returns_empty_list_when_no_files(self):
-        self.assertEqual(self.completer.matches(2, '"a'), set())
+        with self.listing([]):
+            self.assertEqual(self.completer.matches(2, '"a'), set())
 
-    @mock.patch('bpython.autocomplete.glob', new=lambda text: ['abcde', 'aaaaa'])
-    @mock.patch('os.path.expanduser', new=lambda text: text)
-    @mock.patch('os.path.isdir', new=lambda text: False)
     @mock.patch('os.path.sep', new='/')
     def test_match_returns_files_when_files_exist(self):
-        self.assertEqual(sorted(self.completer.matches(2, '"x')),
-                         ['aaaaa', 'abcde'])
+        with self.listing(['aaaaa', 'abcde', 'b']):
+            self.assertEqual(sorted(self.completer.matches(2, '"a')),
+                             ['aaaaa', 'abcde'])
 
-    @mock.patch('bpython.autocomplete.glob', new=lambda text: ['abcde', 'aaaaa'])
-    @mock.patch('os.path.expanduser', new=lambda text: text)
-    @mock.patch('os.path.isdir', new=lambda text: True)
     @mock.patch('os.path.sep', new='/')
     def test_match_returns_dirs_when_dirs_exist(self):
-        self.assertEqual(sorted(self.completer.matches(2, '"x')),
-                         ['aaaaa/', 'abcde/'])
+        with self.listing(['aaaaa', 'abcde'], is_dir=True):
+            self.assertEqual(sorted(self.completer.matches(2, '"a')),
+                             ['aaaaa/', 'abcde/'])
 
-    @mock.patch('bpython.autocomplete.glob', new=lambda text: ['/expand/ed/abcde', '/expand/ed/aaaaa'])
-    @mock.patch('os.path.expanduser', new=lambda text: text.replace('~', '/expand/ed'))
-    @mock.patch('os.path.isdir', new=lambda text: False)
+    @mock.patch('os.path.expanduser',
+                new=lambda text: text.replace('~', '/expand/ed'))
     @mock.patch('os.path.sep', new='/')
     def test_tilde_stays_pretty(self):
-        self.assertEqual(sorted(self.completer.matches(4, '"~/a')),
-                         ['~/aaaaa', '~/abcde'])
+        with self.listing(['abcde', 'aaaaa']) as listdir:
+            self.assertEqual(sorted(self.completer.matches(4, '"~/a')),
+                             ['~/aaaaa', '~/abcde'])
+        listdir.assert_called_once_with('/expand/ed/')
+
+    @mock.patch('os.path.sep', new='/')
+    def test_hidden_files(self):
+        with self.listing(['.hidden', 'visible']):
+            self.assertEqual(self.completer.matches(3, '"d/'),
+                             set(['d/visible']))
+            self.assertEqual(self.completer.matches(4, '"d/.'),
+                             set(['d/.hidden']))
+
+    def test_number_of_matches_is_capped(self):
+        self.completer.max_matches = 2
+        with self.listing(['xa', 'xb', 'xc']):
+            self.assertEqual(self.completer.matches(2, '"x'),
+                             set(['xa', 'xb']))
+
+    def test_listing_is_cached(self):
+        with self.listing(['xa']) as listdir:
+            self.completer.matches(2, '"x')
+            self.completer.matches(3, '"xa')
+        self.assertEqual(listdir.call_count, 1)
+        with self.listing(['xb'], mtime=2):
+            self.assertEqual(self.completer.matches(2, '"x'), set(['xb']))
+
+    @contextmanager
+    def listing(self, names, is_dir=False, mtime=1):
+        with mock.patch('os.stat', return_value=mock.Mock(st_mtime=mtime)):
+            with mock.patch('os.listdir', return_value=names) as listdir:
+                with mock.patch('os.path.isdir', return_value=is_dir):
+                    yield listdir
 
     @mock.patch('os.path.sep', new='/')
     def test_formatting_takes_just_last_part(self):
@@ -180,3 +209,371 @@ class TestDictKeyCompletion(unittest.TestCase):
             com.matches(7,"mNumPy[" , local)
         except ValueError:
             raise AssertionError("Dict key completion raised value error.")
+
+    def test_mapping(self):
+        com = autocomplete.DictKeyCompletion()
+        local = {'m': ReadOnlyMapping({'ab': 1, 'cd': 2})}
+        self.assertSetEqual(com.matches(4, "m['a", local), set(["'ab'"]))
+
+    def test_object_with_keys(self):
+        com = autocomplete.DictKeyCompletion()
+        local = {'k': WithKeys()}
+        self.assertSetEqual(com.matches(2, "k[", local), set(["'xy'"]))
+
+    def test_keys_are_indexed_once(self):
+        com = autocomplete.DictKeyCompletion()
+        d = {'ab': 1, 'cd': 2}
+        with mock.patch.object(autocomplete, 'KeyIndex',
+                               wraps=autocomplete.KeyIndex) as index:
+            com.matches(2, "d[", {'d': d}, namespace_generation=0)
+            self.assertSetEqual(com.matches(4, "d['a", {'d': d},
+                                            namespace_generation=0),
+                                set(["'ab'"]))
+            self.assertEqual(index.call_count, 1)
+            d['ae'] = 3
+            self.assertSetEqual(com.matches(4, "d['a", {'d': d},
+                                            namespace_generation=0),
+                                set(["'ab'", "'ae'"]))
+            self.assertEqual(index.call_count, 2)
+
+    def test_dicts_are_not_kept_alive(self):
+        com = autocomplete.DictKeyCompletion()
+        d = {'ab': 1}
+        com.matches(2, "d[", {'d': d}, namespace_generation=0)
+        self.assertEqual(sys.getrefcount(d), 2)
+
+    def test_dict_index_is_dropped_with_namespace_generation(self):
+        com = autocomplete.DictKeyCompletion()
+        d = {'ab': 1}
+        with mock.patch.object(autocomplete, 'KeyIndex',
+                               wraps=autocomplete.KeyIndex) as index:
+            com.matches(2, "d[", {'d': d}, namespace_generation=0)
+            d.clear()
+            d['cd'] = 2
+            self.assertSetEqual(com.matches(2, "d[", {'d': d},
+                                            namespace_generation=1),
+                                set(["'cd'"]))
+            com.matches(2, "d[", {'d': d})
+            com.matches(2, "d[", {'d': d})
+            self.assertEqual(index.call_count, 4)
+
+    def test_number_of_keys_is_capped(self):
+        com = autocomplete.DictKeyCompletion()
+        com.max_keys = 10
+        com.max_matches = 3
+        local = {'d': dict((i, None) for i in range(20))}
+        matches = com.matches(2, "d[", local)
+        self.assertEqual(len(matches), 3)
+        self.assertTrue(com.truncated)
+        self.assertEqual(len(com._index(local['d']).reprs), 10)
+
+
+class ReadOnlyMapping(collections.Mapping):
+
+    def __init__(self, d):
+        self.d = d
+
+    def __getitem__(self, key):
+        return self.d[key]
+
+    def __iter__(self):
+        return iter(self.d)
+
+    def __len__(self):
+        return len(self.d)
+
+
+class WithKeys(object):
+
+    def keys(self):
+        return ['xy']
+
+    def __len__(self):
+        return 1
+
+
+class Dynamic(object):
+    def __dir__(self):
+        return ['dynamic']
+
+    def __getattr__(self, name):
+        if name == 'dynamic':
+            return 1
+        raise AttributeError(name)
+
+
+class TestAttrLookup(unittest.TestCase):
+
+    def test_attributes_from_dir(self):
+        self.assertEqual(autocomplete.attr_lookup(Dynamic(), 'obj', 'dyn'),
+                         ['obj.dynamic'])
+
+    def test_mock_attributes(self):
+        obj = mock.Mock(spec=['foo'])
+        self.assertIn('obj.foo', autocomplete.attr_lookup(obj, 'obj', 'f'))
+
+    def test_plain_objects_are_not_inspected_with_dir(self):
+        with mock.patch.object(autocomplete, '_dir_attributes') as dir_:
+            self.assertEqual(autocomplete.attr_lookup(Slow(), 'obj', 'fo'),
+                             ['obj.foo'])
+        self.assertFalse(dir_.called)
+
+
+class TestCompletionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = autocomplete.CompletionCache()
+        self.completer = autocomplete.GlobalCompletion()
+        self.locals_ = {'aaa': 1, 'aab': 2, 'abc': 3}
+
+    def matches(self, line, generation=0, locals_=None):
+        if locals_ is None:
+            locals_ = self.locals_
+        with mock.patch.object(self.completer, 'matches',
+                               wraps=self.completer.matches) as matches:
+            result = self.cache.matches(self.completer, len(line), line,
+                                        locals_=locals_,
+                                        namespace_generation=generation)
+        return result, matches.called
+
+    def test_narrowing_filters_earlier_matches(self):
+        matches, called = self.matches('a')
+        self.assertTrue(called)
+        self.assertTrue(set(['aaa', 'aab', 'abc', 'abs(']).issubset(matches))
+        self.assertEqual(self.matches('aa'), (set(['aaa', 'aab']), False))
+        self.assertEqual(self.matches('aab'), (set(['aab']), False))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_other_word_is_recomputed(self):
+        self.matches('aa')
+        self.assertEqual(self.matches('a')[1], True)
+        self.assertEqual(self.matches('x = ab')[1], True)
+
+    def test_namespace_change_is_recomputed(self):
+        self.matches('a')
+        self.locals_['aac'] = 4
+        self.assertEqual(self.matches('aa', generation=1),
+                         (set(['aaa', 'aab', 'aac']), True))
+        self.assertEqual(self.matches('aa', generation=1,
+                                      locals_={'aad': 5}),
+                         (set(['aad']), True))
+
+    def test_without_generation_nothing_is_cached(self):
+        self.matches('a', generation=None)
+        self.assertEqual(self.matches('aa', generation=None)[1], True)
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_private_attributes_are_recomputed(self):
+        completer = autocomplete.AttrCompletion()
+        locals_ = {'obj': mock.Mock(spec=['foo', '_bar'])}
+        self.assertNotIn('obj._bar', self.cache.matches(
+            completer, 4, 'obj.', locals_=locals_, namespace_generation=0))
+        self.assertIn('obj._bar', self.cache.matches(
+            completer, 5, 'obj._', locals_=locals_, namespace_generation=0))
+
+    def test_get_completer(self):
+        a = completer(['abc', 'abd'])
+        a.narrowing_key = lambda cursor_offset, line: ((), line)
+        for line, matches in (('a', ['abc', 'abd']), ('abc', ['abc'])):
+            self.assertEqual(autocomplete.get_completer(
+                [a], len(line), line, cache=self.cache,
+                namespace_generation=0), (matches, a))
+        self.assertEqual(a.matches.call_count, 1)
+
+    def test_narrowing_in_fuzzy_mode(self):
+        self.completer = autocomplete.GlobalCompletion(mode=autocomplete.FUZZY)
+        self.locals_ = {'xaybzc': 1, 'xabx': 2}
+        self.matches('xa')
+        self.assertEqual(self.matches('xab'), (set(['xaybzc', 'xabx']), False))
+        self.assertEqual(self.matches('xabc'), (set(['xaybzc']), False))
+
+
+class TestNamespaceIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = autocomplete.NamespaceIndex()
+        self.locals_ = {'aaa': 1, 'abc': len}
+        self.index.update(self.locals_, 0)
+
+    def test_names(self):
+        self.assertEqual(self.index.names.matches('a'),
+                         ['aaa', 'abc', 'abs', 'all', 'and', 'any', 'apply',
+                          'as', 'assert'])
+
+    def test_names_are_updated_after_code_ran(self):
+        self.locals_['aab'] = 2
+        del self.locals_['abc']
+        self.locals_['abs'] = 3
+        self.index.update(self.locals_, 1)
+        self.assertEqual(self.index.names.matches('a')[:3],
+                         ['aaa', 'aab', 'abs'])
+        del self.locals_['abs']
+        self.index.update(self.locals_, 2)
+        self.assertIn('abs', self.index.names)
+
+    def test_postfixes_are_cached(self):
+        with mock.patch.object(autocomplete, '_callable_postfix',
+                               return_value='(') as postfix:
+            self.assertEqual(self.index.postfix(1, 'abc', len), '(')
+            self.assertEqual(self.index.postfix(1, 'abc', len), '(')
+        self.assertEqual(postfix.call_count, 1)
+
+    def test_rebound_name_is_looked_up_again(self):
+        self.assertEqual(self.index.postfix(1, 'abc', len), '(')
+        self.locals_['abc'] = 1
+        self.index.update(self.locals_, 1)
+        self.assertEqual(self.index.postfix(1, 'abc', 1), '')
+
+    def test_rebound_name_with_reused_id_is_looked_up_again(self):
+        self.assertEqual(self.index.postfix(1, 'abc', len), '(')
+        value = object()
+        self.locals_['abc'] = value
+        with mock.patch.object(autocomplete, 'id', create=True,
+                               side_effect=lambda obj: id(len)):
+            self.index.update(self.locals_, 1)
+        self.assertEqual(self.index.postfix(1, 'abc', value), '')
+
+    def test_global_completion(self):
+        completer = autocomplete.GlobalCompletion()
+        self.assertEqual(completer.matches(2, 'ab', locals_=self.locals_,
+                                           namespace_generation=0),
+                         set(['abc(', 'abs(']))
+
+
+class Slow(object):
+    foo = 1
+
+
+class Fast(object):
+    def method(self):
+        pass
+
+
+class TestCompletionBudget(unittest.TestCase):
+
+    def setUp(self):
+        # every completion misses the deadline
+        self.budget = autocomplete.CompletionBudget(deadline=-1, strikes=2)
+        self.completer = autocomplete.AttrCompletion()
+        self.locals_ = {'slow': Slow(), 'other': Slow(), 'fast': Fast()}
+
+    def matches(self, line):
+        return self.budget.matches(self.completer, len(line), line,
+                                   locals_=self.locals_)
+
+    def test_completer_is_disabled_after_strikes(self):
+        self.assertEqual(self.matches('slow.f'), set(['slow.foo']))
+        self.assertEqual(self.matches('slow.f'), set(['slow.foo']))
+        self.assertEqual(self.budget.take_skipped(), [])
+        self.assertEqual(self.matches('slow.f'), [])
+        self.assertEqual(self.budget.take_skipped(),
+                         ['AttrCompletion for slow'])
+        self.assertEqual(self.budget.take_skipped(), [])
+
+    def test_completer_is_disabled_per_object(self):
+        self.matches('slow.f')
+        self.matches('slow.f')
+        self.assertEqual(self.matches('other.f'), set(['other.foo']))
+        self.assertEqual(self.matches('fast.m'), set(['fast.method']))
+        self.assertEqual(self.matches('slow.foo.r'), set(['slow.foo.real']))
+
+    def test_fast_completion_resets_strikes(self):
+        self.matches('slow.f')
+        self.budget.deadline = 10
+        self.matches('slow.f')
+        self.budget.deadline = -1
+        self.assertEqual(self.matches('slow.f'), set(['slow.foo']))
+
+    def test_completer_is_enabled_after_cooldown(self):
+        self.budget.cooldown = 0
+        self.matches('slow.f')
+        self.matches('slow.f')
+        self.assertEqual(self.matches('slow.f'), set(['slow.foo']))
+
+    def test_get_completer(self):
+        a = completer(['abc'])
+        b = completer(['abd'])
+        a.locate = b.locate = mock.Mock(return_value=(0, 1, 'a'))
+        for _ in range(2):
+            self.assertEqual(autocomplete.get_completer(
+                [a, b], 1, 'a', budget=self.budget), (['abc'], a))
+        self.assertEqual(autocomplete.get_completer(
+            [a, b], 1, 'a', budget=self.budget), ([], None))
+        self.assertEqual(len(self.budget.take_skipped()), 1)
+
+    def test_disabled_completer_which_does_not_apply(self):
+        class Strings(autocomplete.BaseCompletionType):
+            def locate(self, cursor_offset, line):
+                return None
+        a = Strings()
+        b = completer(['abd'])
+        self.budget.disabled[(Strings, None)] = time.time() + 60
+        self.assertEqual(autocomplete.get_completer(
+            [a, b], 1, 'a', budget=self.budget), (['abd'], b))
+        self.assertEqual(self.budget.take_skipped(), [])
+
+    def test_disabled_import_completion_outside_imports(self):
+        for completer_type in (autocomplete.ImportCompletion,
+                               autocomplete.StaticImportCompletion):
+            self.budget.disabled[(completer_type, None)] = time.time() + 60
+        matches, completer = autocomplete.get_completer_bpython(
+            cursor_offset=2, line='fo', locals_={'foo': 1}, argspec=None,
+            current_block='', complete_magic_methods=True, budget=self.budget)
+        self.assertIn('foo', matches)
+        self.assertEqual(self.budget.take_skipped(), [])
+        self.assertEqual(autocomplete.get_completer_bpython(
+            cursor_offset=8, line='import o', locals_={}, argspec=None,
+            current_block='', complete_magic_methods=True,
+            budget=self.budget), ([], None))
+        self.assertEqual(self.budget.take_skipped(), ['ImportCompletion'])
+
+    def test_disabled_after_one_strike(self):
+        self.budget.strikes = 1
+        self.assertEqual(self.matches('slow.f'), set(['slow.foo']))
+        self.assertEqual(self.matches('slow.f'), [])
+        self.assertEqual(self.budget.take_skipped(),
+                         ['AttrCompletion for slow'])
+
+    def test_cumulative_completer_is_limited_per_completer(self):
+        cumulative = autocomplete.CumulativeCompleter(
+            [self.completer, autocomplete.ParameterNameCompletion()])
+        for _ in range(3):
+            cumulative.matches(6, 'slow.f', locals_=self.locals_,
+                               argspec=None, current_block='',
+                               complete_magic_methods=False,
+                               budget=self.budget)
+        self.assertEqual(self.budget.take_skipped(),
+                         ['AttrCompletion for slow',
+                          'ParameterNameCompletion'])
+        self.assertEqual(cumulative.matches(
+            6, 'fast.m', locals_=self.locals_, argspec=None,
+            current_block='', complete_magic_methods=False,
+            budget=self.budget), ['fast.method'])
+
+
+class TestCompletionModes(unittest.TestCase):
+
+    def test_global_matches_are_ranked(self):
+        matches, completer = autocomplete.get_completer_bpython(
+            mode=autocomplete.SUBSTRING, cursor_offset=3, line='ham',
+            locals_={'xhamx': 1, 'spam_ham': 2, 'hamster': 3},
+            argspec=None, current_block='', complete_magic_methods=True)
+        self.assertEqual(matches, ['hamster', 'spam_ham', 'xhamx'])
+        self.assertIsInstance(completer, autocomplete.GlobalCompletion)
+
+    def test_attribute_matches_are_ranked(self):
+        class Obj(object):
+            get_value = value = xvaluex = None
+        locals_ = {'obj': Obj()}
+        matches, completer = autocomplete.get_completer_bpython(
+            mode=autocomplete.FUZZY, cursor_offset=6, line='obj.vl',
+            locals_=locals_, argspec=None, current_block='',
+            complete_magic_methods=True)
+        self.assertEqual(matches, ['obj.value', 'obj.get_value', 'obj.xvaluex'])
+
+    def test_parameter_names(self):
+        completer = autocomplete.ParameterNameCompletion(
+            mode=autocomplete.SUBSTRING)
+        argspec = ['func', [['first', 'last'], None, None, None]]
+        self.assertEqual(completer.matches(6, 'func(s', argspec=argspec),
+                         set(['first=', 'last=']))
@@ -79,3 +79,19 @@ class TestConfig(unittest.TestCase):
 
         self.assertFalse(struct.help_key)
 
+
+    def test_module_indexing(self):
+        struct = self.load_temp_config("")
+        self.assertEqual(struct.module_indexing, 'eager')
+
+        struct = self.load_temp_config(textwrap.dedent("""
+            [general]
+            module_indexing = lazy
+            """))
+        self.assertEqual(struct.module_indexing, 'lazy')
+
+        struct = self.load_temp_config(textwrap.dedent("""
+            [general]
+            module_indexing = sometimes
+            """))
+        self.assertEqual(struct.module_indexing, 'eager')
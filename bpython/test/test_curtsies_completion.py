@@ -0,0 +1,83 @@
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from bpython.curtsiesfrontend.completion import CompletionWorker
+
+
+class TestCompletionWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.ready = threading.Event()
+        self.computed = []
+
+    def tearDown(self):
+        self.worker.stop()
+
+    def compute(self, request, check):
+        self.computed.append(request)
+        return request.upper()
+
+    def test_result(self):
+        self.worker = CompletionWorker(self.compute, self.ready.set)
+        self.worker.submit('abc')
+        self.assertTrue(self.worker.pending)
+        self.ready.wait(5)
+        self.assertTrue(self.ready.is_set())
+        self.assertEqual(self.worker.take(), 'ABC')
+        self.assertFalse(self.worker.pending)
+        self.assertEqual(self.worker.take(), None)
+
+    def test_superseded_request_is_cancelled(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def compute(request, check):
+            if request == 'slow':
+                started.set()
+                release.wait(5)
+                check()
+            return self.compute(request, check)
+
+        self.worker = CompletionWorker(compute, self.ready.set)
+        self.worker.submit('slow')
+        started.wait(5)
+        self.assertTrue(started.is_set())
+        self.worker.submit('fast')
+        release.set()
+        self.ready.wait(5)
+        self.assertTrue(self.ready.is_set())
+        self.assertEqual(self.worker.take(), 'FAST')
+        self.assertEqual(self.computed, ['fast'])
+
+    def test_cancel(self):
+        release = threading.Event()
+
+        def compute(request, check):
+            release.wait(5)
+            return self.compute(request, check)
+
+        self.worker = CompletionWorker(compute, self.ready.set)
+        self.worker.submit('abc')
+        self.worker.cancel()
+        self.assertFalse(self.worker.pending)
+        release.set()
+        self.ready.wait(0.2)
+        self.assertFalse(self.ready.is_set())
+        self.assertEqual(self.worker.take(), None)
+
+    def test_failed_computation(self):
+        def compute(request, check):
+            if request == 'bad':
+                raise ValueError(request)
+            return self.compute(request, check)
+
+        self.worker = CompletionWorker(compute, self.ready.set)
+        self.worker.submit('bad')
+        self.worker.submit('good')
+        self.ready.wait(5)
+        self.assertTrue(self.ready.is_set())
+        self.assertEqual(self.worker.take(), 'GOOD')
@@ -15,8 +15,9 @@ from curtsies.fmtfuncs import *
 from bpython.curtsiesfrontend.events import RefreshRequestEvent
 
 from bpython import config
+from bpython.curtsiesfrontend import replpainter
 from bpython.curtsiesfrontend.repl import Repl
-from bpython.repl import History
+from bpython.repl import History, MatchesIterator
 from bpython.curtsiesfrontend.repl import INCONSISTENT_HISTORY_MSG, CONTIGUITY_BROKEN_MSG
 
 def setup_config():
@@ -478,3 +479,70 @@ class TestCurtsiesRewindRedraw(TestCurtsiesPainting):
         screen = fsarray([cyan(u">>> ")+yellow('('),
                          green(u"... ")+yellow(')')+bold(cyan(" "))])
         self.assert_paint(screen, (1, 6))
+
+    def test_only_the_paren_is_restyled(self):
+        self.enter('f(1,')
+        original = self.repl.display_buffer[0]
+        with output_to_repl(self.repl):
+            self.repl.process_event(')')
+        self.repl.paint()
+        highlighted = self.repl.display_buffer[0]
+        self.assertEqual(highlighted.s, original.s)
+        self.assertEqual(highlighted[:1], original[:1])
+        self.assertEqual(highlighted[2:], original[2:])
+        self.assertNotEqual(highlighted[1:2], original[1:2])
+
+        with output_to_repl(self.repl):
+            self.repl.process_event(' ')
+        self.assertEqual(self.repl.display_buffer[0], original)
+        self.assertEqual(self.repl.highlighted_cell, None)
+
+    def test_highlighted_paren_line_taken_back(self):
+        self.enter('f(1,')
+        with output_to_repl(self.repl):
+            self.repl.process_event(')')
+        self.repl.paint()
+        self.assertNotEqual(self.repl.highlighted_cell, None)
+
+        self.repl.undo()
+        self.assertEqual(self.repl.highlighted_cell, None)
+        with output_to_repl(self.repl):
+            self.repl.process_event('1')
+        self.repl.paint()
+
+class TestMatchesLines(FormatStringTest):
+
+    def setUp(self):
+        self.config = setup_config()
+        self.matches = ['m%02d' % i for i in range(30)]
+
+    def lines(self, rows, current=None, format=lambda m: m, width=None):
+        lines = replpainter.matches_lines(rows, 13, self.matches, current,
+                                          self.config, format, width)
+        return [line.s.split() for line in lines]
+
+    def test_first_page(self):
+        self.assertEqual(self.lines(2), [['m00', 'm01', 'm02'],
+                                         ['m03', 'm04', 'm05']])
+
+    def test_page_with_current_match(self):
+        self.assertEqual(self.lines(2, 'm07'), [['m06', 'm07', 'm08'],
+                                                ['m09', 'm10', 'm11']])
+        self.assertEqual(self.lines(4, 'm29'), [['m24', 'm25', 'm26'],
+                                                ['m27', 'm28', 'm29']])
+
+    def test_only_shown_matches_are_formatted(self):
+        formatted = []
+        def format(match):
+            formatted.append(match)
+            return match
+        matches_iter = MatchesIterator()
+        matches_iter.matches = self.matches
+        self.lines(1, format=format, width=matches_iter.max_width(format))
+        self.lines(1, 'm10', format=format,
+                   width=matches_iter.max_width(format))
+        # all of them once for the width, and then only those shown
+        self.assertEqual(len(formatted), 30 + 3 + 1 + 3)
+
+    def test_no_rows(self):
+        self.assertEqual(self.lines(0), [])
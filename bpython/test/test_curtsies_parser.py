@@ -1,8 +1,19 @@
 import unittest
 
+import mock
+
+from pygments import format
+from pygments.token import Token
+
+from bpython._py3compat import PythonLexer
+from bpython.config import Struct, loadini, default_config_path
 from bpython.curtsiesfrontend import parse
+from bpython.formatter import BPythonFormatter, Parenthesis
 from curtsies.fmtfuncs import yellow, cyan, green, bold
 
+config = Struct()
+loadini(config, default_config_path())
+
 class TestExecArgs(unittest.TestCase):
 
     def test_parse(self):
@@ -16,3 +27,81 @@ class TestExecArgs(unittest.TestCase):
         self.assertEquals(parse.peel_off_string('\x01RI\x03]\x04asdf'),
                           ({'bg': 'I', 'string': ']', 'fg': 'R', 'colormarker':
                             '\x01RI', 'bold': ''}, 'asdf'))
+
+class TestTokenFormatter(unittest.TestCase):
+
+    def setUp(self):
+        self.formatter = BPythonFormatter(config.color_scheme)
+        self.token_formatter = parse.TokenFormatter(config.color_scheme)
+
+    def assertFormatsLikeParse(self, tokens):
+        tokens = list(tokens)
+        self.assertEqual(self.token_formatter.format(tokens),
+                         parse.parse(format(tokens, self.formatter)))
+
+    def test_source(self):
+        for source in [u'', u'x', u'def f(a, b=[1, 2]):\n',
+                       u'print("abc")  # comment\n', u'  \n', u"'''doc'''"]:
+            self.assertFormatsLikeParse(PythonLexer().get_tokens(source))
+
+    def test_format(self):
+        self.assertEqual(self.token_formatter.format(
+            [(Token.Keyword, u'print'), (Token.Text, u'\n')]),
+            yellow(u'print'))
+
+    def test_parenthesis(self):
+        self.assertFormatsLikeParse([(Token.Name, u'f'), (Parenthesis, u'('),
+                                     (Parenthesis.UnderCursor, u')')])
+
+    def test_subtypes(self):
+        self.assertFormatsLikeParse([(Token.Literal.String.Escape, u'\\n'),
+                                     (Token.Name.Builtin.Pseudo, u'self')])
+
+    def test_escape_sequence(self):
+        self.assertFormatsLikeParse([(Token.String, u'"\x1b[31mred"')])
+
+class TestHighlightCache(unittest.TestCase):
+
+    def setUp(self):
+        self.formatter = parse.TokenFormatter(config.color_scheme)
+        self.formatter.format = mock.Mock(wraps=self.formatter.format)
+        self.cache = parse.HighlightCache(self.formatter, 20)
+
+    def line(self, text):
+        return [(Token.Keyword, u'def'), (Token.Name, text)]
+
+    def test_format(self):
+        self.assertEqual(self.cache.format(self.line(u'abc')),
+                         self.formatter.format(self.line(u'abc')))
+
+    def test_hit(self):
+        first = self.cache.format(self.line(u'abc'))
+        self.assertIs(self.cache.format(self.line(u'abc')), first)
+        self.assertEqual(self.formatter.format.call_count, 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_tokens_are_the_key(self):
+        self.cache.format([(Token.Name, u'abc')])
+        self.cache.format([(Token.String, u'abc')])
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_least_recently_used_is_evicted(self):
+        for text in [u'abc', u'def', u'abc', u'ghi']:
+            self.cache.format(self.line(text))
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.used, 14)
+        self.cache.format(self.line(u'abc'))
+        self.cache.format(self.line(u'def'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 4))
+
+    def test_too_long_line(self):
+        self.cache.format(self.line(u'x' * 17))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.used, 0)
+
+    def test_disabled(self):
+        cache = parse.HighlightCache(self.formatter, 0)
+        cache.format(self.line(u''))
+        cache.format(self.line(u''))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
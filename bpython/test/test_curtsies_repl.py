@@ -7,6 +7,7 @@ import os
 from StringIO import StringIO
 import sys
 import tempfile
+import threading
 
 import unittest
 try:
@@ -19,6 +20,7 @@ py3 = (sys.version_info[0] == 3)
 
 from bpython.curtsiesfrontend import repl as curtsiesrepl
 from bpython.curtsiesfrontend import interpreter
+from bpython.curtsiesfrontend import events
 from bpython import autocomplete
 from bpython import config
 from bpython import args
@@ -195,6 +197,130 @@ class TestCurtsiesReplFilenameCompletion(unittest.TestCase):
         self.assertEqual(self.repl.list_win_visible, False)
 
 
+class TestCurtsiesReplCompletionBudget(unittest.TestCase):
+
+    def test_skipped_completer_is_shown_in_status_bar(self):
+        repl = create_repl()
+        key = (autocomplete.GlobalCompletion, None)
+        repl.completion_budget.disabled[key] = float('inf')
+        repl._current_line = 'ab'
+        repl._cursor_offset = 2
+        repl.complete()
+        self.assertEqual(repl.matches_iter.matches, [])
+        self.assertEqual(repl.status_bar._message,
+                         'Completion too slow, skipped: GlobalCompletion')
+
+
+class TestCurtsiesReplAsyncCompletion(unittest.TestCase):
+
+    def setUp(self):
+        self.ready = threading.Event()
+        self.repl = create_repl(request_completions=self.ready.set)
+        self.repl.interp.locals['foobar'] = 1
+        self.repl.interp.locals['foobaz'] = 2
+
+    def tearDown(self):
+        self.repl.completion_worker.stop()
+
+    def type_line(self, line):
+        self.ready.clear()
+        self.repl._cursor_offset = len(line)
+        self.repl._current_line = line
+        self.repl.update_completion()
+
+    def test_matches_are_shown_when_ready(self):
+        self.type_line('fooba')
+        self.assertEqual(self.repl.list_win_visible, False)
+        self.ready.wait(5)
+        self.assertTrue(self.ready.is_set())
+        self.repl.process_event(events.CompletionsReadyEvent())
+        self.assertEqual(self.repl.list_win_visible, True)
+        self.assertEqual(self.repl.matches_iter.matches, ['foobar', 'foobaz'])
+
+    def test_last_matches_are_shown_until_ready(self):
+        self.type_line('fooba')
+        self.ready.wait(5)
+        self.assertTrue(self.ready.is_set())
+        self.repl.process_event(events.CompletionsReadyEvent())
+        self.type_line('foobar')
+        self.assertEqual(self.repl.matches_iter.matches, ['foobar', 'foobaz'])
+
+    def test_matches_for_another_line_are_discarded(self):
+        self.type_line('fooba')
+        self.ready.wait(5)
+        self.assertTrue(self.ready.is_set())
+        self.repl._current_line = 'foob'
+        self.repl._cursor_offset = 4
+        self.repl.process_event(events.CompletionsReadyEvent())
+        self.assertEqual(self.repl.list_win_visible, False)
+
+    def test_tab_completes_synchronously(self):
+        self.repl.completion_worker.stop()
+        self.repl.completion_worker = Mock(pending=True)
+        self.type_line('foob')
+        self.repl.on_tab()
+        self.assertEqual(self.repl.current_line, 'fooba')
+        self.repl.completion_worker.cancel.assert_called_with()
+
+    def test_tab_waits_for_worker(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        find_matches = self.repl.find_matches
+
+        def slow_find_matches(*args):
+            worker = threading.current_thread().name == 'bpython-completion'
+            calls.append(('start', worker))
+            if worker:
+                started.set()
+                release.wait(5)
+            try:
+                return find_matches(*args)
+            finally:
+                calls.append(('end', worker))
+
+        self.repl.find_matches = slow_find_matches
+        self.type_line('foob')
+        started.wait(5)
+        self.assertTrue(started.is_set())
+        tab = threading.Thread(target=self.repl.on_tab)
+        tab.start()
+        tab.join(0.2)
+        self.assertEqual(calls, [('start', True)])
+        release.set()
+        tab.join(5)
+        self.assertFalse(tab.is_alive())
+        self.assertEqual(calls, [('start', True), ('end', True),
+                                 ('start', False), ('end', False)])
+        self.assertEqual(self.repl.current_line, 'fooba')
+
+    def test_code_does_not_run_while_completing(self):
+        started = threading.Event()
+        release = threading.Event()
+        seen = []
+        find_matches = self.repl.find_matches
+
+        def slow_find_matches(*args):
+            started.set()
+            release.wait(5)
+            try:
+                return find_matches(*args)
+            finally:
+                seen.append(self.repl.interp.locals['foobar'])
+
+        self.repl.find_matches = slow_find_matches
+        self.type_line('foob')
+        started.wait(5)
+        self.assertTrue(started.is_set())
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        self.repl.push('foobar = 3')
+        timer.join()
+        # The completion started first saw the namespace before the code ran
+        self.assertEqual(seen[0], 1)
+        self.assertEqual(self.repl.interp.locals['foobar'], 3)
+
+
 @contextmanager # from http://stackoverflow.com/a/17981937/398212 - thanks @rkennedy
 def captured_output():
     new_out, new_err = StringIO(), StringIO()
@@ -1,12 +1,51 @@
 from bpython import importcompletion
+from bpython.matching import SUBSTRING, FUZZY
 
+import mock
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
 import unittest
+import zipfile
+
+try:
+    import watchdog
+    has_watchdog = True
+except ImportError:
+    has_watchdog = False
+
+
+def find_modules(path):
+    """Return the modules found in the path entries `path`."""
+    original_modules = importcompletion.modules
+    importcompletion.modules = importcompletion.ModuleIndex()
+    try:
+        scanner = importcompletion.ModuleScanner(path)
+        scanner.start()
+        scanner.join()
+        return set(importcompletion.modules)
+    finally:
+        importcompletion.modules = original_modules
+
+
+def scan_sys_path(path):
+    """Search `path` like `sys.path` is searched at startup, using the
+    module cache."""
+    with mock.patch.object(sys, 'path', path):
+        scanner = importcompletion.ModuleScanner()
+        scanner.start()
+        scanner.join()
+
 
 class TestSimpleComplete(unittest.TestCase):
 
     def setUp(self):
         self.original_modules = importcompletion.modules
-        importcompletion.modules = ['zzabc', 'zzabd', 'zzefg', 'zzabc.e', 'zzabc.f']
+        importcompletion.modules = importcompletion.ModuleIndex(
+            ['zzabc', 'zzabd', 'zzefg', 'zzabc.e', 'zzabc.f'])
 
     def tearDown(self):
         importcompletion.modules = self.original_modules
@@ -17,19 +56,236 @@ class TestSimpleComplete(unittest.TestCase):
     def test_package_completion(self):
         self.assertEqual(importcompletion.complete(13, 'import zzabc.'), ['zzabc.e', 'zzabc.f', ])
 
+    def test_substring_completion(self):
+        self.assertEqual(importcompletion.complete(9, 'import bd', SUBSTRING),
+                         ['zzabd'])
+
+    def test_fuzzy_completion(self):
+        self.assertEqual(importcompletion.complete(10, 'import zae', FUZZY),
+                         [])
+        self.assertEqual(importcompletion.complete(10, 'import zzg', FUZZY),
+                         ['zzefg'])
+
+
+class TestModuleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = importcompletion.ModuleIndex(
+            ['a', 'ab', 'a.b', 'a.c', 'a.b.c', 'a.b.d', 'a0', 'b'])
+
+    def test_matches_are_one_level_deep(self):
+        self.assertEqual(self.index.matches('a'), ['a', 'a0', 'ab'])
+        self.assertEqual(self.index.matches('a.'), ['a.b', 'a.c'])
+        self.assertEqual(self.index.matches('a.b.'), ['a.b.c', 'a.b.d'])
+        self.assertEqual(self.index.matches('c'), [])
+
+    def test_fuzzy_matches_are_one_level_deep(self):
+        self.assertEqual(self.index.matches('b', FUZZY), ['ab', 'b'])
+        self.assertEqual(self.index.matches('a.', FUZZY), ['a.b', 'a.c'])
+        self.assertEqual(self.index.matches('a.d', SUBSTRING), [])
+        self.assertEqual(self.index.matches('a.b.d', SUBSTRING), ['a.b.d'])
+
+    def test_fuzzy_matches_see_new_names(self):
+        self.assertEqual(self.index.matches('a.c', FUZZY), ['a.c'])
+        self.index.add('a.cc')
+        self.assertEqual(self.index.matches('a.c', FUZZY), ['a.c', 'a.cc'])
+
+    def test_incremental_insertion(self):
+        self.index.update(['a.bb', 'a.b'])
+        self.index.add('a.a')
+        self.assertEqual(self.index.matches('a.'),
+                         ['a.a', 'a.b', 'a.bb', 'a.c'])
+        self.assertEqual(len(self.index), 10)
+
+    def test_removal(self):
+        self.index.discard('a.b')
+        self.index.difference_update(['a0', 'zz'])
+        self.assertEqual(self.index.matches('a'), ['a', 'ab'])
+        self.assertNotIn('a.b', self.index)
+        self.assertIn('a.b.c', self.index)
+        self.index.intersection_update(['b'])
+        self.assertEqual(list(self.index), ['b'])
+
+    def test_clear(self):
+        self.index.add('c')
+        self.index.clear()
+        self.assertEqual(list(self.index), [])
+
+
+class TestScanDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for dirname in ('zzpkg', 'zzdir', 'zzfake.py', 'zz-pkg'):
+            os.makedirs(os.path.join(self.tmpdir, dirname))
+        for filename in ('zzmod.py', 'zzext' + importcompletion.SUFFIXES[0],
+                         'zz-mod.py', 'zz.mod.py', 'README.txt', 'zznosuffix',
+                         os.path.join('zzpkg', '__init__.py'),
+                         os.path.join('zzpkg', 'sub.py'),
+                         os.path.join('zzdir', 'zznotinpkg.py'),
+                         os.path.join('zz-pkg', '__init__.py')):
+            open(os.path.join(self.tmpdir, filename), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_classification(self):
+        with mock.patch('imp.find_module') as find_module:
+            found = find_modules([self.tmpdir])
+        self.assertFalse(find_module.called)
+        self.assertEqual(found, set(['zzmod', 'zzext', 'zzpkg', 'zzpkg.sub']))
+
+    def test_fodder(self):
+        test_dir = os.path.dirname(os.path.abspath(__file__))
+        found = find_modules([test_dir])
+        self.assertTrue(set(['__init__', 'test_importcompletion', 'fodder',
+                             'fodder.original', 'fodder.processed']) <= found)
+        self.assertEqual([name for name in found if '__' in name[1:]],
+                         ['__init__'])
+
+    @mock.patch.object(importcompletion, 'modules',
+                       importcompletion.ModuleIndex())
+    def test_new_package_is_found(self):
+        with mock.patch.object(importcompletion, 'cache_path',
+                               os.path.join(self.tmpdir, 'modules.cache')):
+            scan_sys_path([self.tmpdir])
+            open(os.path.join(self.tmpdir, 'zzdir', '__init__.py'),
+                 'w').close()
+            os.utime(os.path.join(self.tmpdir, 'zzdir'), (0, 0))
+            scan_sys_path([self.tmpdir])
+        self.assertIn('zzdir.zznotinpkg', importcompletion.modules)
+
+
+class TestArchives(unittest.TestCase):
+
+    def setUp(self):
+        self.original_modules = importcompletion.modules
+        self.original_cache_path = importcompletion.cache_path
+        importcompletion.modules = importcompletion.ModuleIndex()
+        self.tmpdir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.tmpdir, 'zzapp.zip')
+        archive = zipfile.ZipFile(self.archive, 'w')
+        for member in ('zztop.py', 'zzpkg/__init__.py', 'zzpkg/sub.py',
+                       'zzpkg/data.txt', 'zzpkg/deep/__init__.py',
+                       'zzpkg/deep/mod.py', 'zznotpkg/mod.py',
+                       'lib/zzlib.py', 'zz-top.py'):
+            archive.writestr(member, '')
+        archive.close()
+        importcompletion.cache_path = os.path.join(self.tmpdir, 'modules.cache')
+
+    def tearDown(self):
+        importcompletion.modules = self.original_modules
+        importcompletion.cache_path = self.original_cache_path
+        shutil.rmtree(self.tmpdir)
+
+    def scan(self, path):
+        scan_sys_path(path)
+        return set(importcompletion.modules)
+
+    def test_modules_in_archive(self):
+        self.assertEqual(find_modules([self.archive]),
+                         set(['zztop', 'zzpkg', 'zzpkg.sub', 'zzpkg.deep',
+                              'zzpkg.deep.mod']))
+
+    def test_directory_inside_archive(self):
+        path = os.path.join(self.archive, 'lib')
+        self.assertEqual(find_modules([path]), set(['zzlib']))
+
+    def test_not_an_archive(self):
+        path = os.path.join(self.tmpdir, 'zzbroken.zip')
+        with open(path, 'w') as f:
+            f.write('not a zip file')
+        self.assertEqual(find_modules([path]), set())
+
+    def test_archive_is_cached(self):
+        mtime = time.time() - 60
+        os.utime(self.archive, (mtime, mtime))
+        self.assertIn('zzpkg.deep.mod', self.scan([self.archive]))
+        importcompletion.modules = importcompletion.ModuleIndex()
+        with mock.patch.object(importcompletion, '_scan_archive') as scan:
+            self.assertIn('zzpkg.deep.mod', self.scan([self.archive]))
+        self.assertFalse(scan.called)
+
+    def test_changed_archive_is_scanned(self):
+        self.scan([self.archive])
+        archive = zipfile.ZipFile(self.archive, 'a')
+        archive.writestr('zznew.py', '')
+        archive.close()
+        self.assertIn('zznew', self.scan([self.archive]))
+
+    def test_scanner(self):
+        scanner = importcompletion.ModuleScanner([self.archive])
+        scanner.start()
+        self.assertTrue(scanner.join(10))
+        self.assertIn('zzpkg.deep.mod', importcompletion.modules)
+
+
+class TestAttrMatches(unittest.TestCase):
+
+    def setUp(self):
+        self.module = types.ModuleType('zzmodule')
+        self.module.zzfoo = 1
+        self.module.zzbar = 2
+        self.submodule = types.ModuleType('zzmodule.zzsub')
+        self.module.zzsub = self.submodule
+        self.modules = mock.patch.dict(sys.modules, {'zzmodule': self.module})
+        self.modules.start()
+
+    def tearDown(self):
+        self.modules.stop()
+
+    def test_attributes(self):
+        self.assertEqual(importcompletion.attr_matches('zzmodule.zz'),
+                         ['zzmodule.zzbar', 'zzmodule.zzfoo', 'zzmodule.zzsub'])
+        self.assertEqual(importcompletion.attr_matches('zzf', 'zzmodule'),
+                         ['zzfoo'])
+        self.assertEqual(importcompletion.attr_matches('x', 'zzmodule'), [])
+
+    def test_dir_is_cached(self):
+        importcompletion.attr_matches('zzmodule.zz')
+        with mock.patch.object(importcompletion, 'dir', create=True) as dir_:
+            importcompletion.attr_matches('zzmodule.zzf')
+        self.assertFalse(dir_.called)
+
+    def test_new_attribute(self):
+        importcompletion.attr_matches('zzmodule.zz')
+        self.module.zzbaz = 3
+        self.assertEqual(importcompletion.attr_matches('zzmodule.zzba'),
+                         ['zzmodule.zzbar', 'zzmodule.zzbaz'])
+
+    def test_replaced_module(self):
+        importcompletion.attr_matches('zzmodule.zz')
+        module = types.ModuleType('zzmodule')
+        module.zzother = 1
+        sys.modules['zzmodule'] = module
+        self.assertEqual(importcompletion.attr_matches('zzmodule.zz'),
+                         ['zzmodule.zzother'])
+
+    def test_only_modules(self):
+        self.assertEqual(importcompletion.module_attr_matches('zzmodule.zz'),
+                         [])
+        sys.modules['zzmodule.zzsub'] = self.submodule
+        self.assertEqual(importcompletion.module_attr_matches('zzmodule.zz'),
+                         ['zzmodule.zzsub'])
+
 
 class TestRealComplete(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        [_ for _ in importcompletion.find_iterator]
+        cls.original_cache_path = importcompletion.cache_path
+        importcompletion.cache_path = None
+        importcompletion.modules = importcompletion.ModuleIndex()
+        scanner = importcompletion.ModuleScanner()
+        scanner.start()
+        scanner.join()
         __import__('sys')
         __import__('os')
 
     @classmethod
     def tearDownClass(cls):
-        importcompletion.find_iterator = importcompletion.find_all_modules()
-        importcompletion.modules = set()
+        importcompletion.modules = importcompletion.ModuleIndex()
+        importcompletion.cache_path = cls.original_cache_path
 
     def test_from_attribute(self):
         self.assertEqual(importcompletion.complete(19, 'from sys import arg'), ['argv'])
@@ -40,3 +296,412 @@ class TestRealComplete(unittest.TestCase):
     def test_from_package(self):
         self.assertEqual(importcompletion.complete(17, 'from xml import d'), ['dom'])
 
+
+class TestModuleCache(unittest.TestCase):
+
+    def setUp(self):
+        self.original_modules = importcompletion.modules
+        self.original_cache_path = importcompletion.cache_path
+        importcompletion.modules = importcompletion.ModuleIndex()
+        self.tmpdir = tempfile.mkdtemp()
+        self.site = os.path.join(self.tmpdir, 'site')
+        os.makedirs(os.path.join(self.site, 'zzpkg'))
+        for filename in ('zzmod.py', os.path.join('zzpkg', '__init__.py'),
+                         os.path.join('zzpkg', 'sub.py')):
+            open(os.path.join(self.site, filename), 'w').close()
+        self.age(self.site, os.path.join(self.site, 'zzpkg'))
+        importcompletion.cache_path = os.path.join(self.tmpdir, 'modules.cache')
+
+    def tearDown(self):
+        importcompletion.modules = self.original_modules
+        importcompletion.cache_path = self.original_cache_path
+        shutil.rmtree(self.tmpdir)
+
+    def age(self, *paths):
+        mtime = time.time() - 60
+        for path in paths:
+            os.utime(path, (mtime, mtime))
+
+    def scan(self, path=None):
+        if path is None:
+            path = [self.site]
+        scan_sys_path(path)
+
+    def cached_modules(self, entries):
+        cache = importcompletion.ModuleCache(importcompletion.cache_path)
+        cache.load()
+        return cache.cached_modules(entries)
+
+    def test_cache_is_written(self):
+        self.scan()
+        self.assertTrue(os.path.exists(importcompletion.cache_path))
+        self.assertTrue(set(['zzmod', 'zzpkg', 'zzpkg.sub']) <=
+                        self.cached_modules([self.site]))
+
+    def test_unchanged_directories_are_not_scanned(self):
+        self.scan()
+        with mock.patch.object(importcompletion, '_scan_directory') as scan:
+            self.scan()
+        self.assertFalse(scan.called)
+        self.assertIn('zzpkg.sub', importcompletion.modules)
+
+    def test_changed_directory_is_scanned(self):
+        self.scan()
+        pkg = os.path.join(self.site, 'zzpkg')
+        open(os.path.join(pkg, 'other.py'), 'w').close()
+        os.utime(pkg, (0, 0))
+        scan = mock.Mock(wraps=importcompletion._scan_directory)
+        with mock.patch.object(importcompletion, '_scan_directory', scan):
+            self.scan()
+        self.assertEqual(scan.call_args_list, [mock.call(pkg)])
+        self.assertIn('zzpkg.other', importcompletion.modules)
+
+    def test_removed_modules_are_dropped(self):
+        self.scan()
+        os.remove(os.path.join(self.site, 'zzmod.py'))
+        os.utime(self.site, (0, 0))
+        importcompletion.modules = importcompletion.ModuleIndex()
+        self.scan()
+        self.assertNotIn('zzmod', importcompletion.modules)
+
+    def test_recently_modified_directory_is_scanned(self):
+        self.scan()
+        open(os.path.join(self.site, 'zznew.py'), 'w').close()
+        scan = mock.Mock(wraps=importcompletion._scan_directory)
+        with mock.patch.object(importcompletion, '_scan_directory', scan):
+            self.scan()
+            self.scan()
+        self.assertEqual(scan.call_args_list, [mock.call(self.site)] * 2)
+        self.assertIn('zznew', importcompletion.modules)
+
+    def test_modules_of_other_entries_are_not_used(self):
+        other = os.path.join(self.tmpdir, 'other')
+        os.mkdir(other)
+        open(os.path.join(other, 'zzother.py'), 'w').close()
+        self.age(other)
+        self.scan([other])
+        importcompletion.modules = importcompletion.ModuleIndex()
+        # Keep the names the scan does not find
+        with mock.patch.object(importcompletion.modules,
+                               'intersection_update'):
+            self.scan()
+        self.assertNotIn('zzother', importcompletion.modules)
+
+    def test_records_of_other_entries_are_kept(self):
+        other = os.path.join(self.tmpdir, 'other')
+        os.mkdir(other)
+        open(os.path.join(other, 'zzother.py'), 'w').close()
+        self.age(other)
+        self.scan([other])
+        self.scan()
+        self.assertIn('zzother', self.cached_modules([other]))
+        self.assertIn('zzmod', self.cached_modules([self.site]))
+        shutil.rmtree(other)
+        self.scan()
+        self.assertEqual(self.cached_modules([other]), set())
+
+    def test_cache_of_other_version_is_ignored(self):
+        with open(importcompletion.cache_path, 'w') as f:
+            f.write('{"version": -1, "entries": {"x": {"modules": ["zzold"]}}}')
+        self.scan()
+        self.assertNotIn('zzold', importcompletion.modules)
+
+    def test_corrupt_cache_is_ignored(self):
+        with open(importcompletion.cache_path, 'w') as f:
+            f.write('{"version": ')
+        self.scan()
+        self.assertIn('zzmod', importcompletion.modules)
+
+
+class TestModuleScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.original_modules = importcompletion.modules
+        importcompletion.modules = importcompletion.ModuleIndex()
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'zzpkg', 'zzsubpkg'))
+        for filename in ('zzmod.py', os.path.join('zzpkg', '__init__.py'),
+                         os.path.join('zzpkg', 'a.py'),
+                         os.path.join('zzpkg', 'zzsubpkg', '__init__.py'),
+                         os.path.join('zzpkg', 'zzsubpkg', 'b.py')):
+            open(os.path.join(self.tmpdir, filename), 'w').close()
+
+    def tearDown(self):
+        importcompletion.modules = self.original_modules
+        shutil.rmtree(self.tmpdir)
+
+    def scan(self, path, workers=4):
+        scanner = importcompletion.ModuleScanner(path, workers)
+        scanner.start()
+        self.assertTrue(scanner.join(10))
+        self.assertFalse(scanner.running)
+        return set(importcompletion.modules)
+
+    def test_finds_modules_in_package_subtrees(self):
+        self.assertEqual(self.scan([self.tmpdir]),
+                         set(['zzmod', 'zzpkg', 'zzpkg.a', 'zzpkg.zzsubpkg',
+                              'zzpkg.zzsubpkg.b']))
+
+    def test_same_results_with_one_worker(self):
+        path = [os.path.dirname(os.path.dirname(__file__))]
+        importcompletion.modules = importcompletion.ModuleIndex()
+        single = self.scan(path, workers=1)
+        importcompletion.modules = importcompletion.ModuleIndex()
+        self.assertEqual(self.scan(path), single)
+
+    def test_repeated_directories_are_scanned_once(self):
+        scan = mock.Mock(wraps=importcompletion._scan_directory)
+        with mock.patch.object(importcompletion, '_scan_directory', scan):
+            self.scan([self.tmpdir, self.tmpdir + os.sep])
+        self.assertEqual(scan.call_count, 3)
+
+    @unittest.skipIf(not hasattr(os, 'symlink'), 'symlinks not available')
+    def test_symlink_loop(self):
+        os.symlink(os.path.join(self.tmpdir, 'zzpkg'),
+                   os.path.join(self.tmpdir, 'zzpkg', 'zzloop'))
+        self.assertIn('zzpkg.zzloop', self.scan([self.tmpdir]))
+
+    def test_empty_path(self):
+        self.assertEqual(self.scan([]), set())
+
+
+class TestLazyModuleScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.original_modules = importcompletion.modules
+        self.original_scanner = importcompletion.scanner
+        importcompletion.modules = importcompletion.ModuleIndex()
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'zzpkg', 'zzsubpkg'))
+        for filename in ('zzmod.py', os.path.join('zzpkg', '__init__.py'),
+                         os.path.join('zzpkg', 'a.py'),
+                         os.path.join('zzpkg', 'zzsubpkg', '__init__.py'),
+                         os.path.join('zzpkg', 'zzsubpkg', 'b.py')):
+            open(os.path.join(self.tmpdir, filename), 'w').close()
+        self.scanner = importcompletion.ModuleScanner([self.tmpdir],
+                                                      lazy=True)
+        self.scanner.start()
+        self.assertTrue(self.scanner.join(10))
+
+    def tearDown(self):
+        importcompletion.modules = self.original_modules
+        importcompletion.scanner = self.original_scanner
+        shutil.rmtree(self.tmpdir)
+
+    def test_only_top_level_is_searched(self):
+        self.assertEqual(set(importcompletion.modules),
+                         set(['zzmod', 'zzpkg']))
+
+    def test_expand(self):
+        self.assertTrue(self.scanner.expand('zzpkg', 10))
+        self.assertEqual(set(importcompletion.modules),
+                         set(['zzmod', 'zzpkg', 'zzpkg.a', 'zzpkg.zzsubpkg']))
+        self.assertTrue(self.scanner.expand('zzpkg.zzsubpkg', 10))
+        self.assertIn('zzpkg.zzsubpkg.b', importcompletion.modules)
+
+    def test_expand_is_memoised(self):
+        self.scanner.expand('zzpkg', 10)
+        scan = mock.Mock(wraps=importcompletion._scan_directory)
+        with mock.patch.object(importcompletion, '_scan_directory', scan):
+            self.assertTrue(self.scanner.expand('zzpkg', 10))
+        self.assertFalse(scan.called)
+
+    def test_expand_parents(self):
+        self.assertTrue(self.scanner.expand('zzpkg.zzsubpkg', 10))
+        self.assertIn('zzpkg.zzsubpkg.b', importcompletion.modules)
+
+    def test_completion_expands_package(self):
+        importcompletion.scanner = self.scanner
+        with mock.patch.object(importcompletion, 'expand_timeout', 10):
+            self.assertEqual(importcompletion.complete(13, 'import zzpkg.'),
+                             ['zzpkg.a', 'zzpkg.zzsubpkg'])
+            self.assertEqual(
+                importcompletion.complete(28, 'from zzpkg.zzsubpkg import b'),
+                ['b'])
+
+
+@unittest.skipIf(not has_watchdog, "watchdog not available")
+class TestModuleIndexWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.original_modules = importcompletion.modules
+        importcompletion.modules = importcompletion.ModuleIndex()
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'zzpkg', 'zzsubpkg'))
+        for filename in ('zzmod.py', os.path.join('zzpkg', '__init__.py'),
+                         os.path.join('zzpkg', 'a.py'),
+                         os.path.join('zzpkg', 'zzsubpkg', '__init__.py'),
+                         os.path.join('zzpkg', 'zzsubpkg', 'b.py')):
+            self.touch(filename)
+        self.scanner = importcompletion.ModuleScanner([self.tmpdir],
+                                                      watch=True)
+        self.scanner.watcher.delay = 0.05
+        self.scanner.start()
+        self.assertTrue(self.scanner.join(10))
+
+    def tearDown(self):
+        self.scanner.watcher.stop()
+        importcompletion.modules = self.original_modules
+        shutil.rmtree(self.tmpdir)
+
+    def touch(self, filename):
+        open(os.path.join(self.tmpdir, filename), 'w').close()
+
+    def test_new_module(self):
+        self.touch(os.path.join('zzpkg', 'c.py'))
+        self.scanner.update_directory(os.path.join(self.tmpdir, 'zzpkg'))
+        self.assertIn('zzpkg.c', importcompletion.modules)
+
+    def test_removed_module(self):
+        os.remove(os.path.join(self.tmpdir, 'zzmod.py'))
+        self.scanner.update_directory(self.tmpdir)
+        self.assertNotIn('zzmod', importcompletion.modules)
+        self.assertIn('zzpkg.a', importcompletion.modules)
+
+    def test_new_package(self):
+        os.makedirs(os.path.join(self.tmpdir, 'zznew', 'sub'))
+        self.touch(os.path.join('zznew', '__init__.py'))
+        self.touch(os.path.join('zznew', 'sub', '__init__.py'))
+        self.touch(os.path.join('zznew', 'sub', 'c.py'))
+        self.scanner.update_directory(self.tmpdir)
+        self.assertEqual(importcompletion.modules.subtree('zznew'),
+                         ['zznew', 'zznew.sub', 'zznew.sub.c'])
+
+    def test_removed_package(self):
+        shutil.rmtree(os.path.join(self.tmpdir, 'zzpkg'))
+        self.scanner.update_directory(self.tmpdir)
+        self.assertEqual(set(importcompletion.modules), set(['zzmod']))
+        self.assertNotIn(os.path.join(self.tmpdir, 'zzpkg'),
+                         self.scanner.directories)
+
+    def test_package_without_init(self):
+        os.remove(os.path.join(self.tmpdir, 'zzpkg', 'zzsubpkg',
+                               '__init__.py'))
+        self.scanner.update_directory(
+            os.path.join(self.tmpdir, 'zzpkg', 'zzsubpkg'))
+        self.assertEqual(importcompletion.modules.subtree('zzpkg'),
+                         ['zzpkg', 'zzpkg.a'])
+
+    def test_directory_becomes_package(self):
+        os.makedirs(os.path.join(self.tmpdir, 'zzpkg', 'notyet'))
+        self.touch(os.path.join('zzpkg', 'notyet', 'c.py'))
+        self.scanner.update_directory(os.path.join(self.tmpdir, 'zzpkg'))
+        self.assertNotIn('zzpkg.notyet', importcompletion.modules)
+
+        self.touch(os.path.join('zzpkg', 'notyet', '__init__.py'))
+        self.scanner.update_directory(
+            os.path.join(self.tmpdir, 'zzpkg', 'notyet'))
+        self.assertEqual(importcompletion.modules.subtree('zzpkg.notyet'),
+                         ['zzpkg.notyet', 'zzpkg.notyet.c'])
+
+    def test_package_without_init_becomes_package_again(self):
+        path = os.path.join(self.tmpdir, 'zzpkg', 'zzsubpkg')
+        os.remove(os.path.join(path, '__init__.py'))
+        self.scanner.update_directory(path)
+        self.touch(os.path.join('zzpkg', 'zzsubpkg', '__init__.py'))
+        self.scanner.update_directory(path)
+        self.assertEqual(importcompletion.modules.subtree('zzpkg.zzsubpkg'),
+                         ['zzpkg.zzsubpkg', 'zzpkg.zzsubpkg.b'])
+
+    def test_unchanged_names_are_kept(self):
+        with mock.patch.object(importcompletion.modules,
+                               'difference_update') as difference_update:
+            self.touch(os.path.join('zzpkg', 'c.py'))
+            self.scanner.update_directory(os.path.join(self.tmpdir, 'zzpkg'))
+        self.assertEqual(list(difference_update.call_args[0][0]), [])
+
+    def test_one_watch_per_entry(self):
+        self.assertEqual(list(self.scanner.watcher.watches), [self.tmpdir])
+        self.assertEqual(len(self.scanner.watcher.observer.emitters), 1)
+
+    def test_watch_failure(self):
+        watcher = self.scanner.watcher
+        entry = self.tmpdir + '-other'
+        with mock.patch.object(watcher.observer, 'schedule',
+                               side_effect=OSError(24, 'Too many open files')):
+            self.assertFalse(watcher.watch(entry, 1))
+        self.assertFalse(watcher.watching(entry))
+
+    def test_subdirectory_of_watched_entry(self):
+        entry = os.path.join(self.tmpdir, 'zzpkg')
+        self.assertTrue(self.scanner.watcher.watch(entry, 1))
+        self.assertEqual(len(self.scanner.watcher.observer.emitters), 1)
+
+    def test_unwatched_entries_are_revalidated(self):
+        self.scanner.watcher.stop()
+        self.scanner = importcompletion.ModuleScanner([self.tmpdir],
+                                                      watch=True)
+        self.scanner.watcher.max_directories = 1
+        self.scanner.start()
+        self.assertTrue(self.scanner.join(10))
+        self.assertFalse(self.scanner.watcher.watching(self.tmpdir))
+
+        self.touch(os.path.join('zzpkg', 'c.py'))
+        self.scanner.revalidate()
+        for _ in range(100):
+            if not self.scanner.revalidating:
+                break
+            time.sleep(0.05)
+        self.assertIn('zzpkg.c', importcompletion.modules)
+
+        # A directory which becomes a package is noticed as well
+        os.makedirs(os.path.join(self.tmpdir, 'zzpkg', 'notyet'))
+        self.touch(os.path.join('zzpkg', 'notyet', 'd.py'))
+        self.scanner.revalidated = 0
+        self.scanner.revalidate()
+        for _ in range(100):
+            if not self.scanner.revalidating:
+                break
+            time.sleep(0.05)
+        self.touch(os.path.join('zzpkg', 'notyet', '__init__.py'))
+        self.scanner.revalidated = 0
+        self.scanner.revalidate()
+        for _ in range(100):
+            if not self.scanner.revalidating:
+                break
+            time.sleep(0.05)
+        self.assertIn('zzpkg.notyet.d', importcompletion.modules)
+
+        # Not again right away
+        with mock.patch.object(self.scanner, 'update_directory') as update:
+            self.scanner.revalidate()
+        self.assertFalse(self.scanner.revalidating)
+        self.assertFalse(update.called)
+
+    def test_events_are_coalesced(self):
+        with mock.patch.object(self.scanner, 'update_directory') as update:
+            for name in ('c.py', 'd.py', 'e.py'):
+                self.touch(os.path.join('zzpkg', name))
+            for _ in range(100):
+                if update.called:
+                    break
+                time.sleep(0.05)
+            time.sleep(0.2)
+        self.assertEqual(update.call_args_list,
+                         [mock.call(os.path.join(self.tmpdir, 'zzpkg'))])
+
+
+class TestReload(unittest.TestCase):
+
+    def setUp(self):
+        self.original_modules = importcompletion.modules
+        self.original_scanner = importcompletion.scanner
+        importcompletion.modules = importcompletion.ModuleIndex(['zzold'])
+
+    def tearDown(self):
+        importcompletion.modules = self.original_modules
+        importcompletion.scanner = self.original_scanner
+
+    def test_reload_scans_again_with_same_policy(self):
+        old = mock.Mock(lazy=True, watcher=mock.Mock())
+        importcompletion.scanner = old
+        with mock.patch.object(importcompletion,
+                               'ModuleScanner') as ModuleScanner:
+            new = importcompletion.reload()
+        old.join.assert_called_once_with()
+        old.watcher.stop.assert_called_once_with()
+        self.assertEqual(list(importcompletion.modules), [])
+        ModuleScanner.assert_called_once_with(lazy=True, watch=True)
+        self.assertIs(new, ModuleScanner.return_value)
+        self.assertIs(importcompletion.scanner, new)
+        new.start.assert_called_once_with()
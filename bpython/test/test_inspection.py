@@ -58,5 +58,101 @@ class TestInspection(unittest.TestCase):
         self.assertEqual(repr(defaults[0]), "23")
         self.assertEqual(repr(defaults[1]), "'yay'")
 
+
+class Spy(object):
+    """Fails the test if any attribute of its instances is looked up."""
+    attribute = 1
+
+    def __init__(self):
+        object.__setattr__(self, 'instance_attribute', 2)
+
+    def __getattribute__(self, name):
+        raise AssertionError('looked up ' + name)
+
+    def __getattr__(self, name):
+        raise AssertionError('looked up ' + name)
+
+    def __dir__(self):
+        raise AssertionError('called __dir__')
+
+
+class OldSpy:
+    attribute = 1
+
+    def __getattr__(self, name):
+        raise AssertionError('looked up ' + name)
+
+
+class TestStaticAttributes(unittest.TestCase):
+
+    def test_instance(self):
+        names = inspection.static_attributes(Spy())
+        self.assertTrue(set(['attribute', 'instance_attribute', '__class__',
+                             '__getattr__', '__init__']).issubset(names))
+
+    def test_old_style_instance(self):
+        obj = OldSpy()
+        obj.instance_attribute = 2
+        names = inspection.static_attributes(obj)
+        self.assertTrue(set(['attribute', 'instance_attribute',
+                             '__class__']).issubset(names))
+
+    def test_class(self):
+        names = inspection.static_attributes(Spy)
+        self.assertIn('attribute', names)
+        self.assertIn('mro', names)
+        self.assertNotIn('instance_attribute', names)
+
+    def test_module(self):
+        names = inspection.static_attributes(unittest)
+        self.assertIn('TestCase', names)
+        self.assertIn('__name__', names)
+
+    def test_class_attributes_are_cached(self):
+        class Klass(object):
+            pass
+
+        names = inspection.class_attributes(Klass)
+        self.assertIs(inspection.class_attributes(Klass), names)
+        Klass.added = 1
+        self.assertIn('added', inspection.class_attributes(Klass))
+
+    def test_class_attributes_replaced(self):
+        class Klass(object):
+            a = 1
+
+        class Old:
+            a = 1
+
+        for klass in (Klass, Old):
+            self.assertIn('a', inspection.class_attributes(klass))
+            del klass.a
+            klass.b = 2
+            names = inspection.class_attributes(klass)
+            self.assertNotIn('a', names)
+            self.assertIn('b', names)
+
+    def test_has_attribute_hooks(self):
+        class Plain(object):
+            pass
+
+        self.assertTrue(inspection.has_attribute_hooks(Spy()))
+        self.assertTrue(inspection.has_attribute_hooks(OldSpy()))
+        self.assertFalse(inspection.has_attribute_hooks(Plain()))
+        self.assertFalse(inspection.has_attribute_hooks(Plain))
+        self.assertFalse(inspection.has_attribute_hooks(unittest))
+        self.assertFalse(inspection.has_attribute_hooks(1))
+
+    def test_is_callable_static(self):
+        class OldCallable(OldSpy):
+            def __call__(self):
+                pass
+
+        self.assertTrue(inspection.is_callable_static(OldCallable()))
+        self.assertFalse(inspection.is_callable_static(OldSpy()))
+        self.assertFalse(inspection.is_callable_static(Spy()))
+        self.assertTrue(inspection.is_callable_static(Spy))
+
+
 if __name__ == '__main__':
     unittest.main()
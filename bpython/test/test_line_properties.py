@@ -1,7 +1,9 @@
+import mock
 import unittest
 import re
 
 from bpython.line import current_word, current_dict_key, current_dict, current_string, current_object, current_object_attribute, current_from_import_from, current_from_import_import, current_import, current_method_definition_name, current_single_word, current_string_literal_attr
+from bpython import line as line_module
 
 
 def cursor(s):
@@ -134,6 +136,10 @@ class TestCurrentDictKey(LineTestCase):
         #TODO self.assertAccess('d[d[<12|>')
         self.assertAccess("d[<'a>|")
 
+    def test_key_contains_names(self):
+        self.assertAccess('a[<b, c|>[d')
+        self.assertAccess('a[b, c[d|')
+
 class TestCurrentDict(LineTestCase):
     def setUp(self):
         self.func = current_dict
@@ -167,6 +173,11 @@ class TestCurrentString(LineTestCase):
         self.assertAccess('"""<asdf|>')
         self.assertAccess('asdf.afd("a") + "<asdf|>')
 
+    def test_empty_triple_quote(self):
+        self.assertAccess('"<|">"')
+        self.assertAccess('"""|')
+        self.assertAccess('"""<a|">')
+
 class TestCurrentObject(LineTestCase):
     def setUp(self):
         self.func = current_object
@@ -265,5 +276,65 @@ class TestCurrentStringLiteral(LineTestCase):
         self.assertAccess('"hey".asdf d|')
         self.assertAccess('"hey".<|>')
 
+    def test_escapes(self):
+        self.assertAccess(r'"a\"b".<x|>')
+        self.assertAccess(r'"a\\".<x|>')
+        self.assertAccess('"a\'b".<x|>')
+        self.assertAccess("'''a''b'''.<x|>")
+        self.assertAccess("'a\\\n'.x|")
+
+class TestLineContext(unittest.TestCase):
+    parts = ['current_word', 'current_dict_key', 'current_dict',
+             'current_string', 'current_from_import_from',
+             'current_from_import_import', 'current_import',
+             'current_method_definition_name', 'current_single_word',
+             'current_dotted_attribute', 'current_string_literal_attr']
+
+    def test_same_as_functions(self):
+        for line in ['foo.bar|', 'd["a|"]', 'from a.b import <c|', 'import os|',
+                     '"hey".ab|', 'def foo|(x):', 'x = y|', '|']:
+            cursor_offset, line = cursor(line)
+            context = line_module.LineContext(cursor_offset, line)
+            for name in self.parts:
+                self.assertEqual(getattr(context, name)(),
+                                 getattr(line_module, name)(cursor_offset,
+                                                            line),
+                                 (name, line))
+
+    def test_parts_are_looked_for_once(self):
+        context = line_module.LineContext(7, 'foo.bar')
+        with mock.patch.object(line_module, 'current_word',
+                               wraps=line_module.current_word) as word:
+            context.current_word()
+            context.current_dotted_attribute()
+        self.assertEqual(word.call_count, 1)
+
+    def test_context_is_reused(self):
+        context = line_module.context(3, 'foo')
+        self.assertIs(line_module.context(3, 'foo'), context)
+        self.assertIsNot(line_module.context(2, 'foo'), context)
+
+class TestLineScanner(unittest.TestCase):
+
+    def test_scanner_is_reused(self):
+        scanner = line_module.scanner('foo')
+        self.assertIs(line_module.scanner('foo'), scanner)
+        self.assertIsNot(line_module.scanner('bar'), scanner)
+
+    def test_line_is_scanned_once(self):
+        scanner = line_module.LineScanner('foo.bar baz')
+        with mock.patch.object(scanner, '_find_words',
+                               wraps=scanner._find_words) as find:
+            self.assertEqual(scanner.current_word(3), (0, 7, 'foo.bar'))
+            self.assertEqual(scanner.current_word(10), (8, 11, 'baz'))
+        self.assertEqual(find.call_count, 1)
+
+    def test_long_lines(self):
+        # Lines the regular expressions used to backtrack over
+        for line in ['a' * 10000, 'a.' * 5000, '"' + "\\'" * 5000]:
+            self.assertIsNone(current_dict_key(len(line), line))
+            self.assertIsNone(current_string_literal_attr(len(line), line))
+
+
 if __name__ == '__main__':
     unittest.main()
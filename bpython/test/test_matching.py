@@ -0,0 +1,122 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from bpython import matching
+from bpython.matching import SIMPLE, SUBSTRING, FUZZY
+
+
+class TestIsMatch(unittest.TestCase):
+
+    def test_simple(self):
+        self.assertTrue(matching.is_match('foobar', 'foo', SIMPLE))
+        self.assertFalse(matching.is_match('foobar', 'bar', SIMPLE))
+
+    def test_substring(self):
+        self.assertTrue(matching.is_match('foobar', 'oba', SUBSTRING))
+        self.assertFalse(matching.is_match('foobar', 'fbr', SUBSTRING))
+
+    def test_fuzzy(self):
+        self.assertTrue(matching.is_match('foobar', 'fbr', FUZZY))
+        self.assertFalse(matching.is_match('foobar', 'rb', FUZZY))
+        self.assertFalse(matching.is_match('foobar', 'Fbr', FUZZY))
+
+
+class TestRank(unittest.TestCase):
+
+    def test_simple_sorts(self):
+        self.assertEqual(matching.rank(['b', 'ab', 'a'], 'a', SIMPLE),
+                         ['a', 'ab', 'b'])
+
+    def test_substring(self):
+        names = ['xfoox', 'x_foo', 'foo_long', 'foo']
+        self.assertEqual(matching.rank(names, 'foo', SUBSTRING),
+                         ['foo', 'foo_long', 'x_foo', 'xfoox'])
+
+    def test_fuzzy(self):
+        names = ['fxoxo', 'foo', 'fx_oo', 'xfoo', 'f_o_o']
+        self.assertEqual(matching.rank(names, 'foo', FUZZY),
+                         ['foo', 'xfoo', 'f_o_o', 'fx_oo', 'fxoxo'])
+
+    def test_key(self):
+        self.assertEqual(matching.rank(['a.xb(', 'a.b('], 'b', FUZZY,
+                                       key=lambda m: m[2:-1]),
+                         ['a.b(', 'a.xb('])
+
+    def test_limit(self):
+        names = ['fxoxo', 'foo', 'fx_oo', 'xfoo', 'f_o_o', 'foo_long', 'x_foo',
+                 'afoo', 'f_oo', 'of_o_o', 'zfo_o']
+        for limit in range(len(names) + 1):
+            ranked = matching.rank(names, 'foo', FUZZY, limit=limit)
+            self.assertEqual(ranked[:limit],
+                             matching.rank(names, 'foo', FUZZY)[:limit])
+            self.assertEqual(ranked[limit:], sorted(ranked[limit:]))
+            self.assertEqual(sorted(ranked), sorted(names))
+
+    def test_limit_with_key(self):
+        names = ['a.xb(', 'a.b(', 'a.cb', 'a.x_b']
+        self.assertEqual(matching.rank(names, 'b', SUBSTRING,
+                                       key=lambda m: m[2:].rstrip('('),
+                                       limit=2),
+                         ['a.b(', 'a.x_b', 'a.cb', 'a.xb('])
+
+
+class TestMatchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.names = ['get_value', 'getvalue', 'set_value', 'values',
+                      'ValueError', 'vlue', 'get', u'valu\xe9']
+        self.index = matching.MatchIndex(self.names)
+
+    def test_simple(self):
+        self.assertEqual(self.index.matches('get', SIMPLE),
+                         ['get', 'get_value', 'getvalue'])
+        self.assertEqual(self.index.matches('', SIMPLE), sorted(self.names))
+
+    def test_same_matches_as_filter(self):
+        for mode in (SUBSTRING, FUZZY):
+            for text in ('val', 'gv', 'lue', 'e', 'V', 'zz', 'ue_', u'\xe9'):
+                self.assertEqual(
+                    self.index.matches(text, mode),
+                    sorted(matching.filter_names(self.names, text, mode)))
+
+    def test_fuzzy(self):
+        self.assertEqual(self.index.matches('gvl', FUZZY),
+                         ['get_value', 'getvalue'])
+
+    def test_postings_are_reused(self):
+        index = matching.MatchIndex(self.names +
+                                    ['x%d' % i for i in range(40)])
+        index.matches('va', SUBSTRING)
+        self.assertEqual(index._postings,
+                         {'va': ['get_value', 'getvalue', 'set_value',
+                                 'values', u'valu\xe9']})
+        self.assertEqual(index.matches('val', SUBSTRING),
+                         ['get_value', 'getvalue', 'set_value', 'values',
+                          u'valu\xe9'])
+        self.assertEqual(list(index._postings), ['va'])
+
+    def test_postings_are_limited(self):
+        self.index.max_postings = 2
+        for text in ('ab', 'cd', 'ef'):
+            self.index.matches(text, SUBSTRING)
+        self.assertEqual(sorted(self.index._postings), ['cd', 'ef'])
+
+    def test_add_and_remove(self):
+        self.index.matches('val', SUBSTRING)
+        self.index.add('interval')
+        self.index.add('get')
+        self.index.remove('vlue')
+        self.index.remove('missing')
+        self.assertIn('interval', self.index)
+        self.assertNotIn('vlue', self.index)
+        self.assertEqual(self.index.matches('v', SIMPLE),
+                         ['values', u'valu\xe9'])
+        self.assertEqual(self.index.matches('vl', FUZZY),
+                         ['get_value', 'getvalue', 'interval', 'set_value',
+                          'values', u'valu\xe9'])
+
+
+if __name__ == '__main__':
+    unittest.main()
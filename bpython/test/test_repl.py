@@ -13,7 +13,10 @@ except ImportError:
 
 py3 = (sys.version_info[0] == 3)
 
+from pygments.token import Token
+
 from bpython import config, repl, cli, autocomplete
+from bpython.formatter import Parenthesis
 
 
 def setup_config(conf):
@@ -103,6 +106,18 @@ class TestMatchesIterator(unittest.TestCase):
         self.assertNotEqual(list(slice), self.matches)
         self.assertEqual(list(newslice), newmatches)
 
+    def test_max_width(self):
+        format = Mock(side_effect=lambda match: match + '()')
+        self.assertEqual(self.matches_iterator.max_width(format), 11)
+        self.assertEqual(self.matches_iterator.max_width(format), 11)
+        self.assertEqual(format.call_count, 3)
+        self.assertEqual(self.matches_iterator.max_width(), 9)
+
+        completer = Mock()
+        completer.locate.return_value = (0, 1, 's')
+        self.matches_iterator.update(1, 's', ['string', 'str'], completer)
+        self.assertEqual(self.matches_iterator.max_width(format), 8)
+
     def test_cur_line(self):
         completer = Mock()
         completer.locate.return_value = (0,
@@ -119,6 +134,21 @@ class TestMatchesIterator(unittest.TestCase):
     def test_is_cseq(self):
         self.assertTrue(self.matches_iterator.is_cseq())
 
+    def test_cseq_of_substring_matches(self):
+        completer = Mock()
+        completer.locate.return_value = (0, 4, 'word')
+        self.matches_iterator.update(4, 'word', ['abcdeword', 'abcdefword'],
+                                     completer)
+        self.assertFalse(self.matches_iterator.is_cseq())
+        self.assertEqual(self.matches_iterator.substitute_cseq(), (4, 'word'))
+
+    def test_cseq_of_one_fuzzy_match(self):
+        completer = Mock()
+        completer.locate.return_value = (0, 2, 'vl')
+        self.matches_iterator.update(2, 'vl', ['value'], completer)
+        self.assertTrue(self.matches_iterator.is_cseq())
+        self.assertEqual(self.matches_iterator.substitute_cseq(), (5, 'value'))
+
 
 class TestArgspec(unittest.TestCase):
     def setUp(self):
@@ -262,25 +292,23 @@ class TestRepl(unittest.TestCase):
         self.assertEqual(self.repl.matches_iter.matches,
             ['def', 'del', 'delattr(', 'dict(', 'dir(', 'divmod('])
 
-    @unittest.skip("disabled while non-simple completion is disabled")
     def test_substring_global_complete(self):
         self.repl = FakeRepl({'autocomplete_mode': autocomplete.SUBSTRING})
         self.setInputLine("time")
 
         self.assertTrue(self.repl.complete())
-        self.assertTrue(hasattr(self.repl.completer,'matches'))
-        self.assertEqual(self.repl.completer.matches,
+        self.assertTrue(hasattr(self.repl.matches_iter,'matches'))
+        self.assertEqual(self.repl.matches_iter.matches,
             ['RuntimeError(', 'RuntimeWarning('])
 
-    @unittest.skip("disabled while non-simple completion is disabled")
     def test_fuzzy_global_complete(self):
         self.repl = FakeRepl({'autocomplete_mode': autocomplete.FUZZY})
         self.setInputLine("doc")
 
         self.assertTrue(self.repl.complete())
-        self.assertTrue(hasattr(self.repl.completer,'matches'))
-        self.assertEqual(self.repl.completer.matches,
-            ['UnboundLocalError(', '__doc__'])
+        self.assertTrue(hasattr(self.repl.matches_iter,'matches'))
+        self.assertEqual(self.repl.matches_iter.matches,
+            ['__doc__', 'UnboundLocalError('])
 
     # 2. Attribute tests
     def test_simple_attribute_complete(self):
@@ -296,7 +324,6 @@ class TestRepl(unittest.TestCase):
         self.assertEqual(self.repl.matches_iter.matches,
             ['Foo.bar'])
 
-    @unittest.skip("disabled while non-simple completion is disabled")
     def test_substring_attribute_complete(self):
         self.repl = FakeRepl({'autocomplete_mode': autocomplete.SUBSTRING})
         self.setInputLine("Foo.az")
@@ -306,11 +333,10 @@ class TestRepl(unittest.TestCase):
             self.repl.push(line)
 
         self.assertTrue(self.repl.complete())
-        self.assertTrue(hasattr(self.repl.completer,'matches'))
-        self.assertEqual(self.repl.completer.matches,
+        self.assertTrue(hasattr(self.repl.matches_iter,'matches'))
+        self.assertEqual(self.repl.matches_iter.matches,
             ['Foo.baz'])
 
-    @unittest.skip("disabled while non-simple completion is disabled")
     def test_fuzzy_attribute_complete(self):
         self.repl = FakeRepl({'autocomplete_mode': autocomplete.FUZZY})
         self.setInputLine("Foo.br")
@@ -320,8 +346,8 @@ class TestRepl(unittest.TestCase):
             self.repl.push(line)
 
         self.assertTrue(self.repl.complete())
-        self.assertTrue(hasattr(self.repl.completer,'matches'))
-        self.assertEqual(self.repl.completer.matches,
+        self.assertTrue(hasattr(self.repl.matches_iter,'matches'))
+        self.assertEqual(self.repl.matches_iter.matches,
             ['Foo.bar'])
 
     # 3. Edge Cases
@@ -343,6 +369,110 @@ class TestRepl(unittest.TestCase):
         self.assertNotIn('__file__', self.repl.matches_iter.matches)
 
 
+class TestLineTokens(unittest.TestCase):
+
+    def setUp(self):
+        self.line_tokens = repl.LineTokens()
+
+    def test_same_tokens_as_block(self):
+        lines = ['def f(x):', '    return [x,', '            "a"]']
+        block = [[]]
+        source = '\n'.join(lines)
+        for token in repl.split_lines(repl.PythonLexer().get_tokens(source)):
+            if token == (Token.Text, '\n'):
+                block.append([])
+            else:
+                block[-1].append(token)
+        self.assertEqual(self.line_tokens.tokens(lines), block[:len(lines)])
+
+    def test_state_carries_over(self):
+        tokens = self.line_tokens.tokens(['x = """abc', 'def"""'])
+        self.assertEqual(tokens[1][:2],
+                         [(Token.Literal.String.Double, 'def'),
+                          (Token.Literal.String.Double, '"""')])
+
+    def test_only_changed_lines_are_lexed(self):
+        lines = ['def f(x):', '    return [x,', '            "a"']
+        self.line_tokens.tokens(lines)
+        lex = self.line_tokens.lex = Mock(wraps=self.line_tokens.lex)
+        self.line_tokens.tokens(lines[:2] + ['            "b"'])
+        self.assertEqual(lex.call_count, 1)
+        self.line_tokens.tokens(lines[:2] + ['            "b"', ''])
+        self.assertEqual(lex.call_count, 2)
+
+    def test_changed_state_lexes_following_lines(self):
+        self.line_tokens.tokens(['x = 1', 'y = 2'])
+        tokens = self.line_tokens.tokens(['x = """', 'y = 2'])
+        self.assertEqual(tokens[1][0], (Token.Literal.String.Double, 'y = 2'))
+
+
+class TestBracketIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.line_tokens = repl.LineTokens()
+        self.brackets = repl.BracketIndex()
+
+    def open_brackets(self, lines):
+        return self.brackets.open_brackets(self.line_tokens.tokens(lines))
+
+    def test_open_brackets(self):
+        self.assertEqual(self.open_brackets(['f(x, [1,', '2], {']),
+                         ((0, 1, '('), (1, 4, '{')))
+
+    def test_closing_bracket_drops_inner_brackets(self):
+        self.assertEqual(self.open_brackets(['f([{', ')']), ())
+
+    def test_closing_bracket_without_opening_one(self):
+        self.assertEqual(self.open_brackets(['f(', ']']), ((0, 1, '('), ))
+        self.assertEqual(self.open_brackets([')', 'f(']), None)
+
+    def test_only_changed_lines_are_matched(self):
+        lines = ['f(x,', '  y,', '  z']
+        self.open_brackets(lines)
+        match = self.brackets.match = Mock(wraps=self.brackets.match)
+        self.open_brackets(lines[:2] + ['  w'])
+        self.assertEqual(match.call_count, 1)
+        # The brackets open at the start of the following lines changed
+        self.open_brackets(['g(x),'] + lines[1:])
+        self.assertEqual(match.call_count, 4)
+
+
+class TestTokenize(unittest.TestCase):
+
+    def setUp(self):
+        self.repl = FakeRepl()
+        self.repl.reprint_line = Mock()
+
+    def test_paren_on_previous_line(self):
+        self.repl.buffer = ['foo(1,']
+        self.repl.cpos = 0
+        tokens = self.repl.tokenize('2)')
+        self.assertEqual(tokens[-1], (Parenthesis, ')'))
+        lineno, saved = self.repl.highlighted_paren
+        self.assertEqual(lineno, 0)
+        self.assertIn((Token.Punctuation, '('), saved)
+        line, tokens = self.repl.reprint_line.call_args[0]
+        self.assertEqual(line, 0)
+        self.assertIn((Parenthesis, '('), tokens)
+
+    def test_typing_in_long_block(self):
+        self.repl.buffer = ['def f():'] + ['    x = %d' % i for i in range(50)]
+        self.repl.cpos = 0
+        self.repl.tokenize('    retur')
+        self.repl.line_tokens.lex = Mock(wraps=self.repl.line_tokens.lex)
+        tokens = self.repl.tokenize('    return')
+        self.assertEqual(self.repl.line_tokens.lex.call_count, 1)
+        self.assertEqual(tokens, [(Token.Text, '    '),
+                                  (Token.Keyword, 'return')])
+
+    def test_unbalanced_block(self):
+        self.repl.buffer = [')']
+        self.repl.cpos = 0
+        self.assertEqual(self.repl.tokenize('()'),
+                         [(Token.Punctuation, '('), (Token.Punctuation, ')')])
+        self.assertEqual(self.repl.highlighted_paren, None)
+
+
 class TestCliRepl(unittest.TestCase):
 
     def setUp(self):
@@ -393,19 +523,24 @@ class TestCliReplTab(unittest.TestCase):
         self.repl.complete.assert_called_with(tab=True)
         self.assertEqual(self.repl.s, "foobar")
 
-    @unittest.skip("disabled while non-simple completion is disabled")
+    def setUpCompletion(self, mode):
+        FakeRepl.__init__(self.repl, {'autocomplete_mode': mode})
+        self.repl.s = ""
+        self.repl.paste_mode = False
+        self.repl.scr = Mock()
+        self.repl.print_line = Mock()
+        self.repl.show_list = Mock()
+        self.repl.interp.locals['foobar'] = 2
+
     def test_substring_tab_complete(self):
+        self.setUpCompletion(autocomplete.SUBSTRING)
         self.repl.s = "bar"
-        self.repl.config.autocomplete_mode = autocomplete.FUZZY
         self.repl.tab()
         self.assertEqual(self.repl.s, "foobar")
-        self.repl.tab()
-        self.assertEqual(self.repl.s, "foofoobar")
 
-    @unittest.skip("disabled while non-simple completion is disabled")
     def test_fuzzy_tab_complete(self):
-        self.repl.s = "br"
-        self.repl.config.autocomplete_mode = autocomplete.FUZZY
+        self.setUpCompletion(autocomplete.FUZZY)
+        self.repl.s = "fobr"
         self.repl.tab()
         self.assertEqual(self.repl.s, "foobar")
 
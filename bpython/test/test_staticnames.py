@@ -0,0 +1,237 @@
+import mock
+import os
+import shutil
+import sys
+import tempfile
+import textwrap
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from bpython import autocomplete
+from bpython import staticnames
+
+
+class TestExtractNames(unittest.TestCase):
+
+    def test_top_level_names(self):
+        source = textwrap.dedent("""
+            import os, os.path as osp
+            from sys import argv as args, path
+            from itertools import *
+            a = b, (c, d) = 1, (2, 3)
+            e += 1
+            def f():
+                g = 1
+            class H(object):
+                i = 1
+            try:
+                import json
+            except ImportError:
+                json = None
+            if True:
+                j = 1
+            else:
+                def k(): pass
+            for l in range(3):
+                pass
+            """)
+        self.assertEqual(staticnames.extract_names(source),
+                         ['H', 'a', 'args', 'b', 'c', 'd', 'e', 'f', 'j',
+                          'json', 'k', 'os', 'osp', 'path'])
+
+    def test_all(self):
+        source = textwrap.dedent("""
+            __all__ = ['a', 'b', 'not valid', 1]
+            from _impl import *
+            """)
+        self.assertEqual(staticnames.extract_names(source),
+                         ['__all__', 'a', 'b'])
+
+    def test_syntax_error(self):
+        self.assertRaises(SyntaxError, staticnames.extract_names, 'def (')
+
+
+class TestFindSource(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'zzpkg', 'sub'))
+        os.makedirs(os.path.join(self.tmpdir, 'zznotpkg'))
+        for filename in ('zzmod.py', os.path.join('zzpkg', '__init__.py'),
+                         os.path.join('zzpkg', 'a.py'),
+                         os.path.join('zzpkg', 'sub', '__init__.py'),
+                         os.path.join('zznotpkg', 'b.py')):
+            open(os.path.join(self.tmpdir, filename), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def find(self, name):
+        filename = staticnames.find_source(name, [self.tmpdir])
+        if filename is not None:
+            return os.path.relpath(filename, self.tmpdir)
+
+    def test_modules(self):
+        self.assertEqual(self.find('zzmod'), 'zzmod.py')
+        self.assertEqual(self.find('zzpkg.a'), os.path.join('zzpkg', 'a.py'))
+
+    def test_packages(self):
+        self.assertEqual(self.find('zzpkg'),
+                         os.path.join('zzpkg', '__init__.py'))
+        self.assertEqual(self.find('zzpkg.sub'),
+                         os.path.join('zzpkg', 'sub', '__init__.py'))
+
+    def test_cached_results(self):
+        with mock.patch.object(sys, 'path', [self.tmpdir]):
+            with mock.patch.object(staticnames, '_sources', dict()):
+                filename = staticnames.cached_find_source('zzpkg.a')
+                self.assertEqual(staticnames.cached_find_source('zzmissing'),
+                                 None)
+                with mock.patch.object(staticnames, 'find_source') as find:
+                    self.assertEqual(
+                        staticnames.cached_find_source('zzpkg.a'), filename)
+                    self.assertEqual(
+                        staticnames.cached_find_source('zzmissing'), None)
+                self.assertFalse(find.called)
+                os.remove(filename)
+                self.assertEqual(staticnames.cached_find_source('zzpkg.a'),
+                                 None)
+
+    def test_missing(self):
+        self.assertEqual(self.find('zzmissing'), None)
+        self.assertEqual(self.find('zzmod.a'), None)
+        self.assertEqual(self.find('zznotpkg.b'), None)
+        self.assertEqual(self.find('zzpkg..a'), None)
+
+
+class TestNameCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.filename = os.path.join(self.tmpdir, 'zzmod.py')
+        with open(self.filename, 'w') as f:
+            f.write('def foo(): pass\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_names_are_cached_on_disk(self):
+        cache = staticnames.NameCache(self.cache_dir, threaded=False)
+        self.assertEqual(cache.get(self.filename), ['foo'])
+        cache = staticnames.NameCache(self.cache_dir, threaded=False)
+        with mock.patch.object(staticnames, 'names_from_file') as parse:
+            self.assertEqual(cache.get(self.filename), ['foo'])
+        self.assertFalse(parse.called)
+
+    def test_changed_file_is_parsed(self):
+        cache = staticnames.NameCache(self.cache_dir, threaded=False)
+        cache.get(self.filename)
+        with open(self.filename, 'w') as f:
+            f.write('def bar(): pass\n')
+        os.utime(self.filename, (0, 0))
+        self.assertEqual(cache.get(self.filename), ['bar'])
+
+    def test_broken_file(self):
+        with open(self.filename, 'w') as f:
+            f.write('def (')
+        cache = staticnames.NameCache(None, threaded=False)
+        self.assertEqual(cache.get(self.filename), [])
+
+    def test_parse_thread(self):
+        cache = staticnames.NameCache(self.cache_dir)
+        try:
+            self.assertEqual(cache.get(self.filename, 10), ['foo'])
+        finally:
+            cache.close()
+
+    def test_parser_process(self):
+        cache = staticnames.NameCache(self.cache_dir)
+        cache.start()
+        try:
+            self.assertNotEqual(cache.process, None)
+            with mock.patch.object(staticnames, 'names_from_file') as parse:
+                self.assertEqual(cache.get(self.filename, 10), ['foo'])
+            self.assertFalse(parse.called)
+        finally:
+            cache.close()
+
+    def test_dead_parser_process(self):
+        cache = staticnames.NameCache(None)
+        cache.start()
+        try:
+            cache.process.kill()
+            cache.process.wait()
+            self.assertEqual(cache.get(self.filename, 10), ['foo'])
+        finally:
+            cache.close()
+
+    def test_prune_cache(self):
+        cache = staticnames.NameCache(self.cache_dir, threaded=False)
+        other = os.path.join(self.tmpdir, 'zzother.py')
+        with open(other, 'w') as f:
+            f.write('bar = 1\n')
+        cache.get(self.filename)
+        cache.get(other)
+        os.remove(other)
+        staticnames.prune_cache(self.cache_dir)
+        self.assertEqual(os.listdir(self.cache_dir),
+                         [os.path.basename(cache._cache_file(self.filename))])
+        staticnames.prune_cache(self.cache_dir, 0)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_slow_parse_goes_on_in_background(self):
+        cache = staticnames.NameCache(None)
+        parsed = staticnames.threading.Event()
+
+        def names_from_file(filename):
+            parsed.wait(10)
+            return ['foo']
+
+        with mock.patch.object(staticnames, 'names_from_file',
+                               names_from_file):
+            try:
+                self.assertEqual(cache.get(self.filename, 0.01), None)
+                parsed.set()
+                self.assertEqual(cache.get(self.filename, 10), ['foo'])
+            finally:
+                cache.close()
+
+
+class TestStaticImportCompletion(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        with open(os.path.join(self.tmpdir, 'zzmod.py'), 'w') as f:
+            f.write('def foo(): pass\nfoobar = 1\nbaz = 2\n')
+        self.path = mock.patch.object(sys, 'path', [self.tmpdir])
+        self.path.start()
+        self.cache = mock.patch.object(
+            staticnames, 'cache', staticnames.NameCache(None, threaded=False))
+        self.cache.start()
+        self.completer = autocomplete.StaticImportCompletion()
+
+    def tearDown(self):
+        self.cache.stop()
+        self.path.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_from_import(self):
+        self.assertEqual(self.completer.matches(20, 'from zzmod import fo'),
+                         set(['foo', 'foobar']))
+
+    def test_not_applicable(self):
+        self.assertEqual(self.completer.matches(11, 'import zzmo'), None)
+        self.assertEqual(self.completer.matches(10, 'from zzmo'), None)
+        self.assertEqual(self.completer.matches(18, 'from sys import ar'),
+                         None)
+
+    def test_get_completer(self):
+        matches, completer = autocomplete.get_completer_bpython(
+            cursor_offset=19, line='from zzmod import b', locals_={},
+            argspec=None, current_block='', complete_magic_methods=True)
+        self.assertEqual(matches, ['baz'])
+        self.assertIsInstance(completer, autocomplete.StaticImportCompletion)
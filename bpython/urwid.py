@@ -48,7 +48,8 @@ from pygments.token import Token
 from bpython import args as bpargs, repl, translations
 from bpython._py3compat import py3
 from bpython.formatter import theme_map
-from bpython.importcompletion import find_coroutine
+from bpython import importcompletion
+from bpython import staticnames
 from bpython.translations import _
 
 from bpython.keys import urwid_key_dispatch as key_dispatch
@@ -1302,14 +1303,8 @@ def main(args=None, locals_=None, banner=None):
             myrepl.write(banner)
             myrepl.write('\n')
         myrepl.start()
-
-        # This bypasses main_loop.set_alarm_in because we must *not*
-        # hit the draw_screen call (it's unnecessary and slow).
-        def run_find_coroutine():
-            if find_coroutine():
-                main_loop.event_loop.alarm(0, run_find_coroutine)
-
-        run_find_coroutine()
+        staticnames.cache.start()
+        importcompletion.start_scan(config.module_indexing)
 
     myrepl.main_loop.screen.run_wrapper(run_with_screen_before_mainloop)
 